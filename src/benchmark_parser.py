@@ -0,0 +1,133 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+
+from utils import parse_function_call, parse_function_calls, ParseErrorCode
+
+FC = '<|im_start|>assistant\n<functioncall> {{"name": "{}", "arguments": "{}"}} <|im_end|><|endoftext|>'
+
+# Hand-written cases around the model_data corpus: (response, expected fn_name, expected properties or error code)
+EDGE_CASES = [
+    (FC.format("play_music", "{'track': \\\"Don't Stop Me Now\\\"}"), "play_music", {"track": "Don't Stop Me Now"}),
+    (FC.format("play_music", "{'track': 'True Colors'}"), "play_music", {"track": "True Colors"}),
+    (FC.format("play_music", "{'track': 'False Alarm', 'shuffle': False}"), "play_music", {"track": "False Alarm", "shuffle": False}),
+    (FC.format("lock_doors", "{\\\"lock\\\": true}"), "lock_doors", {"lock": True}),
+    (FC.format("set_temperature", "{'temperature': 21.5, 'area': ['driver', 'passenger']}"), "set_temperature",
+     {"temperature": 21.5, "area": ["driver", "passenger"]}),
+    (FC.format("start_engine", ""), "start_engine", {}),
+    ('<|im_start|>assistant\n<functioncall> {"name": "start_engine"} <|im_end|>', "start_engine", {}),
+    ('<|im_start|>assistant\nI cannot do that.<|im_end|>', None, ParseErrorCode.DELIMITERS_NOT_FOUND),
+    ('<|im_start|>assistant\n<functioncall> {"name": "lock_doors", "argu', None, ParseErrorCode.TRUNCATED),
+    ('<|im_start|>assistant\n<functioncall> {"name": "start_engine", "arguments": "{}"}', None, ParseErrorCode.TRUNCATED),
+    ('<|im_start|>assistant\n<functioncall> {"name": "start_engine"} extra <|im_end|>', None, ParseErrorCode.INVALID_CALL_JSON),
+    ('<|im_start|>assistant\n<functioncall> {"name": "lock_doors", "argu <|im_end|>', None, ParseErrorCode.INVALID_CALL_JSON),
+    ('<|im_start|>assistant\n<functioncall> {"arguments": "{}"} <|im_end|>', None, ParseErrorCode.MISSING_NAME),
+    (FC.format("lock_doors", "{'lock': }"), None, ParseErrorCode.INVALID_ARGUMENTS),
+    (FC.format("lock_doors", "['lock']"), None, ParseErrorCode.ARGUMENTS_NOT_DICT),
+]
+
+
+def legacy_convert_command(command):
+    """The previous utils.convert_command (delimiter search, three str.replace passes, two json.loads)."""
+    try:
+        start_delim = '<functioncall> '
+        end_delim = '<|im_end|>'
+        start_idx = command.find(start_delim) + len(start_delim)
+        end_idx = command.find(end_delim)
+        if start_idx == -1 or end_idx == -1:
+            return {"error": "Delimiters not found"}
+        function_call_dict = json.loads(command[start_idx:end_idx])
+        arguments = function_call_dict.get('arguments', '{}')
+        arguments = arguments.replace("'", '"').replace('True', 'true').replace('False', 'false')
+        return {'fn_name': function_call_dict.get('name'), 'properties': json.loads(arguments)}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def load_corpus(data_dir):
+    """Assistant responses of every JSON file of the model data directory."""
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.json"))):
+        with open(path, "r") as f:
+            corpus.extend(sample["assistant"] for sample in json.load(f))
+    return corpus
+
+
+def check_corpus(corpus):
+    """Compares the parser with the legacy one on the corpus; returns the disagreeing responses."""
+    return [
+        command for command in corpus
+        if parse_function_call(command) != legacy_convert_command(command)
+    ]
+
+
+def check_edge_cases():
+    failures = []
+    for command, fn_name, expected in EDGE_CASES:
+        result = parse_function_call(command)
+        if isinstance(expected, ParseErrorCode):
+            ok = result.get("error_code") == expected.value
+        else:
+            ok = result.get("fn_name") == fn_name and result.get("properties") == expected
+        if not ok:
+            failures.append((command, expected, result))
+    return failures
+
+
+def time_per_sample(parsers, corpus, repeat):
+    """
+    Microseconds per sample of each (name, fn) parser: the fastest of repeat passes, with the
+    parsers taking turns pass by pass so background load affects them alike.
+    """
+    best = {name: float("inf") for name, _ in parsers}
+    for _ in range(repeat):
+        for name, fn in parsers:
+            start_time = time.perf_counter()
+            fn(corpus)
+            best[name] = min(best[name], time.perf_counter() - start_time)
+    return {name: elapsed / len(corpus) * 1e6 for name, elapsed in best.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Correctness corpus and microbenchmark of the function-call output parser.")
+    parser.add_argument('--data_dir', type=str, default=os.path.join(os.path.dirname(__file__), "data", "model_data"),
+                        help='Directory of the training / test JSON files the corpus is drawn from.')
+    parser.add_argument('--repeat', type=int, default=20, help='Passes over the corpus per timing, the fastest one is reported.')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.data_dir)
+    print(f"Corpus: {len(corpus)} responses from {args.data_dir}, {len(EDGE_CASES)} edge cases")
+
+    disagreements = check_corpus(corpus)
+    print(f"Disagreements with the legacy parser on the corpus: {len(disagreements)}")
+    for command in disagreements[:10]:
+        print(f"  {command!r}\n    new:    {parse_function_call(command)}\n    legacy: {legacy_convert_command(command)}")
+
+    failures = check_edge_cases()
+    print(f"Edge case failures: {len(failures)}")
+    for command, expected, result in failures:
+        print(f"  {command!r}\n    expected: {expected}\n    got:      {result}")
+    legacy_failures = sum(
+        legacy_convert_command(command).get("properties") != expected
+        for command, _, expected in EDGE_CASES if not isinstance(expected, ParseErrorCode)
+    )
+    print(f"Edge cases the legacy parser gets wrong: {legacy_failures}")
+
+    print(f"\n{'parser':<10} {'us/sample':>10}  (best of {args.repeat} passes; batch memoizes duplicate responses)")
+    timings = time_per_sample([
+        ("legacy", lambda c: [legacy_convert_command(x) for x in c]),
+        ("single", lambda c: [parse_function_call(x) for x in c]),
+        ("batch", parse_function_calls),
+    ], corpus, args.repeat)
+    for name, us in timings.items():
+        print(f"{name:<10} {us:>10.2f}")
+
+    if disagreements or failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 from enum import Enum
 
 
+# Fixed system prompt shared by the training data and inference. Inference reuses its KV-cache,
+# so any change here requires regenerating the training data and re-training.
+system_message = "<|im_start|>system\nYou are a helpful assistant. You have to either provide a way to answer user's request or answer user's query.\n<|im_end|>\n"
+
+
 functions = [
     {
         "name": "set_temperature",
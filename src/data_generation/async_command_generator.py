@@ -0,0 +1,396 @@
+import os
+import time
+import random
+import asyncio
+import argparse
+import itertools
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from generate_user_command import CommandGenerator, format_numbered, split_batch_results
+from llm_backends import add_backend_args, backend_options
+from user_command_config import CorrectCommandsOutput, IncompleteCommandOutput, \
+    BatchedCorrectCommandsOutput, BatchedIncompleteCommandsOutput, SampleCorrectnessJudgement
+
+
+def is_rate_limit_error(exc):
+    """Checks whether an exception raised by an LLM call is an HTTP 429."""
+    if getattr(exc, "status_code", None) == 429:
+        return True
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+def retry_after_seconds(exc):
+    """Returns the Retry-After delay suggested by the server, if any."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) used to charge the tokens/min bucket."""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Asyncio token bucket refilled continuously at rate_per_minute, holding at most capacity."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            async with self.lock:
+                self.refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate_per_second
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """Enforces both a requests/min and a tokens/min quota."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, num_tokens):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(num_tokens)
+
+
+class AsyncCommandGenerator(CommandGenerator):
+    """
+    Asyncio version of CommandGenerator.
+
+    Function calls are fed to max_concurrency worker tasks through a bounded queue and every
+    follow-up incomplete command request runs concurrently. Throughput is bounded by max_concurrency in-flight
+    requests and by the requests/min and tokens/min quotas, and HTTP 429s are retried with
+    exponential backoff instead of sleeping after a fixed number of requests.
+    """
+
+    def __init__(self, input_file, output_file, n=2, max_concurrency=8, requests_per_minute=60,
+                 tokens_per_minute=60000, completion_tokens=256, max_retries=6, base_delay=1.0, max_delay=60.0,
+                 cache_file=None, cache_max_entries=1000000, checkpoint_file=None, resume=False,
+                 prompt_batch_size=1, validation_file=None, llm_backend="azure", backend_options=None,
+                 overwrite_checkpoint=False):
+        """
+        :param max_concurrency: Maximum number of in-flight LLM requests.
+        :param requests_per_minute: Requests/min quota of the deployment.
+        :param tokens_per_minute: Tokens/min quota of the deployment.
+        :param completion_tokens: Completion tokens charged per request on top of the prompt estimate.
+        :param max_retries: Maximum number of retries of a request after a 429.
+        :param base_delay: First backoff delay in seconds, doubled on every retry.
+        :param max_delay: Upper bound of a single backoff delay in seconds.
+        :param cache_file: Optional SQLite file caching LLM responses across runs.
+        :param cache_max_entries: Maximum number of cached LLM responses.
+        :param checkpoint_file: Optional JSONL file every finished call is appended to.
+        :param resume: Skip the calls already in checkpoint_file instead of starting over.
+        :param prompt_batch_size: Number of function calls packed into one complete command request.
+        :param validation_file: Optional JSONL file every negative-sample judgement is appended to.
+        :param llm_backend: LLM backend to generate with ("azure" or the local "fake" backend).
+        :param backend_options: Extra options of the LLM backend (e.g. latency of the fake backend).
+        :param overwrite_checkpoint: Discard an existing checkpoint / validation log when not resuming,
+            instead of refusing to start.
+        """
+        super().__init__(input_file, output_file, n=n, max_threads=max_concurrency,
+                         cache_file=cache_file, cache_max_entries=cache_max_entries,
+                         checkpoint_file=checkpoint_file, resume=resume, prompt_batch_size=prompt_batch_size,
+                         validation_file=validation_file, llm_backend=llm_backend,
+                         backend_options=backend_options, overwrite_checkpoint=overwrite_checkpoint)
+        self.max_concurrency = max_concurrency
+        self.rate_limiter_config = (requests_per_minute, tokens_per_minute)
+        self.completion_tokens = completion_tokens
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limited_retries = 0
+
+    def initialize_llm(self, max_retries=0):
+        # Retries are handled here, with the rate limiter, instead of inside the client
+        super().initialize_llm(max_retries=max_retries)
+
+    def estimate_request_tokens(self, prompt_message, inputs):
+        prompt_text = " ".join(text for _, text in prompt_message) + " ".join(str(v) for v in inputs.values())
+        return estimate_tokens(prompt_text) + self.completion_tokens
+
+    async def ainvoke(self, chain, prompt_message, parser, inputs, llm=None):
+        """Invokes a chain through the LLM cache, then under the concurrency limit and quotas."""
+        if self.cache is None:
+            return await self.ainvoke_llm(chain, prompt_message, inputs)
+
+        key = self.cache_key(prompt_message, parser, inputs, llm)
+        # SQLite calls block, keep them off the event loop
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return parser.parse_obj(cached)
+        res = await self.ainvoke_llm(chain, prompt_message, inputs)
+        await asyncio.to_thread(self.cache.put, key, res.dict())
+        return res
+
+    async def ainvoke_llm(self, chain, prompt_message, inputs):
+        """Invokes a chain under the concurrency limit and quotas, backing off on 429s."""
+        num_tokens = self.estimate_request_tokens(prompt_message, inputs)
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire(num_tokens)
+            async with self.semaphore:
+                try:
+                    return await chain.ainvoke(inputs)
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt == self.max_retries:
+                        raise
+                    delay = retry_after_seconds(e)
+            if delay is None:
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt) * (0.5 + random.random())
+            self.rate_limited_retries += 1
+            print(f"Rate limited, retrying in {delay:.2f} seconds (attempt {attempt + 1}/{self.max_retries})")
+            await asyncio.sleep(delay)
+
+    async def agenerate_incomplete_command(self, function_call, command):
+        try:
+            res = await self.ainvoke(
+                self.incomplete_chain,
+                self.incomplete_prompt,
+                IncompleteCommandOutput,
+                {"function_call": function_call, "command": command},
+            )
+            return {"incomplete_command": res.incomplete_command,
+                    "modified_incorrect_function_call": res.modified_incorrect_function_call}
+        except Exception as e:
+            print(f"Error in generating incomplete command: {e}")
+            return {"incomplete_command": "", "modified_incorrect_function_call": ""}
+
+    async def agenerate_complete_commands(self, function_call):
+        res = await self.ainvoke(
+            self.complete_chain, self.complete_prompt, CorrectCommandsOutput, {"function_call": function_call}
+        )
+        return res.commands
+
+    async def agenerate_complete_commands_batch(self, function_calls):
+        """Async version of CommandGenerator.generate_complete_commands_batch."""
+        results = [None] * len(function_calls)
+        if len(function_calls) > 1:
+            try:
+                res = await self.ainvoke(
+                    self.complete_batch_chain,
+                    self.complete_batch_prompt,
+                    BatchedCorrectCommandsOutput,
+                    {"function_calls": format_numbered(function_calls)},
+                )
+                split = split_batch_results(res.results, len(function_calls), "call_id")
+                results = [r.commands if r is not None and r.commands else None for r in split]
+            except Exception as e:
+                print(f"Error in generating batched commands: {e}")
+
+        async def retry(k):
+            try:
+                results[k] = await self.agenerate_complete_commands(function_calls[k])
+            except Exception as e:
+                print(f"Error in generating commands for {function_calls[k]}: {e}")
+
+        await asyncio.gather(*[retry(k) for k in range(len(function_calls)) if results[k] is None])
+        return results
+
+    async def agenerate_incomplete_commands(self, function_call, commands):
+        """Async version of CommandGenerator.generate_incomplete_commands."""
+        results = [None] * len(commands)
+        if self.prompt_batch_size > 1 and commands:
+            try:
+                res = await self.ainvoke(
+                    self.incomplete_batch_chain,
+                    self.incomplete_batch_prompt,
+                    BatchedIncompleteCommandsOutput,
+                    {"function_call": function_call, "commands": format_numbered(commands)},
+                )
+                for j, r in enumerate(split_batch_results(res.results, len(commands), "command_id")):
+                    if r is not None:
+                        results[j] = {"incomplete_command": r.incomplete_command,
+                                      "modified_incorrect_function_call": r.modified_incorrect_function_call}
+            except Exception as e:
+                print(f"Error in generating batched incomplete commands: {e}")
+
+        missing = [j for j in range(len(commands)) if results[j] is None]
+        retried = await asyncio.gather(
+            *[self.agenerate_incomplete_command(function_call, commands[j]) for j in missing]
+        )
+        for j, result in zip(missing, retried):
+            results[j] = result
+        return results
+
+    async def agenerate_call_batch(self, batch):
+        """Generates commands for a batch of (function name, call index, call) entries."""
+        all_commands = await self.agenerate_complete_commands_batch([call for _, _, call in batch])
+
+        async def generate_incomplete(function_name, i, call, commands):
+            incomplete_commands = await self.agenerate_incomplete_commands(call, commands)
+            # The checkpoint write flushes a file, keep it off the event loop like the cache I/O
+            await asyncio.to_thread(self.store_call_commands, function_name, i, commands, incomplete_commands)
+
+        await asyncio.gather(*[
+            generate_incomplete(function_name, i, call, commands)
+            for (function_name, i, call), commands in zip(batch, all_commands)
+            if commands is not None
+        ])
+
+    def create_limits(self):
+        """Creates the concurrency limit and the rate limiter (bound to the running event loop)."""
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.rate_limiter = RateLimiter(*self.rate_limiter_config)
+
+    async def run_queued(self, items, worker):
+        """
+        Awaits worker(*item) for every item of an iterable, with max_concurrency worker tasks fed
+        through a bounded queue, so only a few items are materialized at once however many
+        there are, and each worker finishes its item before taking the next one.
+        """
+        queue = asyncio.Queue(maxsize=2 * self.max_concurrency)
+
+        async def produce():
+            for item in items:
+                await queue.put(item)
+            for _ in range(self.max_concurrency):
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                await worker(*item)
+
+        tasks = [asyncio.create_task(produce())] + [asyncio.create_task(consume()) for _ in range(self.max_concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # A failed worker stops the others instead of leaving the producer blocked on the queue
+            for task in tasks:
+                task.cancel()
+
+    async def agenerate_commands_for_all_functions(self):
+        """Generates commands for every call of every function, batch by batch, on the worker tasks."""
+        self.create_limits()
+        self.prepare_outputs()
+        calls = (
+            (function_name, i, call)
+            for function_name in self.data
+            for i, call in self.pending_calls(function_name)
+        )
+        batch_size = max(1, self.prompt_batch_size)
+        batches = iter(lambda: list(itertools.islice(calls, batch_size)), [])
+        await self.run_queued(((batch,) for batch in batches), self.agenerate_call_batch)
+
+    async def avalidate_negative_sample(self, function_name, i, j, sample):
+        try:
+            res = await self.ainvoke(
+                self.judge_chain,
+                self.judge_prompt,
+                SampleCorrectnessJudgement,
+                self.judgement_inputs(
+                    sample["incomplete_command"], sample["modified_incorrect_function_call"],
+                    self.function_params[function_name],
+                ),
+                llm=self.judge_llm,
+            )
+        except Exception as e:
+            print(f"Error in validating negative sample {sample}: {e}")
+            return
+        await asyncio.to_thread(self.store_judgement, function_name, i, j, res.judgement, res.reason)
+
+    async def avalidate_negative_samples_for_all_functions(self):
+        """Judges every negative sample as an independent request, on the worker tasks."""
+        self.create_limits()
+        samples = (
+            (function_name, i, j, sample)
+            for function_name in self.data
+            for i, j, sample in list(self.negative_samples(function_name))
+        )
+        await self.run_queued(samples, self.avalidate_negative_sample)
+
+    def run(self, validate=False, validate_only=False):
+        """
+        Executes the entire command generation pipeline.
+
+        :param validate: Judge the generated negative samples after generation.
+        :param validate_only: Only judge the negative samples already in the output file.
+        """
+        self.check_existing_logs(generate=not validate_only, validate=validate or validate_only)
+        if not validate_only:
+            self.load_function_calls()
+            self.open_checkpoint()
+            asyncio.run(self.agenerate_commands_for_all_functions())
+            self.save_commands()
+
+        if validate or validate_only:
+            self.load_generated_commands()
+            self.open_validation_log()
+            asyncio.run(self.avalidate_negative_samples_for_all_functions())
+            self.save_validated_commands()
+        print(f"Retried {self.rate_limited_retries} rate limited requests.")
+        self.report_cache()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate user commands for function calls with an asyncio LLM client.")
+    parser.add_argument('--input_file', type=str, required=True, help='Path to the input JSON file.')
+    parser.add_argument('--output_file', type=str, required=True, help='Path to the output JSON file.')
+    parser.add_argument('--n', type=int, default=1, help='Number of commands to generate per function call.')
+    parser.add_argument('--max_concurrency', type=int, default=8, help='Maximum number of in-flight requests.')
+    parser.add_argument('--requests_per_minute', type=float, default=60, help='Requests/min quota of the deployment.')
+    parser.add_argument('--tokens_per_minute', type=float, default=60000, help='Tokens/min quota of the deployment.')
+    parser.add_argument('--max_retries', type=int, default=6, help='Maximum retries of a request after a 429.')
+    parser.add_argument('--cache_file', type=str, default=None, help='SQLite file caching LLM responses across runs (disabled when not given).')
+    parser.add_argument('--cache_max_entries', type=int, default=1000000, help='Maximum number of cached LLM responses.')
+    parser.add_argument('--checkpoint_file', type=str, default=None, help='JSONL file every finished call is appended to (default: output file with a .jsonl extension).')
+    parser.add_argument('--resume', action='store_true', help='Skip the calls already in the checkpoint file.')
+    parser.add_argument('--overwrite_checkpoint', action='store_true', help='Discard an existing checkpoint and validation log instead of refusing to start.')
+    parser.add_argument('--prompt_batch_size', type=int, default=1, help='Number of function calls packed into one request (1 disables batched prompting).')
+    parser.add_argument('--validate', action='store_true', help='Judge the generated negative samples after generation.')
+    parser.add_argument('--validate_only', action='store_true', help='Only judge the negative samples already in the output file.')
+    parser.add_argument('--validation_file', type=str, default=None, help='JSONL file every judgement is appended to (default: output file with a .validation.jsonl extension).')
+    add_backend_args(parser)
+    args = parser.parse_args()
+
+    generator = AsyncCommandGenerator(
+        input_file=args.input_file,
+        output_file=args.output_file,
+        n=args.n,
+        max_concurrency=args.max_concurrency,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+        max_retries=args.max_retries,
+        cache_file=args.cache_file,
+        cache_max_entries=args.cache_max_entries,
+        checkpoint_file=args.checkpoint_file or os.path.splitext(args.output_file)[0] + ".jsonl",
+        resume=args.resume,
+        prompt_batch_size=args.prompt_batch_size,
+        validation_file=args.validation_file or os.path.splitext(args.output_file)[0] + ".validation.jsonl",
+        llm_backend=args.llm_backend,
+        backend_options=backend_options(args),
+        overwrite_checkpoint=args.overwrite_checkpoint,
+    )
+    try:
+        generator.run(validate=args.validate, validate_only=args.validate_only)
+    except FileExistsError as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    start_time = time.time()
+    main()
+    print(f"Execution completed in {time.time() - start_time:.2f} seconds.")
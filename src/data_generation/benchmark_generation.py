@@ -0,0 +1,114 @@
+import os
+import io
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+
+from generate_user_command import CommandGenerator
+from async_command_generator import AsyncCommandGenerator
+
+ENGINES = ["threads", "async"]
+
+
+def sample_function_calls(input_file, num_calls):
+    """Takes the first num_calls function calls of the input file, round-robin over functions."""
+    with open(input_file, 'r') as f:
+        data = json.load(f)
+    sampled = {name: {"args": function_data["args"], "calls": []} for name, function_data in data.items()}
+    taken = 0
+    for position in range(max(len(function_data["calls"]) for function_data in data.values())):
+        for name, function_data in data.items():
+            if taken < num_calls and position < len(function_data["calls"]):
+                sampled[name]["calls"].append(function_data["calls"][position])
+                taken += 1
+    return {name: function_data for name, function_data in sampled.items() if function_data["calls"]}
+
+
+def count_commands(output_file):
+    with open(output_file, 'r') as f:
+        data = json.load(f)
+    complete = sum(len(commands) for function_data in data.values() for commands in function_data["complete_commands"])
+    incomplete = sum(
+        1
+        for function_data in data.values()
+        for commands in function_data["incomplete_commands"]
+        for command in commands
+        if command["incomplete_command"]
+    )
+    return complete, incomplete
+
+
+def run_benchmark(engine, input_file, output_file, concurrency, args):
+    options = {"latency": args.latency, "error_rate": args.error_rate, "rate_limit_rate": args.rate_limit_rate,
+               "retry_after": args.retry_after}
+    if engine == "threads":
+        generator = CommandGenerator(
+            input_file, output_file, max_threads=concurrency, batch_size=10 ** 9,
+            prompt_batch_size=args.prompt_batch_size, llm_backend="fake", backend_options=options,
+        )
+        run = lambda: generator.run(parallel=True, validate=args.validate)
+    else:
+        generator = AsyncCommandGenerator(
+            input_file, output_file, max_concurrency=concurrency,
+            requests_per_minute=args.requests_per_minute, tokens_per_minute=args.tokens_per_minute,
+            base_delay=args.retry_after, prompt_batch_size=args.prompt_batch_size,
+            llm_backend="fake", backend_options=options,
+        )
+        run = lambda: generator.run(validate=args.validate)
+
+    start_time = time.perf_counter()
+    # The generators print every command, keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        run()
+    elapsed = time.perf_counter() - start_time
+
+    complete, incomplete = count_commands(output_file)
+    return {
+        "engine": engine,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "complete": complete,
+        "incomplete": incomplete,
+        "commands_per_sec": (complete + incomplete) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end command generation throughput against the fake LLM backend.")
+    parser.add_argument('--input_file', type=str, default="../data/fc_commands.json", help='Path to the input JSON file of function calls.')
+    parser.add_argument('--num_calls', type=int, default=200, help='Number of function calls to generate commands for.')
+    parser.add_argument('--engines', type=str, nargs='+', default=ENGINES, choices=ENGINES, help='Generation engines to benchmark.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64], help='Concurrency settings to benchmark.')
+    parser.add_argument('--latency', type=float, default=0.2, help='Mean request latency of the fake backend in seconds.')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Fraction of requests failing with an error.')
+    parser.add_argument('--rate_limit_rate', type=float, default=0.0, help='Fraction of requests failing with a 429.')
+    parser.add_argument('--retry_after', type=float, default=0.5, help='Retry-After seconds of injected 429s.')
+    parser.add_argument('--requests_per_minute', type=float, default=10 ** 6, help='Requests/min quota of the async engine.')
+    parser.add_argument('--tokens_per_minute', type=float, default=10 ** 9, help='Tokens/min quota of the async engine.')
+    parser.add_argument('--prompt_batch_size', type=int, default=1, help='Number of function calls packed into one request.')
+    parser.add_argument('--validate', action='store_true', help='Include the negative-sample validation stage.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, "function_calls.json")
+        with open(input_file, 'w') as f:
+            json.dump(sample_function_calls(args.input_file, args.num_calls), f)
+
+        results = []
+        for engine in args.engines:
+            for concurrency in args.concurrency:
+                output_file = os.path.join(tmp_dir, f"commands_{engine}_{concurrency}.json")
+                result = run_benchmark(engine, input_file, output_file, concurrency, args)
+                results.append(result)
+                print(f"{engine} x{concurrency}: {result['commands_per_sec']:.1f} commands/sec")
+
+    print(f"\n{'engine':<8} {'concurrency':>11} {'seconds':>8} {'complete':>9} {'incomplete':>11} {'commands/sec':>13}")
+    for r in results:
+        print(f"{r['engine']:<8} {r['concurrency']:>11} {r['seconds']:>8.2f} {r['complete']:>9} "
+              f"{r['incomplete']:>11} {r['commands_per_sec']:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
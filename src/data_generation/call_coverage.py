@@ -0,0 +1,141 @@
+import json
+import hashlib
+import itertools
+import numpy as np
+
+
+class Absent:
+    """Level of an optional parameter that is left out of the call."""
+
+    def __repr__(self):
+        return "ABSENT"
+
+
+ABSENT = Absent()
+
+
+def parameter_levels(choices, optional=False, numeric_levels=3, max_subsets=15, rng=None):
+    """
+    Distinct values of a parameter worth covering.
+
+    Enums, booleans and placeholder strings contribute every value, numeric ranges their bounds
+    and evenly spaced interior values, and arrays every non-empty subset of their values (or
+    the singletons, the full set and random subsets when there are more than max_subsets).
+    Optional parameters also get the ABSENT level.
+
+    :param choices: Parameter choices as returned by FunctionCallGenerator.get_param_choices.
+    """
+    values = choices['values']
+    if 'array' in choices['type']:
+        values = list(values)
+        if 2 ** len(values) - 1 <= max_subsets:
+            subsets = [list(subset) for size in range(1, len(values) + 1) for subset in itertools.combinations(values, size)]
+        else:
+            rng = rng or np.random.default_rng(0)
+            subsets = [[value] for value in values] + [values]
+            while len(subsets) < max_subsets:
+                mask = rng.random(len(values)) < 0.5
+                subset = [value for value, keep in zip(values, mask) if keep]
+                if subset and subset not in subsets:
+                    subsets.append(subset)
+        levels = [subset for subset in subsets if 'all' not in subset or len(subset) == 1]
+    elif isinstance(values, range):
+        count = min(numeric_levels, len(values))
+        levels = sorted(set(np.linspace(values.start, values.stop - 1, count).round().astype(int).tolist()))
+    else:
+        levels = list(values)
+    return [ABSENT] + levels if optional else levels
+
+
+class PairwiseCoverage:
+    """
+    Tracks which level pairs of every two parameters are covered by a set of calls (or which
+    single levels, for functions with one parameter).
+    """
+
+    def __init__(self, level_counts):
+        """
+        :param level_counts: Number of levels of every parameter.
+        """
+        self.num_params = len(level_counts)
+        if self.num_params == 1:
+            self.uncovered = {(0, a) for a in range(level_counts[0])}
+        else:
+            self.uncovered = {
+                (i, a, j, b)
+                for i, j in itertools.combinations(range(self.num_params), 2)
+                for a in range(level_counts[i])
+                for b in range(level_counts[j])
+            }
+        self.total = len(self.uncovered)
+
+    def row_items(self, row):
+        if self.num_params == 1:
+            return [(0, row[0])]
+        return [(i, row[i], j, row[j]) for i, j in itertools.combinations(range(self.num_params), 2)]
+
+    def new_items(self, row):
+        return sum(item in self.uncovered for item in self.row_items(row))
+
+    def add(self, row):
+        self.uncovered.difference_update(self.row_items(row))
+
+    @property
+    def coverage(self):
+        return 1.0 - len(self.uncovered) / self.total if self.total else 1.0
+
+
+def call_hash(args):
+    """Order-independent hash of a function call's arguments, used to drop duplicate calls."""
+    return hashlib.sha1(json.dumps(args, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def pairwise_rows(levels, max_rows, coverage_target=1.0, num_candidates=20, rng=None):
+    """
+    Greedy (AETG-style) pairwise covering array.
+
+    Every new row starts from a random uncovered pair, fills the remaining parameters with the
+    level that covers the most new pairs, and the best of num_candidates such rows is kept.
+    Stops once coverage_target of the pairs is covered or max_rows rows were generated.
+
+    :param levels: Levels of every parameter.
+    :return: (rows as lists of level indices, PairwiseCoverage)
+    """
+    rng = rng or np.random.default_rng(0)
+    coverage = PairwiseCoverage([len(param_levels) for param_levels in levels])
+    rows = []
+    while coverage.uncovered and coverage.coverage < coverage_target and len(rows) < max_rows:
+        uncovered = sorted(coverage.uncovered)
+        best_row, best_score = None, -1
+        for _ in range(num_candidates):
+            seed = uncovered[rng.integers(len(uncovered))]
+            row = [None] * coverage.num_params
+            row[seed[0]] = seed[1]
+            if len(seed) == 4:
+                row[seed[2]] = seed[3]
+            for p in rng.permutation(coverage.num_params).tolist():
+                if row[p] is not None:
+                    continue
+                scores = []
+                for level in range(len(levels[p])):
+                    score = sum(
+                        (min(p, q), level if p < q else row[q], max(p, q), row[q] if p < q else level) in coverage.uncovered
+                        for q in range(coverage.num_params)
+                        if q != p and row[q] is not None
+                    )
+                    scores.append(score)
+                best = np.flatnonzero(np.asarray(scores) == max(scores))
+                row[p] = int(best[rng.integers(len(best))])
+            score = coverage.new_items(row)
+            if score > best_score:
+                best_row, best_score = row, score
+        coverage.add(best_row)
+        rows.append(best_row)
+    return rows, coverage
+
+
+def exhaustive_rows(levels, max_rows):
+    """Every combination of levels, or None when there are more than max_rows of them."""
+    if int(np.prod([len(param_levels) for param_levels in levels])) > max_rows:
+        return None
+    return [list(row) for row in itertools.product(*[range(len(param_levels)) for param_levels in levels])]
@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+from collections import defaultdict
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from utils import canonicalize_command
+
+# Mersenne prime 2^31 - 1, keeps (a * x + b) below 2^63 for 31-bit a, b and x
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+def shingles(command, shingle_size=5):
+    """Character n-grams of the canonicalized command, hashed to 31-bit integers."""
+    text = canonicalize_command(command)
+    if len(text) <= shingle_size:
+        grams = {text}
+    else:
+        grams = {text[i:i + shingle_size] for i in range(len(text) - shingle_size + 1)}
+    return np.unique(np.fromiter(
+        (zlib.crc32(gram.encode("utf-8")) % MERSENNE_PRIME for gram in grams), dtype=np.int64, count=len(grams)
+    ))
+
+
+class MinHashLSH:
+    """
+    MinHash signatures with banded locality-sensitive hashing.
+
+    Two commands whose shingle sets have Jaccard similarity s land in a common bucket with
+    probability 1 - (1 - s^rows)^bands, so only likely near-duplicates are compared exactly
+    and the whole pass stays near-linear in the number of commands.
+    """
+
+    def __init__(self, num_perm=128, bands=32, seed=42):
+        """
+        :param num_perm: Number of hash permutations in a signature.
+        :param bands: Number of LSH bands; num_perm must be divisible by it.
+        :param seed: Seed of the hash permutations.
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+
+    def signature(self, shingle_hashes):
+        # (num_shingles, num_perm) permuted hashes, min over the shingles
+        return ((np.outer(shingle_hashes, self.a) + self.b) % MERSENNE_PRIME).min(axis=0)
+
+    def candidate_pairs(self, signatures):
+        """
+        Pairs of indices sharing a band bucket. Every bucket member is paired with the first
+        and the previous member only, so large buckets of identical commands stay linear.
+        """
+        pairs = set()
+        for band in range(self.bands):
+            buckets = defaultdict(list)
+            band_rows = np.ascontiguousarray(signatures[:, band * self.rows:(band + 1) * self.rows])
+            for idx, key in enumerate(map(bytes, band_rows)):
+                buckets[key].append(idx)
+            for members in buckets.values():
+                for n in range(1, len(members)):
+                    pairs.add((members[0], members[n]))
+                    pairs.add((members[n - 1], members[n]))
+        return pairs
+
+
+def jaccard(x, y):
+    intersection = np.intersect1d(x, y, assume_unique=True).size
+    return intersection / (x.size + y.size - intersection)
+
+
+def find_duplicates(commands, groups, lsh, threshold, shingle_size=5):
+    """
+    Finds near-duplicate commands within each group.
+
+    :param commands: List of commands.
+    :param groups: Group key of every command; only commands of the same group are compared.
+    :param threshold: Minimum Jaccard similarity of the shingle sets of two duplicates.
+    :return: Boolean array, True for the commands to drop (every duplicate but the first).
+    """
+    drop = np.zeros(len(commands), dtype=bool)
+    if not commands:
+        return drop
+    shingle_sets = [shingles(command, shingle_size) for command in commands]
+    signatures = np.stack([lsh.signature(s) for s in shingle_sets])
+
+    # Union-find over the confirmed duplicate pairs
+    parent = list(range(len(commands)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in lsh.candidate_pairs(signatures):
+        if groups[i] == groups[j] and jaccard(shingle_sets[i], shingle_sets[j]) >= threshold:
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                # Keep the earliest command of every cluster as the root
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    for i in range(len(commands)):
+        drop[i] = find(i) != i
+    return drop
+
+
+def dedup_function(function_data, lsh, threshold, shingle_size=5, dedup_incomplete=True):
+    """
+    Removes near-duplicate commands of one function in place.
+
+    Complete commands are compared among calls with the same arguments, and a dropped complete
+    command takes the incomplete command generated from it along. Incomplete commands are then
+    compared among samples with the same modified function call, and duplicates are blanked
+    (generate_training_data skips empty incomplete commands).
+    """
+    calls = function_data["calls"]
+    call_keys = function_data.get("args", calls)
+    complete = function_data["complete_commands"]
+    incomplete = function_data.get("incomplete_commands", [[] for _ in calls])
+
+    positions = [(i, j) for i in range(len(complete)) for j in range(len(complete[i]))]
+    drop = find_duplicates(
+        [complete[i][j] for i, j in positions], [str(call_keys[i]) for i, _ in positions], lsh, threshold, shingle_size
+    )
+    dropped = set(pos for pos, d in zip(positions, drop) if d)
+
+    new_complete, new_incomplete = [], []
+    for i in range(len(complete)):
+        keep = [j for j in range(len(complete[i])) if (i, j) not in dropped]
+        new_complete.append([complete[i][j] for j in keep])
+        new_incomplete.append([incomplete[i][j] for j in keep if j < len(incomplete[i])])
+    function_data["complete_commands"] = new_complete
+    function_data["incomplete_commands"] = new_incomplete
+
+    blanked = 0
+    if dedup_incomplete:
+        samples = [sample for samples in new_incomplete for sample in samples if sample["incomplete_command"]]
+        drop_incomplete = find_duplicates(
+            [sample["incomplete_command"] for sample in samples],
+            [sample["modified_incorrect_function_call"] for sample in samples],
+            lsh, threshold, shingle_size,
+        )
+        for sample, d in zip(samples, drop_incomplete):
+            if d:
+                sample["incomplete_command"] = ""
+                blanked += 1
+
+    return {
+        "complete_before": len(positions),
+        "complete_removed": len(dropped),
+        "incomplete_removed": blanked,
+    }
+
+
+def dedup_commands(data, threshold=0.7, num_perm=128, bands=32, shingle_size=5, dedup_incomplete=True):
+    """Deduplicates the commands of every function in place and returns the per-function report."""
+    lsh = MinHashLSH(num_perm=num_perm, bands=bands)
+    return {
+        function_name: dedup_function(function_data, lsh, threshold, shingle_size, dedup_incomplete)
+        for function_name, function_data in data.items()
+    }
+
+
+def print_report(report):
+    print(f"{'function':<32} {'commands':>9} {'removed':>8} {'removed %':>10} {'incomplete removed':>19}")
+    for function_name, r in report.items():
+        ratio = r["complete_removed"] / r["complete_before"] if r["complete_before"] else 0.0
+        print(f"{function_name:<32} {r['complete_before']:>9} {r['complete_removed']:>8} {ratio:>10.1%} {r['incomplete_removed']:>19}")
+    total = sum(r["complete_before"] for r in report.values())
+    removed = sum(r["complete_removed"] for r in report.values())
+    print(f"{'total':<32} {total:>9} {removed:>8} {removed / max(total, 1):>10.1%} "
+          f"{sum(r['incomplete_removed'] for r in report.values()):>19}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove near-duplicate generated user commands (MinHash / LSH).")
+    parser.add_argument('--input_file', type=str, required=True, help='Path to the generated commands JSON file.')
+    parser.add_argument('--output_file', type=str, required=True, help='Path to the deduplicated commands JSON file.')
+    parser.add_argument('--threshold', type=float, default=0.7, help='Jaccard similarity above which two commands are duplicates.')
+    parser.add_argument('--num_perm', type=int, default=128, help='Number of MinHash permutations.')
+    parser.add_argument('--bands', type=int, default=32, help='Number of LSH bands (num_perm must be divisible by it).')
+    parser.add_argument('--shingle_size', type=int, default=5, help='Character n-gram size of the shingles.')
+    parser.add_argument('--keep_incomplete_duplicates', action='store_true', help='Do not deduplicate incomplete commands.')
+    parser.add_argument('--report_file', type=str, default=None, help='Optional JSON file for the per-function report.')
+    args = parser.parse_args()
+
+    with open(args.input_file, 'r') as f:
+        data = json.load(f)
+
+    report = dedup_commands(
+        data,
+        threshold=args.threshold,
+        num_perm=args.num_perm,
+        bands=args.bands,
+        shingle_size=args.shingle_size,
+        dedup_incomplete=not args.keep_incomplete_duplicates,
+    )
+    print_report(report)
+
+    with open(args.output_file, 'w') as f:
+        json.dump(data, f, indent=4)
+    if args.report_file:
+        with open(args.report_file, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    start_time = time.time()
+    main()
+    print(f"Execution completed in {time.time() - start_time:.2f} seconds.")
@@ -1,14 +1,18 @@
 import os
 import json
-import random
 import argparse
+import numpy as np
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from config import functions
 from dotenv import load_dotenv
+from call_coverage import ABSENT, PairwiseCoverage, parameter_levels, pairwise_rows, exhaustive_rows, call_hash
+
+GENERATION_MODES = ["random", "pairwise", "exhaustive"]
 
 class FunctionCallGenerator:
-    def __init__(self, functions, n=10, opt_prob=0.5, output_file="./data/function_calls.json"):
+    def __init__(self, functions, n=10, opt_prob=0.5, output_file="./data/function_calls.json", seed=42, chunk_size=100000,
+                 mode="random", coverage_target=1.0, numeric_levels=3, max_subsets=15):
         """
         Initializes the FunctionCallGenerator with the given parameters.
 
@@ -16,11 +20,26 @@ class FunctionCallGenerator:
         :param n: Number of function calls to generate per function.
         :param opt_prob: Probability of including optional parameters.
         :param output_file: Path to the output JSON file.
+        :param seed: Seed of the argument sampler, the same seed always generates the same calls.
+        :param chunk_size: Number of argument sets sampled at once when streaming.
+        :param mode: "random" samples n calls independently, "pairwise" covers every pair of parameter
+                     values and "exhaustive" every combination of them (pairwise when there are more
+                     than n combinations). In the coverage modes n caps the calls per function.
+        :param coverage_target: Fraction of the parameter value pairs to cover in pairwise mode.
+        :param numeric_levels: Number of representative values of numeric parameters in the coverage modes.
+        :param max_subsets: Maximum number of value subsets of array parameters in the coverage modes.
         """
         self.functions = functions
         self.n = n
         self.opt_prob = opt_prob
         self.output_file = output_file
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.mode = mode
+        self.coverage_target = coverage_target
+        self.numeric_levels = numeric_levels
+        self.max_subsets = max_subsets
+        self.coverage_report = {}
         self.function_args = {}
         self.function_calls = {}
         load_dotenv()
@@ -45,7 +64,7 @@ class FunctionCallGenerator:
             elif param_type in ["integer", "number"]:
                 lower_bound = param_details.get("lower_bound", 1)
                 upper_bound = param_details.get("upper_bound", 100)
-                param_choices[param]['values'] = list(range(lower_bound, upper_bound))
+                param_choices[param]['values'] = range(lower_bound, upper_bound)
             elif param_type == "string":
                 param_choices[param]['values'] = ["|string1|", "|string2|", "|string3|"]
             elif param_type == "array":
@@ -59,41 +78,62 @@ class FunctionCallGenerator:
                 elif item_type in ["integer", "number"]:
                     lower_bound = items.get("lower_bound", 1)
                     upper_bound = items.get("upper_bound", 100)
-                    param_choices[param]['values'] = list(range(lower_bound, upper_bound))
+                    param_choices[param]['values'] = range(lower_bound, upper_bound)
                 elif item_type == "boolean":
                     param_choices[param]['values'] = [True, False]
         return param_choices
 
-    def construct_function(self, required_params_config, opt_params_config):
+    def sample_values(self, choices, n, rng):
         """
-        Constructs a single function call with randomly selected arguments.
+        Draws n values of one parameter at once.
 
-        :param required_params_config: Choices for required parameters.
-        :param opt_params_config: Choices for optional parameters.
-        :return: Dictionary of function arguments.
+        Scalars are drawn uniformly from the choices (numeric ranges without materializing
+        them). Arrays get a uniform length in [1, len(values)] and a random subset of that
+        length, with 'all' dropped when other values were drawn too.
         """
-        function_args = {}
-        for param, choices in required_params_config.items():
-            if choices['type'] != 'array':
-                function_args[param] = random.choice(choices['values'])
-            else:
-                array_length = random.randint(1, len(choices['values']))
-                function_args[param] = random.sample(choices['values'], array_length)
-                if 'all' in function_args[param] and len(function_args[param]) > 1:
-                    function_args[param].remove('all')
+        values = choices['values']
+        if 'array' not in choices['type']:
+            if isinstance(values, range):
+                return rng.integers(values.start, values.stop, size=n).tolist()
+            return [values[i] for i in rng.integers(0, len(values), size=n).tolist()]
+
+        num_values = len(values)
+        lengths = rng.integers(1, num_values + 1, size=n).tolist()
+        # Row-wise random permutations, the first `length` entries form the subset
+        permutations = np.argsort(rng.random((n, num_values)), axis=1).tolist()
+        samples = []
+        for length, permutation in zip(lengths, permutations):
+            sample = [values[i] for i in permutation[:length]]
+            if 'all' in sample and len(sample) > 1:
+                sample.remove('all')
+            samples.append(sample)
+        return samples
 
+    def sample_function_args(self, required_params_config, opt_params_config, n, rng):
+        """
+        Samples n argument sets of a function column by column.
+
+        :param rng: numpy Generator the arguments are drawn from.
+        :return: List of n function argument dicts.
+        """
+        columns = {}
+        for param, choices in required_params_config.items():
+            columns[param] = (self.sample_values(choices, n, rng), None)
         for param, choices in opt_params_config.items():
-            if random.random() < self.opt_prob:
-                if 'array' not in choices['type']:
-                    function_args[param] = random.choice(choices['values'])
-                else:
-                    array_length = random.randint(1, len(choices['values']))
-                    function_args[param] = random.sample(choices['values'], array_length)
-                    if 'all' in function_args[param] and len(function_args[param]) > 1:
-                        function_args[param].remove('all')
+            include = (rng.random(n) < self.opt_prob).tolist()
+            columns[param] = (self.sample_values(choices, n, rng), include)
 
+        function_args = [{} for _ in range(n)]
+        for param, (values, include) in columns.items():
+            for k, args in enumerate(function_args):
+                if include is None or include[k]:
+                    args[param] = values[k]
         return function_args
 
+    def function_rng(self, function_index):
+        """Independent, reproducible random generator of one function."""
+        return np.random.default_rng([self.seed, function_index])
+
     def get_function_params(self, function_detail):
         """
         Extracts the function name and parameter choices from the function details.
@@ -111,6 +151,52 @@ class FunctionCallGenerator:
 
         return function_name, function_args_choices_req, function_args_choices_opt
 
+    def covering_function_args(self, required_params_config, opt_params_config, rng):
+        """
+        Builds distinct argument sets of a function that cover its parameter space.
+
+        Every parameter is reduced to a few levels (see call_coverage.parameter_levels) and the
+        calls are the rows of a pairwise covering array, or of the full product in exhaustive mode.
+        Calls hashing to already generated arguments are dropped.
+
+        :return: Tuple of the list of function argument dicts and the coverage report.
+        """
+        params = list(required_params_config.items()) + list(opt_params_config.items())
+        levels = [
+            parameter_levels(choices, param in opt_params_config, self.numeric_levels, self.max_subsets, rng)
+            for param, choices in params
+        ]
+        if not params:
+            return [{}], {"calls": 1, "combinations": 1, "pairs": 0, "coverage": 1.0}
+
+        rows = exhaustive_rows(levels, self.n) if self.mode == "exhaustive" else None
+        if rows is not None:
+            coverage = PairwiseCoverage([len(param_levels) for param_levels in levels])
+            for row in rows:
+                coverage.add(row)
+        else:
+            rows, coverage = pairwise_rows(levels, self.n, self.coverage_target, rng=rng)
+
+        function_args, seen = [], set()
+        for row in rows:
+            args = {
+                param: param_levels[level]
+                for (param, _), param_levels, level in zip(params, levels, row)
+                if param_levels[level] is not ABSENT
+            }
+            key = call_hash(args)
+            if key not in seen:
+                seen.add(key)
+                function_args.append(args)
+
+        report = {
+            "calls": len(function_args),
+            "combinations": int(np.prod([len(param_levels) for param_levels in levels])),
+            "pairs": coverage.total,
+            "coverage": coverage.coverage,
+        }
+        return function_args, report
+
     def generate_function_call_args(self):
         """
         Generates function call arguments for each function.
@@ -118,14 +204,39 @@ class FunctionCallGenerator:
         Updates self.function_args with generated arguments.
         """
         function_args = {}
-        for function_detail in self.functions:
+        for function_index, function_detail in enumerate(self.functions):
             function_name, required_params_config, opt_params_config = self.get_function_params(function_detail)
-            function_args[function_name] = []
-            for _ in range(self.n):
-                args = self.construct_function(required_params_config, opt_params_config)
-                function_args[function_name].append(args)
+            rng = self.function_rng(function_index)
+            if self.mode == "random":
+                function_args[function_name] = self.sample_function_args(
+                    required_params_config, opt_params_config, self.n, rng
+                )
+            else:
+                function_args[function_name], self.coverage_report[function_name] = self.covering_function_args(
+                    required_params_config, opt_params_config, rng
+                )
         self.function_args = function_args
 
+    def print_coverage_report(self):
+        print(f"{'function':<32} {'calls':>6} {'combinations':>13} {'pairs':>6} {'coverage':>9}")
+        for function_name, r in self.coverage_report.items():
+            print(f"{function_name:<32} {r['calls']:>6} {r['combinations']:>13} {r['pairs']:>6} {r['coverage']:>9.1%}")
+        incomplete = [name for name, r in self.coverage_report.items() if r['coverage'] < self.coverage_target]
+        if incomplete:
+            print(f"Coverage target not met within {self.n} calls for: {', '.join(incomplete)}")
+
+    def format_function_call(self, function_name, args):
+        """Formats function arguments as a readable call string, e.g. set_temperature(temperature=25)."""
+        params = []
+        for param, value in args.items():
+            # Format arrays properly
+            if isinstance(value, list):
+                value_str = "[" + ", ".join(map(str, value)) + "]"
+            else:
+                value_str = str(value)
+            params.append(f"{param}={value_str}")
+        return f"{function_name}(" + ", ".join(params) + ")"
+
     def assimilate_function_calls(self):
         """
         Converts the function arguments into readable function call strings.
@@ -136,23 +247,11 @@ class FunctionCallGenerator:
         for function_name, function_args_list in self.function_args.items():
             function_call_main_dict[function_name] = {"args": function_args_list, "calls": []}
             for args in function_args_list:
-                function_call = f"{function_name}("
-                params = []
-                for param, value in args.items():
-                    # Format arrays properly
-                    if isinstance(value, list):
-                        value_str = "[" + ", ".join(map(str, value)) + "]"
-                    else:
-                        value_str = str(value)
-                    params.append(f"{param}={value_str}")
-                function_call += ", ".join(params) + ")"
+                function_call = self.format_function_call(function_name, args)
                 function_call_main_dict[function_name]['calls'].append(function_call)
         self.function_calls = function_call_main_dict
 
-    def save_function_calls(self):
-        """
-        Saves the generated function calls to a JSON file specified by self.output_file.
-        """
+    def get_save_path(self):
         currDir = os.path.dirname(os.path.realpath(__file__))
         # find parent of current directory
         parentDir = os.path.abspath(os.path.join(currDir, os.pardir))
@@ -161,12 +260,57 @@ class FunctionCallGenerator:
         if not os.path.exists(saveDir):
             os.makedirs(saveDir)
         
-        save_path = os.path.join(saveDir, self.output_file)
-        
-        
-        with open(save_path, "w") as f:
+        return os.path.join(saveDir, self.output_file)
+
+    def save_function_calls(self):
+        """
+        Saves the generated function calls to a JSON file specified by self.output_file.
+        """
+        with open(self.get_save_path(), "w") as f:
             json.dump(self.function_calls, f, indent=4)
 
+    def encode_records(self, function_name, function_args):
+        """
+        Encodes argument sets as JSONL records. Parameters take few distinct values, so the JSON
+        and call-string fragment of every (parameter, value) pair is built once and reused.
+        """
+        fragments = {}
+        prefix = '{"function_name": ' + json.dumps(function_name) + ', "args": {'
+        call_prefix = json.dumps(function_name + "(")[:-1]
+        for args in function_args:
+            arg_fragments, call_fragments = [], []
+            for param, value in args.items():
+                key = (param, type(value), tuple(value) if isinstance(value, list) else value)
+                if key not in fragments:
+                    call_fragment = self.format_function_call("", {param: value})[1:-1]
+                    fragments[key] = (json.dumps({param: value})[1:-1], json.dumps(call_fragment)[1:-1])
+                arg_fragment, call_fragment = fragments[key]
+                arg_fragments.append(arg_fragment)
+                call_fragments.append(call_fragment)
+            yield prefix + ", ".join(arg_fragments) + '}, "call": ' + call_prefix + ", ".join(call_fragments) + ')"}\n'
+
+    def stream_function_calls(self):
+        """
+        Samples self.n calls per function in chunks of self.chunk_size and appends them to a JSONL
+        file, one {"function_name", "args", "call"} record per line, so memory stays flat however
+        many calls are generated.
+        """
+        with open(self.get_save_path(), "w") as f:
+            for function_index, function_detail in enumerate(self.functions):
+                function_name, required_params_config, opt_params_config = self.get_function_params(function_detail)
+                rng = self.function_rng(function_index)
+                if self.mode != "random":
+                    function_args, self.coverage_report[function_name] = self.covering_function_args(
+                        required_params_config, opt_params_config, rng
+                    )
+                    f.writelines(self.encode_records(function_name, function_args))
+                    continue
+                for start in range(0, self.n, self.chunk_size):
+                    chunk = self.sample_function_args(
+                        required_params_config, opt_params_config, min(self.chunk_size, self.n - start), rng
+                    )
+                    f.writelines(self.encode_records(function_name, chunk))
+
     def run(self):
         """
         Executes the full pipeline: generating arguments, assimilating calls, and saving to a file.
@@ -174,16 +318,36 @@ class FunctionCallGenerator:
         self.generate_function_call_args()
         self.assimilate_function_calls()
         self.save_function_calls()
+        if self.coverage_report:
+            self.print_coverage_report()
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--n', type=int, default=10, help='Number of function calls per function')
+    parser.add_argument('--n', type=int, default=10, help='Number of function calls per function (maximum in the coverage modes)')
     parser.add_argument('--opt_prob', type=float, default=0.5, help='Probability of including optional parameters')
-    parser.add_argument('--output_file', type=str, default='function_calls.json', help='Output file path')
+    parser.add_argument('--output_file', type=str, default=None,
+                        help='Output file path (default: function_calls.json, function_calls.jsonl with --stream)')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the argument sampler')
+    parser.add_argument('--stream', action='store_true', help='Stream the calls to a JSONL file instead of building one JSON file')
+    parser.add_argument('--chunk_size', type=int, default=100000, help='Number of argument sets sampled at once when streaming')
+    parser.add_argument('--mode', type=str, default='random', choices=GENERATION_MODES,
+                        help='random sampling, pairwise coverage or exhaustive enumeration of the parameter values')
+    parser.add_argument('--coverage_target', type=float, default=1.0, help='Fraction of parameter value pairs to cover in pairwise mode')
+    parser.add_argument('--numeric_levels', type=int, default=3, help='Representative values per numeric parameter in the coverage modes')
+    parser.add_argument('--max_subsets', type=int, default=15, help='Maximum value subsets per array parameter in the coverage modes')
     args = parser.parse_args()
+    output_file = args.output_file or ('function_calls.jsonl' if args.stream else 'function_calls.json')
 
-    generator = FunctionCallGenerator(functions, n=args.n, opt_prob=args.opt_prob, output_file=args.output_file)
-    generator.run()
+    generator = FunctionCallGenerator(functions, n=args.n, opt_prob=args.opt_prob, output_file=output_file,
+                                      seed=args.seed, chunk_size=args.chunk_size, mode=args.mode,
+                                      coverage_target=args.coverage_target, numeric_levels=args.numeric_levels,
+                                      max_subsets=args.max_subsets)
+    if args.stream:
+        generator.stream_function_calls()
+        if generator.coverage_report:
+            generator.print_coverage_report()
+    else:
+        generator.run()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -11,7 +11,9 @@ from faker import Faker
 from datetime import datetime, timedelta
 import random
 import json
-from config import functions
+from config import system_message
+from schema_registry import registry
+from training_data_format import write_messages, ARROW_EXTENSION
 import inspect
 
 import ast
@@ -94,7 +96,38 @@ def extract_function_name_and_parameters(function_call):
     }
 
     
-def generate_function_call_message(functions: list,data_file = None) -> list:
+def complete_message(fn, user_command, fn_args):
+    """Training message of a complete command calling fn with fn_args."""
+    user_message = "<|im_start|>user\n" + user_command + "<|im_end|>\n"
+    assistant_message = f'<|im_start|>assistant\n<functioncall> {{"name": "{fn}", "arguments": "{fn_args}"}} <|im_end|><|endoftext|>'
+    return {'system': system_message, 'user': user_message, 'assistant': assistant_message}
+
+
+def incomplete_message(incomplete_command, fn_call, fn_args, verbose=True):
+    """
+    Training message of an incomplete command, answered with its modified function call.
+
+    :param fn_args: extract_function_name_and_parameters result of the modified call fn_call.
+    :return: The message, or None when fn_call could not be parsed.
+    """
+    ## Check if no args are present and if so, add POSSIBILY_INCORRECT to function name
+    try:
+        function_name = fn_args['function_name']
+        if len(fn_args['parameters']) == 0:
+            function_name = "POSSIBLY_INCORRECT_" + function_name
+            if verbose:
+                print(f"Possibly incorrect example: {incomplete_command} \n , fn_args : {dict(fn_args, function_name=function_name)}" )
+    except:
+        if verbose:
+            print(f"Error in extracting function name and parameters for {fn_call}")
+        return None
+
+    user_message = "<|im_start|>user\n" + incomplete_command + "<|im_end|>\n"
+    assistant_message = f'<|im_start|>assistant\n<functioncall> {{"name": "{function_name}", "arguments": "{fn_args["parameters"]}"}} <|im_end|><|endoftext|>'
+    return {'system': system_message, 'user': user_message, 'assistant': assistant_message}
+
+
+def generate_function_call_message(registry, data_file = None) -> list:
     
     # message initialization
     complete_messages = []
@@ -110,9 +143,6 @@ def generate_function_call_message(functions: list,data_file = None) -> list:
         
         
        
-    system_message = "<|im_start|>system\nYou are a helpful assistant. You have to either provide a way to answer user's request or answer user's query.\n<|im_end|>\n"
-    
-    
     if data_file is None:
         raise ValueError("Data file is required to read data from file")
     
@@ -125,24 +155,18 @@ def generate_function_call_message(functions: list,data_file = None) -> list:
         fn_args = data[fn]['args']
         # import pdb; pdb.set_trace()
         
-        fun = list(filter(lambda x: x['name'] == fn, functions))
-        fun = fun[0]
-        required = fun['parameters'].get('required', [])
-        optional = fun['parameters'].get('optional', [])
+        fun = registry[fn]
+        required = fun.required
+        optional = fun.optional
         
         # import pdb; pdb.set_trace()
         
         for i in range(len(user_commands)):
             for j in range(len(user_commands[i])):
                 # import pdb; pdb.set_trace()
-                user_message = "<|im_start|>user\n"
                 user_command_temp = user_commands[i][j]
                 user_command_temp = refine_command_expression(user_command_temp)
-                user_message += user_commands[i][j]
-                user_message += "<|im_end|>\n"
-                assistant_message = f'<|im_start|>assistant\n<functioncall> {{"name": "{fn}", "arguments": "{fn_args[i]}"}} <|im_end|><|endoftext|>'
-                scenario_message = {'system': system_message, 'user': user_message, 'assistant': assistant_message}
-                complete_messages.append(scenario_message)
+                complete_messages.append(complete_message(fn, user_commands[i][j], fn_args[i]))
         
         ## Continue if function has no required parameters as the info of calling 
                 ## the function with no required parameters is already present in the complete commands
@@ -157,28 +181,12 @@ def generate_function_call_message(functions: list,data_file = None) -> list:
                 if len(incomplete_commands[i][j]['incomplete_command']) == 0:
                     continue
                 
-                user_message = "<|im_start|>user\n"
                 user_command_temp = incomplete_commands[i][j]['incomplete_command']
-                user_message += user_command_temp
-                user_message += "<|im_end|>\n"
-                
                 fn_call_temp = incomplete_commands[i][j]['modified_incorrect_function_call']
                 fn_args_temp = extract_function_name_and_parameters(fn_call_temp)
-                
-                
-                
-                ## Check if no args are present and if so, add POSSIBILY_INCORRECT to function name
-                try:
-                    if len(fn_args_temp['parameters']) == 0:
-                        fn_args_temp['function_name'] = "POSSIBLY_INCORRECT_" + fn_args_temp['function_name']
-                        print(f"Possibly incorrect example: {incomplete_commands[i][j]['incomplete_command']} \n , fn_args : {fn_args_temp}" )
-                except:
-                    print(f"Error in extracting function name and parameters for {fn_call_temp}")
-                    continue
-                
-                assistant_message = f'<|im_start|>assistant\n<functioncall> {{"name": "{fn_args_temp["function_name"]}", "arguments": "{fn_args_temp["parameters"]}"}} <|im_end|><|endoftext|>'
-                scenario_message = {'system': system_message, 'user': user_message, 'assistant': assistant_message}
-                incomplete_messages.append(scenario_message)
+                scenario_message = incomplete_message(user_command_temp, fn_call_temp, fn_args_temp)
+                if scenario_message is not None:
+                    incomplete_messages.append(scenario_message)
                 
                             
     return complete_messages, incomplete_messages
@@ -197,20 +205,24 @@ def refine_command_expression(user_command_temp):
     
     return user_command_temp
 
-def save_data(complete_messages, output_file, suffix = ''):
+def save_data(complete_messages, output_file, suffix = '', legacy_formats = False):
+        """
+        Splits the messages 80/20 into train and test and writes each split once, as an Arrow
+        file with system / user / assistant / function_name / is_negative columns. With
+        legacy_formats the pickled .npy and indented .json files are written as well.
+        """
         # split the data into train and test
         split = int(len(complete_messages) * 0.8)
         train_data = complete_messages[:split]
         test_data = complete_messages[split:]
         # save the messages
-        np.save(f"{output_file}-train_{suffix}.npy", train_data)
-
-        with open(f"{output_file}-train_{suffix}.json", "w") as file:
-            json.dump(train_data, file, indent=4)
-            
-        np.save(f"{output_file}-test_{suffix}.npy", test_data)
-        with open(f"{output_file}-test_{suffix}.json", "w") as file:
-            json.dump(test_data, file, indent=4)
+        for split_name, split_data in [("train", train_data), ("test", test_data)]:
+            path = f"{output_file}-{split_name}_{suffix}"
+            write_messages(path + ARROW_EXTENSION, split_data)
+            if legacy_formats:
+                np.save(f"{path}.npy", split_data)
+                with open(f"{path}.json", "w") as file:
+                    json.dump(split_data, file, indent=4)
 
 if __name__ == "__main__":
     
@@ -221,6 +233,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Generate training data for function calling')
     parser.add_argument('--output_file', type=str, default='car_finetuning_gpt', help='Output file path')
     parser.add_argument('--data_file', type=str, default='./data/function_calls_with_commands.json', help='Data file path')
+    parser.add_argument('--legacy_formats', action='store_true', help='Also write the pickled .npy and .json files of every split')
     
     args = parser.parse_args()
     
@@ -228,11 +241,11 @@ if __name__ == "__main__":
     
     # import pdb; pdb.set_trace()
     
-    complete_messages, incomplete_messages = generate_function_call_message(functions, data_file=args.data_file)
+    complete_messages, incomplete_messages = generate_function_call_message(registry, data_file=args.data_file)
     random.shuffle(complete_messages)
     random.shuffle(incomplete_messages)
     
-    save_data(complete_messages, output_file, suffix='complete')
-    save_data(incomplete_messages, output_file, suffix='incomplete')
+    save_data(complete_messages, output_file, suffix='complete', legacy_formats=args.legacy_formats)
+    save_data(incomplete_messages, output_file, suffix='incomplete', legacy_formats=args.legacy_formats)
     
     
\ No newline at end of file
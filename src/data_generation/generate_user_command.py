@@ -2,27 +2,55 @@ import os
 import json
 import time
 import argparse
+import itertools
+from collections import Counter
 from dotenv import load_dotenv
-from langchain_openai import AzureChatOpenAI
 from langchain.prompts import ChatPromptTemplate
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import threading
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from config import functions
+from schema_registry import registry
 
+from llm_cache import LLMResponseCache
+from llm_backends import create_llm, add_backend_args, backend_options
+from generation_checkpoint import GenerationCheckpoint, ValidationLog, export_checkpoint, check_existing_log
 from user_command_config import complete_command_gen_prompt, CorrectCommandsOutput, \
      incomplete_command_gen_prompt,\
         CommandType,MissingValuesOutput,IncompleteCommands,\
             incomplete_command_gen_prompt_reinforced, IncompleteCommandOutput,\
-                SampleCorrectnessJudgement, incorrectness_judgement_prompt
+                SampleCorrectnessJudgement, incorrectness_judgement_prompt,\
+                    complete_command_gen_prompt_batched, BatchedCorrectCommandsOutput,\
+                        incomplete_command_gen_prompt_batched, BatchedIncompleteCommandsOutput
             
 load_dotenv()
 
 
+def format_numbered(items):
+    """Formats items as a '[i] item' list for the batched prompts."""
+    return "\n".join(f"[{i}] {item}" for i, item in enumerate(items))
+
+
+def split_batch_results(results, num_items, id_field):
+    """
+    Maps the entries of a batched response back to the items they were generated for.
+
+    :return: List with the entry of every item, or None where the response had no (or only a
+             duplicate / out-of-range) entry for it.
+    """
+    split = [None] * num_items
+    for result in results:
+        idx = getattr(result, id_field)
+        if 0 <= idx < num_items and split[idx] is None:
+            split[idx] = result
+    return split
+
+
 
 class CommandGenerator:
-    def __init__(self, input_file, output_file, n=2, sleep_interval=1.0, max_threads=4, batch_size=5):
+    def __init__(self, input_file, output_file, n=2, sleep_interval=1.0, max_threads=4, batch_size=5,
+                 cache_file=None, cache_max_entries=1000000, checkpoint_file=None, resume=False, prompt_batch_size=1,
+                 validation_file=None, llm_backend="azure", backend_options=None, overwrite_checkpoint=False):
         """
         Initializes the CommandGenerator with the given parameters.
 
@@ -31,6 +59,17 @@ class CommandGenerator:
         :param n: Number of commands to generate per function call.
         :param sleep_interval: Time to sleep after every 10 commands (in seconds).
         :param max_threads: Maximum number of threads for parallel processing.
+        :param cache_file: Optional SQLite file caching LLM responses across runs.
+        :param cache_max_entries: Maximum number of cached LLM responses.
+        :param checkpoint_file: Optional JSONL file every finished call is appended to.
+        :param resume: Skip the calls already in checkpoint_file instead of starting over.
+        :param prompt_batch_size: Number of function calls packed into one complete command request. When
+            above 1, the incomplete commands of a call are also generated with a single request.
+        :param validation_file: Optional JSONL file every negative-sample judgement is appended to.
+        :param llm_backend: LLM backend to generate with ("azure" or the local "fake" backend).
+        :param backend_options: Extra options of the LLM backend (e.g. latency of the fake backend).
+        :param overwrite_checkpoint: Discard an existing checkpoint / validation log when not resuming,
+            instead of refusing to start.
         """
         self.input_file = input_file
         self.output_file = output_file
@@ -40,26 +79,73 @@ class CommandGenerator:
         self.data = {}
         self.llm = None
         self.batch_size = batch_size
+        self.cache = LLMResponseCache(cache_file, cache_max_entries) if cache_file else None
+        self.request_samples = Counter()
+        self.sample_lock = threading.Lock()
+        self.checkpoint_file = checkpoint_file
+        self.resume = resume
+        self.overwrite_checkpoint = overwrite_checkpoint
+        self.checkpoint = None
+        self.prompt_batch_size = prompt_batch_size
+        self.validation_file = validation_file
+        self.validation_log = None
+        self.llm_backend = llm_backend
+        self.backend_options = backend_options or {}
 
         self.global_request_count = 0
         self.lock = threading.Lock()
 
         self.initialize_llm()
+        self.build_generation_chains()
+        self.build_validation_chain()
         self.load_personas()
 
-    def initialize_llm(self):
-        """Initializes the AzureChatOpenAI LLM client."""
-        self.llm = AzureChatOpenAI(
-            azure_endpoint=os.getenv("AZURE_ENDPOINT"),
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            deployment_name=os.getenv("DEPLOYMENT_NAME"),
-            openai_api_version=os.getenv("OPENAI_API_VERSION"),
-            temperature=0.9,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2,
+    def create_llm(self, temperature, max_retries):
+        """Creates an LLM client of the configured backend."""
+        return create_llm(self.llm_backend, temperature=temperature, max_retries=max_retries, **self.backend_options)
+
+    def initialize_llm(self, max_retries=2):
+        """Initializes the generation and the (deterministic) judge LLM clients."""
+        self.llm = self.create_llm(temperature=0.9, max_retries=max_retries)
+        # Separate client, so validation never changes the temperature used by generation threads
+        self.judge_llm = self.create_llm(temperature=0, max_retries=max_retries)
+
+    def build_chain(self, prompt_message, parser, llm=None):
+        """Builds a prompt | structured-output chain."""
+        prompt = ChatPromptTemplate.from_messages(prompt_message)
+        return prompt | (llm or self.llm).with_structured_output(parser)
+
+    def cache_key(self, prompt_message, parser, inputs, llm=None):
+        """
+        Cache key of a request. Identical sampled (temperature above 0) requests of a run are
+        numbered, so each one is cached as a distinct sample instead of replaying the first response.
+        """
+        llm = llm or self.llm
+        sample = 0
+        if llm.temperature:
+            request_key = LLMResponseCache.make_key(prompt_message, inputs, llm.deployment_name, llm.temperature, parser)
+            with self.sample_lock:
+                sample = self.request_samples[request_key]
+                self.request_samples[request_key] += 1
+        return LLMResponseCache.make_key(
+            prompt_message, inputs, llm.deployment_name, llm.temperature, parser, sample=sample
         )
 
+    def invoke_chain(self, chain, prompt_message, parser, inputs, llm=None):
+        """Invokes a chain, serving the response from the LLM cache when possible."""
+        if self.cache is None:
+            self.check_rate_limit()  # Enforce global rate limit per command
+            return chain.invoke(inputs)
+
+        key = self.cache_key(prompt_message, parser, inputs, llm)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return parser.parse_obj(cached)
+        self.check_rate_limit()  # Enforce global rate limit per command
+        res = chain.invoke(inputs)
+        self.cache.put(key, res.dict())
+        return res
+
     def load_function_calls(self):
         """Loads function calls from the input JSON file."""
         with open(self.input_file, 'r') as f:
@@ -77,172 +163,380 @@ class CommandGenerator:
                 print(f"Generated {self.global_request_count} commands. Pausing for {self.sleep_interval} seconds...")
                 time.sleep(self.sleep_interval)
 
-    def generate_command(self, function_call):
-        """Generates user commands for a given function call."""
-        
-        fn_name = function_call.split('(')[0]
-        fn = list(filter(lambda x: x['name'] == fn_name, functions))[0]
-        params = list(fn['parameters']['properties'].keys())
-        description = fn['description']
-        
-        
-        prompt_message = complete_command_gen_prompt
-        parser = CorrectCommandsOutput
-        prompt = ChatPromptTemplate.from_messages(
-             prompt_message
-        )
+    def build_generation_chains(self):
+        """Builds the complete / incomplete command chains once, they are shared by all workers."""
+        self.complete_prompt = complete_command_gen_prompt
+        self.incomplete_prompt = incomplete_command_gen_prompt_reinforced
+        self.complete_chain = self.build_chain(self.complete_prompt, CorrectCommandsOutput)
+        self.incomplete_chain = self.build_chain(self.incomplete_prompt, IncompleteCommandOutput)
+        self.complete_batch_prompt = complete_command_gen_prompt_batched
+        self.incomplete_batch_prompt = incomplete_command_gen_prompt_batched
+        self.complete_batch_chain = self.build_chain(self.complete_batch_prompt, BatchedCorrectCommandsOutput)
+        self.incomplete_batch_chain = self.build_chain(self.incomplete_batch_prompt, BatchedIncompleteCommandsOutput)
 
-        chain = prompt | self.llm.with_structured_output(parser)
-        all_commands = []
-        
-        self.check_rate_limit()  # Enforce global rate limit per command
-        res = chain.invoke(
+    def generate_complete_commands(self, function_call):
+        """Generates the complete user commands for a given function call."""
+        res = self.invoke_chain(
+            self.complete_chain,
+            self.complete_prompt,
+            CorrectCommandsOutput,
             {
                 "function_call": function_call,
                 # "function_params": ', '.join(params),
                 # "function_description": description
              }
         )
-        all_commands = res.commands
-        all_incomplete_commands = []
-        
-        incomplete_prompt_message = incomplete_command_gen_prompt_reinforced
-        incomplete_parser = IncompleteCommandOutput
-        incomplete_prompt = ChatPromptTemplate.from_messages(
-                incomplete_prompt_message
+        return res.commands
+
+    def generate_incomplete_command(self, function_call, command):
+        """Generates an incomplete command (and the matching incorrect call) from a complete command."""
+        try:
+            res = self.invoke_chain(
+                self.incomplete_chain,
+                self.incomplete_prompt,
+                IncompleteCommandOutput,
+                {
+                    "function_call": function_call,
+                    "command": command
+                }
             )
-        
-        incomplete_chain = incomplete_prompt | self.llm.with_structured_output(incomplete_parser)
-        
-        for command in all_commands:
-            self.check_rate_limit()  # Enforce global rate limit per command
+            incomplete_command = res.incomplete_command
+            modified_incorrect_function_call = res.modified_incorrect_function_call
+            print(f"Complete command: {command} for function call: {function_call}")
+            print(f"Incomplete command: {incomplete_command} with modified incorrect function call: {modified_incorrect_function_call}")
+            return {"incomplete_command": incomplete_command, "modified_incorrect_function_call": modified_incorrect_function_call}
+        except Exception as e:
+            print(f"Error in generating incomplete command: {e}")
+            return {"incomplete_command": "", "modified_incorrect_function_call": ""}
+
+    def generate_complete_commands_batch(self, function_calls):
+        """
+        Generates the complete commands of several function calls with one request. Calls missing
+        from the response are retried individually.
+
+        :return: List with the commands of every call, or None for calls that failed.
+        """
+        results = [None] * len(function_calls)
+        if len(function_calls) > 1:
             try:
-                res = incomplete_chain.invoke(
-                    {
-                        "function_call": function_call,
-                        "command": command
-                    }
+                res = self.invoke_chain(
+                    self.complete_batch_chain,
+                    self.complete_batch_prompt,
+                    BatchedCorrectCommandsOutput,
+                    {"function_calls": format_numbered(function_calls)}
                 )
-                incomplete_command = res.incomplete_command
-                modified_incorrect_function_call = res.modified_incorrect_function_call
-                print(f"Complete command: {command} for function call: {function_call}")
-                print(f"Incomplete command: {incomplete_command} with modified incorrect function call: {modified_incorrect_function_call}")
-                all_incomplete_commands.append({"incomplete_command": incomplete_command, "modified_incorrect_function_call": modified_incorrect_function_call})
+                split = split_batch_results(res.results, len(function_calls), "call_id")
+                results = [r.commands if r is not None and r.commands else None for r in split]
             except Exception as e:
-                print(f"Error in generating incomplete command: {e}")
-                all_incomplete_commands.append({"incomplete_command": "", "modified_incorrect_function_call": ""})
-            
-        return all_commands, all_incomplete_commands
+                print(f"Error in generating batched commands: {e}")
+
+        for k, function_call in enumerate(function_calls):
+            if results[k] is None:
+                try:
+                    results[k] = self.generate_complete_commands(function_call)
+                except Exception as e:
+                    print(f"Error in generating commands for {function_call}: {e}")
+        return results
+
+    def generate_incomplete_commands_batch(self, function_call, commands):
+        """
+        Generates the incomplete commands of all complete commands of a call with one request.
+        Commands missing from the response are retried individually.
+        """
+        results = [None] * len(commands)
+        try:
+            res = self.invoke_chain(
+                self.incomplete_batch_chain,
+                self.incomplete_batch_prompt,
+                BatchedIncompleteCommandsOutput,
+                {"function_call": function_call, "commands": format_numbered(commands)}
+            )
+            for j, r in enumerate(split_batch_results(res.results, len(commands), "command_id")):
+                if r is not None:
+                    results[j] = {"incomplete_command": r.incomplete_command,
+                                  "modified_incorrect_function_call": r.modified_incorrect_function_call}
+        except Exception as e:
+            print(f"Error in generating batched incomplete commands: {e}")
+
+        for j, command in enumerate(commands):
+            if results[j] is None:
+                results[j] = self.generate_incomplete_command(function_call, command)
+        return results
+
+    def generate_command(self, function_call):
+        """Generates user commands for a given function call."""
+        all_commands = self.generate_complete_commands(function_call)
+        return all_commands, self.generate_incomplete_commands(function_call, all_commands)
+
+    def generate_incomplete_commands(self, function_call, commands):
+        """Generates the incomplete commands of all complete commands of a call."""
+        if self.prompt_batch_size > 1 and commands:
+            return self.generate_incomplete_commands_batch(function_call, commands)
+        return [self.generate_incomplete_command(function_call, command) for command in commands]
+
+    def pending_calls(self, function_name):
+        """Yields the (call index, call) pairs of a function that still need commands."""
+        for i, call in enumerate(self.data[function_name]["calls"]):
+            if self.checkpoint is None or not self.checkpoint.is_completed(function_name, i, call):
+                yield i, call
+
+    def prepare_outputs(self):
+        """Pre-allocates the per-call output lists (not needed when streaming to a checkpoint)."""
+        if self.checkpoint is not None:
+            return
+        for function_data in self.data.values():
+            num_calls = len(function_data["calls"])
+            function_data["complete_commands"] = [[] for _ in range(num_calls)]
+            function_data["incomplete_commands"] = [[] for _ in range(num_calls)]
+
+    def store_call_commands(self, function_name, i, complete_commands, incomplete_commands):
+        """Records the commands of a finished call, streaming them to the checkpoint if there is one."""
+        if self.checkpoint is not None:
+            call = self.data[function_name]["calls"][i]
+            self.checkpoint.write(function_name, i, call, complete_commands, incomplete_commands)
+        else:
+            self.data[function_name]["complete_commands"][i] = complete_commands
+            self.data[function_name]["incomplete_commands"][i] = incomplete_commands
 
     def generate_commands_for_function(self, function_name):
         """Generates commands for all calls of a single function."""
-        function_data = self.data[function_name]
-        function_data["complete_commands"] = []  # Initialize the user_commands key
-        function_data["incomplete_commands"] = []  # Initialize the user_commands key
-
-        for i,call in enumerate(function_data["calls"]):
-            complete_commands, incomplete_commands = self.generate_command(call)
-            function_data["complete_commands"].append(complete_commands)
-            function_data["incomplete_commands"].append(incomplete_commands)
-            
-            # if i == 1:
-            #     break
+        calls = list(self.pending_calls(function_name))
+        batch_size = max(1, self.prompt_batch_size)
+        for start in range(0, len(calls), batch_size):
+            batch = calls[start:start + batch_size]
+            for (i, call), commands in zip(batch, self.generate_complete_commands_batch([call for _, call in batch])):
+                if commands is not None:
+                    self.store_call_commands(function_name, i, commands, self.generate_incomplete_commands(call, commands))
 
     def generate_commands_for_all_functions(self, parallel=True):
-        # import pdb; pdb.set_trace()
-        """Generates commands for all functions using multithreading."""
-        if parallel:
-            with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
-                futures = [
-                    executor.submit(self.generate_commands_for_function, function_name)
-                    for function_name in self.data.keys()
-                ]
-                for future in futures:
-                    try:
-                        future.result()
-                    except Exception as exc:
-                        print(f"Error in generating commands: {exc}")
-        else:
+        """
+        Generates commands for all functions.
+
+        In parallel mode every (function, call index) pair is an independent task, and every
+        incomplete command request is submitted as soon as its complete commands are back, so
+        all workers stay busy regardless of how calls are spread across functions. Results are
+        written back in call order. At most max_threads calls are in progress at a time, so
+        finished calls reach the checkpoint steadily instead of all at the end.
+        """
+        self.prepare_outputs()
+        if not parallel:
             for function_name in self.data.keys():
                 self.generate_commands_for_function(function_name)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
+            pending = {}
+            # Calls waiting for their incomplete commands: (function, index) -> [complete, incomplete, remaining]
+            in_progress = {}
+            calls = (
+                (function_name, i, call)
+                for function_name in self.data.keys()
+                for i, call in self.pending_calls(function_name)
+            )
+            batch_size = max(1, self.prompt_batch_size)
+            active_calls = 0
+
+            while True:
+                while active_calls < self.max_threads * batch_size:
+                    batch = list(itertools.islice(calls, batch_size))
+                    if not batch:
+                        break
+                    future = executor.submit(self.generate_complete_commands_batch, [call for _, _, call in batch])
+                    pending[future] = ("complete", batch)
+                    active_calls += len(batch)
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, key = pending.pop(future)
+                    if kind == "complete":
+                        for (function_name, i, call), commands in zip(key, future.result()):
+                            if commands is None:
+                                active_calls -= 1
+                            elif not commands:
+                                self.store_call_commands(function_name, i, [], [])
+                                active_calls -= 1
+                            else:
+                                in_progress[(function_name, i)] = [commands, [None] * len(commands), len(commands)]
+                                for indices, call_future in self.submit_incomplete_commands(executor, call, commands):
+                                    pending[call_future] = ("incomplete", (function_name, i, indices))
+                    else:
+                        function_name, i, indices = key
+                        entry = in_progress[(function_name, i)]
+                        for j, result in zip(indices, future.result()):
+                            entry[1][j] = result
+                        entry[2] -= len(indices)
+                        if entry[2] == 0:
+                            del in_progress[(function_name, i)]
+                            self.store_call_commands(function_name, i, entry[0], entry[1])
+                            active_calls -= 1
+
+    def submit_incomplete_commands(self, executor, function_call, commands):
+        """Submits the incomplete command requests of a call, returning (command indices, future) pairs."""
+        if self.prompt_batch_size > 1:
+            return [(range(len(commands)), executor.submit(self.generate_incomplete_commands_batch, function_call, commands))]
+        return [
+            ([j], executor.submit(lambda command=command: [self.generate_incomplete_command(function_call, command)]))
+            for j, command in enumerate(commands)
+        ]
+
+    def build_validation_chain(self):
+        """Builds the negative-sample judge chain on the temperature 0 client."""
+        self.judge_prompt = incorrectness_judgement_prompt
+        self.judge_chain = self.build_chain(self.judge_prompt, SampleCorrectnessJudgement, llm=self.judge_llm)
+        self.function_params = {spec.name: list(spec.parameters) for spec in registry}
+
+    def judgement_inputs(self, incomplete_user_command, modified_incorrect_function_call, parameters):
+        return {
+            "incomplete_user_command": incomplete_user_command,
+            "modified_incorrect_function_call": modified_incorrect_function_call,
+            "parameters": parameters
+        }
 
     def is_negative_sample_correct(self, incomplete_user_command, modified_incorrect_function_call, parameters):
-        
-        prompt_message = incorrectness_judgement_prompt
-        parser = SampleCorrectnessJudgement
-        prompt = ChatPromptTemplate.from_messages(
-             prompt_message
-        )
-        self.llm.temperature = 0
-        chain = prompt | self.llm.with_structured_output(parser)
-        res = chain.invoke(
-            {
-                "incomplete_user_command": incomplete_user_command,
-                "modified_incorrect_function_call": modified_incorrect_function_call,
-                "parameters": parameters
-             }
+        res = self.invoke_chain(
+            self.judge_chain,
+            self.judge_prompt,
+            SampleCorrectnessJudgement,
+            self.judgement_inputs(incomplete_user_command, modified_incorrect_function_call, parameters),
+            llm=self.judge_llm,
         )
         return res.judgement, res.reason
-        
-        # return True
-    
+
+    def negative_samples(self, function_name):
+        """Yields the (call index, command index, sample) triples of a function that still need a judgement."""
+        for i, samples in enumerate(self.data[function_name].get("incomplete_commands", [])):
+            for j, sample in enumerate(samples):
+                if "is_correct" not in sample:
+                    yield i, j, sample
+
+    def store_judgement(self, function_name, i, j, is_correct, reason):
+        """Records the judgement of a sample, streaming it to the validation log if there is one."""
+        sample = self.data[function_name]["incomplete_commands"][i][j]
+        if self.validation_log is not None:
+            self.validation_log.write(function_name, i, j, sample, is_correct, reason)
+        sample["is_correct"] = is_correct
+        sample["reason"] = reason
+
+    def validate_negative_sample(self, function_name, i, j, sample):
+        is_correct, reason = self.is_negative_sample_correct(
+            sample["incomplete_command"], sample["modified_incorrect_function_call"], self.function_params[function_name]
+        )
+        self.store_judgement(function_name, i, j, is_correct, reason)
+
     def validate_negative_samples_for_function(self, function_name):
         """Validates negative samples for a single function."""
-        function_data = self.data[function_name]
-        incomplete_calls = function_data["incomplete_commands"]
-        complete_calls = function_data["complete_commands"]
-        fn_calls = function_data["calls"]
-        
-        
-        fn = list(filter(lambda x: x['name'] == function_name, functions))[0]
-        params = list(fn['parameters']['properties'].keys())
-        
-        for i, call in enumerate(incomplete_calls):
-            fn_call = fn_calls[i]
-            complete_commads = complete_calls[i]
-            for j, incomplete_call in enumerate(call):
-                inc_command = incomplete_call["incomplete_command"]
-                inc_fn_call = incomplete_call["modified_incorrect_function_call"]
-                com_fn_call = fn_calls[i]
-                com_command = complete_commads[j]
-                is_correct, reason = self.is_negative_sample_correct(inc_command, inc_fn_call, params)
-                incomplete_calls[i][j]["is_correct"] = is_correct
-                incomplete_calls[i][j]["reason"] = reason
-        
-        function_data["incomplete_commands"] = incomplete_calls    
-    
+        for i, j, sample in list(self.negative_samples(function_name)):
+            self.validate_negative_sample(function_name, i, j, sample)
+
     def validate_negative_samples_for_all_functions(self, parallel=True):
-        """Validates negative samples for all functions using multithreading."""
-        if parallel:
-            with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
-                futures = [
-                    executor.submit(self.validate_negative_samples_for_function, function_name)
-                    for function_name in self.data.keys()
-                ]
-                for future in futures:
+        """
+        Validates negative samples for all functions. In parallel mode every sample is an
+        independent request, with at most max_threads requests queued ahead of the workers.
+        """
+        if not parallel:
+            for function_name in self.data.keys():
+                self.validate_negative_samples_for_function(function_name)
+            return
+
+        samples = [
+            (function_name, i, j, sample)
+            for function_name in self.data.keys()
+            for i, j, sample in self.negative_samples(function_name)
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
+            pending = {}
+            samples = iter(samples)
+            while True:
+                for function_name, i, j, sample in itertools.islice(samples, 2 * self.max_threads - len(pending)):
+                    future = executor.submit(self.validate_negative_sample, function_name, i, j, sample)
+                    pending[future] = sample
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    sample = pending.pop(future)
                     try:
                         future.result()
                     except Exception as exc:
-                        print(f"Error in validating negative samples: {exc}")
-        else:
-            for function_name in self.data.keys():
-                self.validate_negative_samples_for_function(function_name)
-    
+                        print(f"Error in validating negative sample {sample}: {exc}")
+
+    def load_generated_commands(self):
+        """Loads the generated commands from the output JSON file, for the validation stage."""
+        with open(self.output_file, 'r') as f:
+            self.data = json.load(f)
+
+    def open_validation_log(self):
+        """Opens the validation log and applies the judgements it already holds."""
+        if not self.validation_file:
+            return
+        self.validation_log = ValidationLog(self.validation_file, resume=self.resume, overwrite=self.overwrite_checkpoint)
+        restored = 0
+        for function_name in self.data.keys():
+            for i, j, sample in list(self.negative_samples(function_name)):
+                result = self.validation_log.get(function_name, i, j, sample)
+                if result is not None:
+                    sample["is_correct"], sample["reason"] = result
+                    restored += 1
+        if restored:
+            print(f"Resuming: {restored} negative samples already validated.")
+
+    def save_validated_commands(self):
+        """Saves the data with the negative-sample judgements to the output JSON file."""
+        if self.validation_log is not None:
+            self.validation_log.close()
+        with open(self.output_file, 'w') as f:
+            json.dump(self.data, f, indent=4)
+
+    def check_existing_logs(self, generate, validate):
+        """Refuses to start, before any request, when a log of a previous run would be discarded."""
+        if generate and self.checkpoint_file:
+            check_existing_log(self.checkpoint_file, self.resume, self.overwrite_checkpoint)
+        if validate and self.validation_file:
+            check_existing_log(self.validation_file, self.resume, self.overwrite_checkpoint)
+
+    def open_checkpoint(self):
+        if self.checkpoint_file:
+            self.checkpoint = GenerationCheckpoint(self.checkpoint_file, resume=self.resume, overwrite=self.overwrite_checkpoint)
+            if self.checkpoint.completed:
+                print(f"Resuming: {len(self.checkpoint.completed)} function calls already generated.")
+
     def save_commands(self):
         """Saves the data with generated commands to the output JSON file."""
         # import pdb; pdb.set_trace()
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+            export_checkpoint(self.checkpoint_file, self.data, self.output_file)
+            return
         with open(self.output_file, 'w') as f:
             json.dump(self.data, f, indent=4)
 
-    def run(self, parallel=True, type=CommandType.CORRECT_COMMANDS):
-        """Executes the entire command generation pipeline."""
-        self.load_function_calls()
-        
-        self.generate_commands_for_all_functions(parallel=parallel)
-        
-        # self.validate_negative_samples_for_all_functions(parallel=parallel)
-        
-        self.save_commands()
+    def run(self, parallel=True, type=CommandType.CORRECT_COMMANDS, validate=False, validate_only=False):
+        """
+        Executes the entire command generation pipeline.
+
+        :param validate: Judge the generated negative samples after generation.
+        :param validate_only: Only judge the negative samples already in the output file.
+        """
+        self.check_existing_logs(generate=not validate_only, validate=validate or validate_only)
+        if not validate_only:
+            self.load_function_calls()
+            self.open_checkpoint()
+            self.generate_commands_for_all_functions(parallel=parallel)
+            self.save_commands()
+
+        if validate or validate_only:
+            self.load_generated_commands()
+            self.open_validation_log()
+            self.validate_negative_samples_for_all_functions(parallel=parallel)
+            self.save_validated_commands()
+        self.report_cache()
+
+    def report_cache(self):
+        if self.cache is not None:
+            self.cache.flush()
+            print(f"LLM cache: {self.cache.metrics()}")
 
 def main():
     parser = argparse.ArgumentParser(description="Generate user commands for function calls using an LLM.")
@@ -253,6 +547,16 @@ def main():
     parser.add_argument('--max_threads', type=int, default=4, help='Maximum number of threads for parallel processing.')
     parser.add_argument('--batch_size', type=int, default=5, help='Number of commands to generate before pausing.')
     parser.add_argument('--parallel', action='store_true', help='Enable parallel processing.')
+    parser.add_argument('--cache_file', type=str, default=None, help='SQLite file caching LLM responses across runs (disabled when not given).')
+    parser.add_argument('--cache_max_entries', type=int, default=1000000, help='Maximum number of cached LLM responses.')
+    parser.add_argument('--checkpoint_file', type=str, default=None, help='JSONL file every finished call is appended to (default: output file with a .jsonl extension).')
+    parser.add_argument('--resume', action='store_true', help='Skip the calls already in the checkpoint file.')
+    parser.add_argument('--overwrite_checkpoint', action='store_true', help='Discard an existing checkpoint and validation log instead of refusing to start.')
+    parser.add_argument('--prompt_batch_size', type=int, default=1, help='Number of function calls packed into one request (1 disables batched prompting).')
+    parser.add_argument('--validate', action='store_true', help='Judge the generated negative samples after generation.')
+    parser.add_argument('--validate_only', action='store_true', help='Only judge the negative samples already in the output file.')
+    parser.add_argument('--validation_file', type=str, default=None, help='JSONL file every judgement is appended to (default: output file with a .validation.jsonl extension).')
+    add_backend_args(parser)
     
     
     
@@ -265,8 +569,20 @@ def main():
         sleep_interval=args.sleep_interval,
         max_threads=args.max_threads,
         batch_size=args.batch_size,
+        cache_file=args.cache_file,
+        cache_max_entries=args.cache_max_entries,
+        checkpoint_file=args.checkpoint_file or os.path.splitext(args.output_file)[0] + ".jsonl",
+        resume=args.resume,
+        prompt_batch_size=args.prompt_batch_size,
+        validation_file=args.validation_file or os.path.splitext(args.output_file)[0] + ".validation.jsonl",
+        llm_backend=args.llm_backend,
+        backend_options=backend_options(args),
+        overwrite_checkpoint=args.overwrite_checkpoint,
     )
-    generator.run(args.parallel, type=type)
+    try:
+        generator.run(args.parallel, type=type, validate=args.validate, validate_only=args.validate_only)
+    except FileExistsError as e:
+        parser.error(str(e))
 
 if __name__ == "__main__":
     start_time = time.time()
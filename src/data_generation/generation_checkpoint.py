@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import argparse
+import threading
+
+
+def read_records(path):
+    """Reads the complete records of a JSONL log, truncating a torn last line left by an interrupted run."""
+    records = []
+    valid_size = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+            valid_size += len(line)
+    if valid_size != os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(valid_size)
+    return records
+
+
+def check_existing_log(path, resume, overwrite):
+    """
+    Refuses to discard the log of a previous run: raises FileExistsError when path exists and
+    neither resume nor overwrite is set, so a plain rerun never deletes the progress of an
+    interrupted run.
+    """
+    if os.path.exists(path) and not (resume or overwrite):
+        raise FileExistsError(
+            f"{path} already exists. Pass --resume to continue the previous run, or "
+            f"--overwrite_checkpoint to discard it and start over."
+        )
+
+
+class GenerationCheckpoint:
+    """
+    Append-only JSONL log of generated commands, one record per completed function call:
+
+        {"function_name": ..., "call_index": ..., "call": ..., "complete_commands": [...], "incomplete_commands": [...]}
+
+    Records are flushed as soon as they are written, so an interrupted run loses at most the
+    calls that were in flight, and a resumed run skips every call already in the log.
+    """
+
+    def __init__(self, path, resume=False, overwrite=False):
+        """
+        :param path: Path of the JSONL file.
+        :param resume: Keep the existing records and append to them instead of starting over.
+        :param overwrite: Delete an existing log when not resuming; otherwise an existing log raises FileExistsError.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.completed = set()
+        check_existing_log(path, resume, overwrite)
+        if resume and os.path.exists(path):
+            self.completed = self.load_completed()
+        elif os.path.exists(path):
+            os.remove(path)
+        self.file = open(path, "a")
+
+    def load_completed(self):
+        """Reads the calls already in the log."""
+        return {
+            (record["function_name"], record["call_index"], record["call"])
+            for record in read_records(self.path)
+        }
+
+    def is_completed(self, function_name, call_index, call):
+        return (function_name, call_index, call) in self.completed
+
+    def write(self, function_name, call_index, call, complete_commands, incomplete_commands):
+        record = {
+            "function_name": function_name,
+            "call_index": call_index,
+            "call": call,
+            "complete_commands": complete_commands,
+            "incomplete_commands": incomplete_commands,
+        }
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            self.completed.add((function_name, call_index, call))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class ValidationLog:
+    """
+    Append-only JSONL log of negative-sample judgements, one record per incomplete command:
+
+        {"function_name": ..., "call_index": ..., "command_index": ..., "incomplete_command": ...,
+         "modified_incorrect_function_call": ..., "is_correct": ..., "reason": ...}
+    """
+
+    def __init__(self, path, resume=False, overwrite=False):
+        """
+        :param path: Path of the JSONL file.
+        :param resume: Keep the existing judgements and append to them instead of starting over.
+        :param overwrite: Delete an existing log when not resuming; otherwise an existing log raises FileExistsError.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.results = {}
+        check_existing_log(path, resume, overwrite)
+        if resume and os.path.exists(path):
+            for record in read_records(path):
+                self.results[self.key(record)] = (record["is_correct"], record["reason"])
+        elif os.path.exists(path):
+            os.remove(path)
+        self.file = open(path, "a")
+
+    @staticmethod
+    def key(record):
+        # The sample text is part of the key, so regenerated samples are judged again
+        return (record["function_name"], record["call_index"], record["command_index"],
+                record["incomplete_command"], record["modified_incorrect_function_call"])
+
+    def get(self, function_name, call_index, command_index, sample):
+        """Returns the logged (is_correct, reason) of an incomplete command sample, or None."""
+        return self.results.get(self.key({
+            "function_name": function_name,
+            "call_index": call_index,
+            "command_index": command_index,
+            **sample,
+        }))
+
+    def write(self, function_name, call_index, command_index, sample, is_correct, reason):
+        record = {
+            "function_name": function_name,
+            "call_index": call_index,
+            "command_index": command_index,
+            "incomplete_command": sample["incomplete_command"],
+            "modified_incorrect_function_call": sample["modified_incorrect_function_call"],
+            "is_correct": is_correct,
+            "reason": reason,
+        }
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            self.results[self.key(record)] = (is_correct, reason)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def index_checkpoint(path):
+    """Maps every logged (function_name, call_index, call) to the file offset of its latest record."""
+    index = {}
+    with open(path, "rb") as f:
+        offset = f.tell()
+        for line in iter(f.readline, b""):
+            if line.endswith(b"\n"):
+                record = json.loads(line)
+                index[(record["function_name"], record["call_index"], record["call"])] = offset
+            offset += len(line)
+    return index
+
+
+def export_checkpoint(checkpoint_file, data, output_file):
+    """
+    Writes the commands logged in checkpoint_file in the generate_user_command.py output format,
+    one function at a time, so only the records of a single function are held in memory.
+
+    :param data: Input function calls ({function_name: {"args": ..., "calls": [...]}}).
+    """
+    index = index_checkpoint(checkpoint_file)
+    missing = 0
+    with open(checkpoint_file, "rb") as f_in, open(output_file, "w") as f_out:
+        f_out.write("{")
+        for n, (function_name, function_data) in enumerate(data.items()):
+            function_data = dict(function_data)
+            function_data["complete_commands"] = []
+            function_data["incomplete_commands"] = []
+            for i, call in enumerate(function_data["calls"]):
+                offset = index.get((function_name, i, call))
+                if offset is None:
+                    missing += 1
+                    function_data["complete_commands"].append([])
+                    function_data["incomplete_commands"].append([])
+                    continue
+                f_in.seek(offset)
+                record = json.loads(f_in.readline())
+                function_data["complete_commands"].append(record["complete_commands"])
+                function_data["incomplete_commands"].append(record["incomplete_commands"])
+
+            body = json.dumps(function_data, indent=4).replace("\n", "\n    ")
+            f_out.write(("," if n else "") + f"\n    {json.dumps(function_name)}: {body}")
+        f_out.write("\n}")
+    if missing:
+        print(f"{missing} function calls have no generated commands yet (rerun with --resume to generate them).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a command generation JSONL checkpoint to the JSON output format.")
+    parser.add_argument('--input_file', type=str, required=True, help='Path to the input JSON file of function calls.')
+    parser.add_argument('--checkpoint_file', type=str, required=True, help='Path to the JSONL checkpoint.')
+    parser.add_argument('--output_file', type=str, required=True, help='Path to the output JSON file.')
+    args = parser.parse_args()
+
+    with open(args.input_file, 'r') as f:
+        data = json.load(f)
+    export_checkpoint(args.checkpoint_file, data, args.output_file)
+
+
+if __name__ == "__main__":
+    start_time = time.time()
+    main()
+    print(f"Execution completed in {time.time() - start_time:.2f} seconds.")
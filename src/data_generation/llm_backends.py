@@ -0,0 +1,197 @@
+import os
+import re
+import time
+import random
+import asyncio
+import hashlib
+from langchain_openai import AzureChatOpenAI
+from langchain_core.runnables import RunnableLambda
+
+from user_command_config import CorrectCommandsOutput, IncompleteCommandOutput, SampleCorrectnessJudgement, \
+    BatchedCorrectCommandsOutput, BatchedIncompleteCommandsOutput
+
+LLM_BACKENDS = ["azure", "fake"]
+
+COMMAND_TEMPLATES = [
+    "{}",
+    "please {}",
+    "can you {}",
+    "I'd like you to {}",
+    "{} right now",
+    "could you {} for me",
+    "hey, {}",
+]
+
+
+class FakeLLMError(Exception):
+    """Injected transient failure of the fake backend."""
+
+
+class FakeRateLimitError(Exception):
+    """Injected HTTP 429 of the fake backend, shaped like the openai client's RateLimitError."""
+
+    status_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__("Rate limit is exceeded.")
+        self.response = type("Response", (), {"status_code": 429, "headers": {"retry-after": str(retry_after)}})()
+
+
+def describe_call(function_call):
+    """Turns set_temperature(temperature=25, zone=['driver']) into 'set temperature 25 driver'."""
+    name = function_call.split("(")[0].replace("_", " ")
+    values = re.findall(r"=\s*([^,()\[\]]+|\[[^\]]*\])", function_call)
+    values = [re.sub(r"[\[\]'\"]", "", value).strip() for value in values]
+    return " ".join([name] + [value for value in values if value])
+
+
+def numbered_items(text):
+    """Reads the '[i] item' lines of a batched prompt."""
+    return re.findall(r"^\[(\d+)\] (.*)$", text, flags=re.MULTILINE)
+
+
+def prompt_field(text, name):
+    match = re.search(rf"<{name}> is (.*)", text)
+    return match.group(1).strip() if match else ""
+
+
+class FakeChatModel:
+    """
+    Local, deterministic stand-in for AzureChatOpenAI.
+
+    with_structured_output returns a runnable producing schema-valid CorrectCommandsOutput,
+    IncompleteCommandOutput and SampleCorrectnessJudgement objects (and their batched variants)
+    derived from the prompt, after a configurable latency. A configurable fraction of requests
+    fails with a transient error or an HTTP 429. Outputs depend only on the prompt, the
+    temperature and the seed, so runs are reproducible.
+    """
+
+    def __init__(self, temperature=0.9, latency=0.2, error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0,
+                 correct_rate=0.7, seed=42, deployment_name="fake"):
+        """
+        :param latency: Mean latency of a request in seconds.
+        :param error_rate: Fraction of requests failing with a transient error.
+        :param rate_limit_rate: Fraction of requests failing with an HTTP 429.
+        :param retry_after: Retry-After (seconds) attached to injected 429s.
+        :param correct_rate: Fraction of negative samples judged correct.
+        :param seed: Seed of the generated outputs, of the latencies and of the injected failures.
+        """
+        self.temperature = temperature
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.correct_rate = correct_rate
+        self.seed = seed
+        self.deployment_name = deployment_name
+        self.failure_rng = random.Random(seed)
+        self.latency_rng = random.Random(seed)
+
+    def with_structured_output(self, parser):
+        return RunnableLambda(
+            lambda prompt_value: self.invoke(parser, prompt_value),
+            afunc=lambda prompt_value: self.ainvoke(parser, prompt_value),
+        )
+
+    def request_latency(self):
+        return max(0.0, self.latency_rng.gauss(self.latency, self.latency * 0.1))
+
+    def maybe_fail(self):
+        draw = self.failure_rng.random()
+        if draw < self.rate_limit_rate:
+            raise FakeRateLimitError(self.retry_after)
+        if draw < self.rate_limit_rate + self.error_rate:
+            raise FakeLLMError("Injected LLM failure.")
+
+    def invoke(self, parser, prompt_value):
+        time.sleep(self.request_latency())
+        self.maybe_fail()
+        return self.respond(parser, prompt_value)
+
+    async def ainvoke(self, parser, prompt_value):
+        await asyncio.sleep(self.request_latency())
+        self.maybe_fail()
+        return self.respond(parser, prompt_value)
+
+    def respond(self, parser, prompt_value):
+        text = "\n".join(str(message.content) for message in prompt_value.to_messages())
+        digest = hashlib.sha256(f"{self.seed}:{self.temperature}:{text}".encode("utf-8")).digest()
+        rng = random.Random(digest)
+
+        if parser is CorrectCommandsOutput:
+            return CorrectCommandsOutput(commands=self.commands(prompt_field(text, "FUNCTION_CALL"), rng))
+        if parser is BatchedCorrectCommandsOutput:
+            return BatchedCorrectCommandsOutput(results=[
+                {"call_id": int(i), "commands": self.commands(call, rng)} for i, call in numbered_items(text)
+            ])
+        if parser is IncompleteCommandOutput:
+            return IncompleteCommandOutput(**self.incomplete_command(
+                prompt_field(text, "CORRECT_FUNCTION_CALL"), prompt_field(text, "COMPLETE_COMMAND")
+            ))
+        if parser is BatchedIncompleteCommandsOutput:
+            function_call = prompt_field(text, "CORRECT_FUNCTION_CALL")
+            return BatchedIncompleteCommandsOutput(results=[
+                {"command_id": int(i), **self.incomplete_command(function_call, command)}
+                for i, command in numbered_items(text)
+            ])
+        if parser is SampleCorrectnessJudgement:
+            judgement = rng.random() < self.correct_rate
+            reason = "The parameters match the command." if judgement else "The function call has extra parameters."
+            return SampleCorrectnessJudgement(judgement=judgement, reason=reason)
+        raise ValueError(f"The fake LLM backend does not support {parser.__name__}")
+
+    def commands(self, function_call, rng, n=5):
+        description = describe_call(function_call)
+        return [template.format(description) for template in rng.sample(COMMAND_TEMPLATES, n)]
+
+    def incomplete_command(self, function_call, command):
+        name = function_call.split("(")[0]
+        if "(" not in function_call or function_call.rstrip().endswith("()"):
+            return {"incomplete_command": "", "modified_incorrect_function_call": ""}
+        words = command.split()
+        return {
+            "incomplete_command": " ".join(words[:max(1, len(words) // 2)]),
+            "modified_incorrect_function_call": f"{name}()",
+        }
+
+
+def create_llm(backend="azure", temperature=0.9, max_retries=2, **options):
+    """
+    Creates the chat model of a backend.
+
+    :param backend: "azure" (AzureChatOpenAI configured from the environment) or "fake" (FakeChatModel).
+    :param options: Extra options of the fake backend (latency, error_rate, rate_limit_rate, ...).
+    """
+    if backend == "azure":
+        return AzureChatOpenAI(
+            azure_endpoint=os.getenv("AZURE_ENDPOINT"),
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            deployment_name=os.getenv("DEPLOYMENT_NAME"),
+            openai_api_version=os.getenv("OPENAI_API_VERSION"),
+            temperature=temperature,
+            max_tokens=None,
+            timeout=None,
+            max_retries=max_retries,
+        )
+    if backend == "fake":
+        return FakeChatModel(temperature=temperature, **options)
+    raise ValueError(f"Unknown LLM backend {backend}, expected one of {LLM_BACKENDS}")
+
+
+def add_backend_args(parser):
+    """Adds the LLM backend arguments shared by the generation scripts."""
+    parser.add_argument('--llm_backend', type=str, default="azure", choices=LLM_BACKENDS, help='LLM backend to generate with.')
+    parser.add_argument('--fake_latency', type=float, default=0.2, help='Mean request latency of the fake backend in seconds.')
+    parser.add_argument('--fake_error_rate', type=float, default=0.0, help='Fraction of fake backend requests failing with an error.')
+    parser.add_argument('--fake_rate_limit_rate', type=float, default=0.0, help='Fraction of fake backend requests failing with a 429.')
+
+
+def backend_options(args):
+    """Backend options from the arguments added by add_backend_args."""
+    if args.llm_backend != "fake":
+        return {}
+    return {
+        "latency": args.fake_latency,
+        "error_rate": args.fake_error_rate,
+        "rate_limit_rate": args.fake_rate_limit_rate,
+    }
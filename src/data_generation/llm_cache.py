@@ -0,0 +1,151 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+def schema_fingerprint(parser):
+    """JSON schema of a structured-output parser, so changing the schema invalidates its entries."""
+    if hasattr(parser, "schema"):
+        return parser.schema()
+    return getattr(parser, "__name__", str(parser))
+
+
+class LLMResponseCache:
+    """
+    Content-addressed SQLite cache of structured LLM responses.
+
+    Entries are keyed by a hash of the prompt template, the prompt inputs, the model deployment,
+    the temperature, the output schema and the sample index of the request, and hold the parsed
+    response as JSON. When more than max_entries are stored, the least recently used entries are
+    evicted in batches of evict_batch_size.
+
+    Writes and access-time updates are buffered and committed every commit_interval operations
+    (and by flush / close), so lookups and inserts do not each pay for a transaction.
+    """
+
+    def __init__(self, path, max_entries=1000000, commit_interval=100, evict_batch_size=None):
+        """
+        :param path: Path of the SQLite database file.
+        :param max_entries: Maximum number of cached responses.
+        :param commit_interval: Number of buffered inserts and access-time updates per commit.
+        :param evict_batch_size: Number of entries evicted at once, defaults to 1% of max_entries.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.commit_interval = commit_interval
+        self.evict_batch_size = evict_batch_size or max(1, max_entries // 100)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.conn.commit()
+        # Running row count, so inserts never count the table
+        self.size = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        self.pending_access = {}
+        self.pending_writes = 0
+
+    @staticmethod
+    def make_key(prompt_message, inputs, deployment, temperature, parser, sample=0):
+        """
+        :param sample: Index of the request among identical requests, so repeated sampled
+                       requests are cached as distinct responses.
+        """
+        payload = {
+            "prompt": prompt_message,
+            "inputs": inputs,
+            "deployment": deployment,
+            "temperature": temperature,
+            "schema": schema_fingerprint(parser),
+            "sample": sample,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Returns the cached response dict for key, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.pending_access[key] = time.time()
+            self.maybe_commit()
+            return json.loads(row[0])
+
+    def put(self, key, response):
+        with self.lock:
+            now = time.time()
+            inserted = self.conn.execute(
+                "INSERT OR IGNORE INTO responses (key, response, last_access) VALUES (?, ?, ?)",
+                (key, json.dumps(response), now),
+            ).rowcount
+            if inserted:
+                self.size += 1
+            else:
+                self.conn.execute(
+                    "UPDATE responses SET response = ?, last_access = ? WHERE key = ?",
+                    (json.dumps(response), now, key),
+                )
+            self.pending_access.pop(key, None)
+            self.pending_writes += 1
+            if self.size > self.max_entries:
+                self.evict()
+            self.maybe_commit()
+
+    def evict(self):
+        """Deletes the least recently used entries down to evict_batch_size below max_entries."""
+        self.write_access_times()
+        excess = self.size - self.max_entries + self.evict_batch_size
+        deleted = self.conn.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+            (excess,),
+        ).rowcount
+        self.size -= deleted
+        self.evictions += deleted
+
+    def write_access_times(self):
+        if self.pending_access:
+            self.conn.executemany(
+                "UPDATE responses SET last_access = ? WHERE key = ?",
+                [(last_access, key) for key, last_access in self.pending_access.items()],
+            )
+            self.pending_access = {}
+
+    def maybe_commit(self):
+        if self.pending_writes + len(self.pending_access) >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self.write_access_times()
+        self.conn.commit()
+        self.pending_writes = 0
+
+    def flush(self):
+        """Commits the buffered inserts and access-time updates."""
+        with self.lock:
+            self.commit()
+
+    def metrics(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.conn.close()
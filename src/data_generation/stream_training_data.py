@@ -0,0 +1,225 @@
+import os
+import sys
+import time
+import random
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from schema_registry import registry
+from utils import JsonStreamReader
+from training_data_format import MessageWriter, ARROW_EXTENSION
+from generate_training_data import extract_function_name_and_parameters, complete_message, incomplete_message
+
+
+def iter_function_entries(data_file, chunk_size=1 << 20):
+    """
+    Streams the generate_user_command.py output {fn: {"args": [...], "calls": [...],
+    "complete_commands": [...], "incomplete_commands": [...]}} without loading it.
+
+    Yields (fn, key, value) for the small fields and (fn, key, (i, item)) for every item of
+    the complete_commands / incomplete_commands lists, so only one call's commands are held
+    in memory at a time.
+    """
+    with open(data_file, "r") as f:
+        reader = JsonStreamReader(f, chunk_size)
+        reader.expect("{")
+        while not reader.skip("}"):
+            fn = reader.read_value()
+            reader.expect(":")
+            reader.expect("{")
+            while not reader.skip("}"):
+                key = reader.read_value()
+                reader.expect(":")
+                if key in ("complete_commands", "incomplete_commands"):
+                    reader.expect("[")
+                    i = 0
+                    while not reader.skip("]"):
+                        yield fn, key, (i, reader.read_value())
+                        i += 1
+                        reader.skip(",")
+                else:
+                    yield fn, key, reader.read_value()
+                reader.skip(",")
+            reader.skip(",")
+
+
+def extract_many(function_calls):
+    """Parses a chunk of modified function calls in a worker process."""
+    return [extract_function_name_and_parameters(function_call) for function_call in function_calls]
+
+
+class StreamingTrainingDataBuilder:
+    """
+    Builds the generate_training_data.py output from arbitrarily large generation output in
+    bounded memory: the input is read incrementally, modified function calls are parsed on a
+    process pool with identical call strings parsed once (LRU memo), and messages pass through
+    a shuffle buffer of shuffle_buffer_size per split file before being appended to it in
+    shuffled record batches of shard_size. Samples are assigned to the test split with
+    probability test_fraction.
+
+    The input is grouped by function, so the files are only as well mixed as the buffer allows:
+    with a buffer holding a whole split they match the global shuffle of generate_training_data.py,
+    with a smaller one nearby rows still tend to share a function. ModelTrainer permutes the rows
+    again when it splits them, so training is unaffected either way.
+    """
+
+    def __init__(self, data_file, output_file, num_workers=None, parse_batch_size=20000, shard_size=10000,
+                 cache_max_entries=200000, test_fraction=0.2, seed=42, shuffle_buffer_size=100000):
+        """
+        :param parse_batch_size: Number of incomplete samples whose calls are parsed together.
+        :param shard_size: Number of messages shuffled and written per record batch of a split file.
+        :param cache_max_entries: Maximum number of memoized parsed calls.
+        :param shuffle_buffer_size: Messages held per split file to draw the written ones from at
+                                    random (0 only shuffles within each record batch).
+        """
+        self.data_file = data_file
+        self.output_file = output_file
+        self.num_workers = num_workers or os.cpu_count()
+        self.parse_batch_size = parse_batch_size
+        self.shard_size = shard_size
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.cache_max_entries = cache_max_entries
+        self.test_fraction = test_fraction
+        self.rng = random.Random(seed)
+        self.parsed_calls = OrderedDict()
+        self.cache_hits = 0
+        self.writers = {}
+        self.shards = {}
+        self.shuffle_buffers = {}
+        self.pending_incomplete = []
+        self.skipped = 0
+
+    def open_writers(self):
+        for suffix in ["complete", "incomplete"]:
+            for split in ["train", "test"]:
+                path = f"{self.output_file}-{split}_{suffix}{ARROW_EXTENSION}"
+                self.writers[(split, suffix)] = MessageWriter(path)
+                self.shards[(split, suffix)] = []
+                self.shuffle_buffers[(split, suffix)] = []
+
+    def add_message(self, suffix, message):
+        split = "test" if self.rng.random() < self.test_fraction else "train"
+        if self.shuffle_buffer_size:
+            # Once the buffer is full, every new message replaces a random buffered one, which is written instead
+            buffer = self.shuffle_buffers[(split, suffix)]
+            if len(buffer) < self.shuffle_buffer_size:
+                buffer.append(message)
+                return
+            j = self.rng.randrange(len(buffer))
+            buffer[j], message = message, buffer[j]
+        shard = self.shards[(split, suffix)]
+        shard.append(message)
+        if len(shard) >= self.shard_size:
+            self.flush_shard(split, suffix)
+
+    def flush_shard(self, split, suffix):
+        shard = self.shards[(split, suffix)]
+        self.rng.shuffle(shard)
+        self.writers[(split, suffix)].write(shard)
+        self.shards[(split, suffix)] = []
+
+    def flush_remaining(self, split, suffix):
+        """Writes the partial shard and the shuffle buffer of a split file, shuffled together."""
+        remaining = self.shards[(split, suffix)] + self.shuffle_buffers[(split, suffix)]
+        self.shuffle_buffers[(split, suffix)] = []
+        self.rng.shuffle(remaining)
+        for start in range(0, len(remaining), self.shard_size):
+            self.writers[(split, suffix)].write(remaining[start:start + self.shard_size])
+        self.shards[(split, suffix)] = []
+
+    def parse_calls(self, function_calls, executor):
+        """Returns the parsed function calls, parsing only the ones not memoized yet."""
+        missing = list(dict.fromkeys(call for call in function_calls if call not in self.parsed_calls))
+        self.cache_hits += len(function_calls) - len(missing)
+        if missing:
+            chunk_size = max(1, -(-len(missing) // (self.num_workers * 4)))
+            chunks = [missing[start:start + chunk_size] for start in range(0, len(missing), chunk_size)]
+            for chunk, results in zip(chunks, executor.map(extract_many, chunks)):
+                for function_call, result in zip(chunk, results):
+                    self.parsed_calls[function_call] = result
+        results = []
+        for function_call in function_calls:
+            self.parsed_calls.move_to_end(function_call)
+            results.append(self.parsed_calls[function_call])
+        while len(self.parsed_calls) > self.cache_max_entries:
+            self.parsed_calls.popitem(last=False)
+        return results
+
+    def flush_incomplete(self, executor):
+        samples = self.pending_incomplete
+        self.pending_incomplete = []
+        parsed = self.parse_calls([sample['modified_incorrect_function_call'] for sample in samples], executor)
+        for sample, fn_args in zip(samples, parsed):
+            message = incomplete_message(
+                sample['incomplete_command'], sample['modified_incorrect_function_call'], fn_args, verbose=False
+            )
+            if message is None:
+                self.skipped += 1
+            else:
+                self.add_message("incomplete", message)
+
+    def run(self):
+        self.open_writers()
+        fn_args = []
+        try:
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                for fn, key, value in iter_function_entries(self.data_file):
+                    if key == "args":
+                        fn_args = value
+                    elif key == "complete_commands":
+                        i, commands = value
+                        for command in commands:
+                            self.add_message("complete", complete_message(fn, command, fn_args[i]))
+                    elif key == "incomplete_commands":
+                        # Functions without required parameters are covered by their complete commands
+                        if len(registry[fn].required) == 0:
+                            continue
+                        _, samples = value
+                        self.pending_incomplete.extend(sample for sample in samples if sample['incomplete_command'])
+                        if len(self.pending_incomplete) >= self.parse_batch_size:
+                            self.flush_incomplete(executor)
+                if self.pending_incomplete:
+                    self.flush_incomplete(executor)
+            for split, suffix in self.shards:
+                self.flush_remaining(split, suffix)
+        finally:
+            for writer in self.writers.values():
+                writer.close()
+
+    def report(self):
+        for (split, suffix), writer in self.writers.items():
+            print(f"{self.output_file}-{split}_{suffix}{ARROW_EXTENSION}: {writer.num_rows} messages")
+        print(f"Parsed call cache hits: {self.cache_hits}, unparseable modified calls skipped: {self.skipped}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the function calling training data from large generation output in bounded memory')
+    parser.add_argument('--output_file', type=str, default='car_finetuning_gpt', help='Output file path prefix')
+    parser.add_argument('--data_file', type=str, default='./data/function_calls_with_commands.json', help='Data file path')
+    parser.add_argument('--num_workers', type=int, default=None, help='Worker processes parsing function calls, defaults to the number of CPUs')
+    parser.add_argument('--parse_batch_size', type=int, default=20000, help='Incomplete samples whose calls are parsed together')
+    parser.add_argument('--shard_size', type=int, default=10000, help='Messages shuffled and written together')
+    parser.add_argument('--shuffle_buffer_size', type=int, default=100000,
+                        help='Messages buffered per split file to shuffle across the input. The input is grouped by '
+                             'function, so the output matches the global shuffle of generate_training_data.py only when '
+                             'the buffer holds a whole split; with a smaller one nearby rows tend to share a function '
+                             '(the trainer permutes the rows again, so training is unaffected)')
+    parser.add_argument('--cache_max_entries', type=int, default=200000, help='Maximum number of memoized parsed calls')
+    parser.add_argument('--test_fraction', type=float, default=0.2, help='Fraction of samples in the test split')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the split assignment and the shuffling')
+    args = parser.parse_args()
+
+    builder = StreamingTrainingDataBuilder(
+        args.data_file, args.output_file, num_workers=args.num_workers, parse_batch_size=args.parse_batch_size,
+        shard_size=args.shard_size, cache_max_entries=args.cache_max_entries, test_fraction=args.test_fraction,
+        seed=args.seed, shuffle_buffer_size=args.shuffle_buffer_size,
+    )
+    builder.run()
+    builder.report()
+
+
+if __name__ == "__main__":
+    start_time = time.time()
+    main()
+    print(f"Execution completed in {time.time() - start_time:.2f} seconds.")
@@ -0,0 +1,168 @@
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fill_schema(schema, definitions=None, index=0):
+    """
+    Builds a placeholder value satisfying a JSON schema (objects, arrays, strings, numbers, booleans).
+    Integer *_id fields of array items are numbered by their position, like batched responses.
+    """
+    definitions = definitions or schema.get("definitions") or schema.get("$defs") or {}
+    if "$ref" in schema:
+        return fill_schema(definitions[schema["$ref"].split("/")[-1]], definitions, index)
+    for key in ("anyOf", "oneOf", "allOf"):
+        if key in schema:
+            options = [s for s in schema[key] if s.get("type") != "null"] or schema[key]
+            return fill_schema(options[0], definitions, index)
+    if "enum" in schema:
+        return schema["enum"][0]
+
+    schema_type = schema.get("type", "object")
+    if isinstance(schema_type, list):
+        schema_type = next((t for t in schema_type if t != "null"), "null")
+    if schema_type == "object":
+        return {
+            name: index if name.endswith("_id") and prop.get("type") == "integer" else fill_schema(prop, definitions)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        return [fill_schema(schema.get("items", {}), definitions, i) for i in range(3)]
+    if schema_type == "string":
+        return f"stub {uuid.uuid4().hex[:8]}"
+    if schema_type == "integer":
+        return 1
+    if schema_type == "number":
+        return 1.0
+    if schema_type == "boolean":
+        return True
+    return None
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """
+    Answers OpenAI / Azure OpenAI chat completion requests with schema-valid placeholder
+    output after a configurable latency, and returns 429s at a configurable rate.
+    """
+
+    def do_POST(self):
+        if not self.path.split("?")[0].endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        server.count("requests")
+        if random.random() < server.rate_limit_probability:
+            server.count("rate_limited")
+            self.send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                           headers={"Retry-After": str(server.retry_after)})
+            return
+
+        time.sleep(max(0.0, random.gauss(server.latency, server.latency * 0.1)))
+        self.send_json(200, self.completion(body))
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            with self.server.lock:
+                self.send_json(200, dict(self.server.counters))
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def completion(self, body):
+        message = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+        tools = body.get("tools") or []
+        response_format = body.get("response_format") or {}
+        if tools:
+            function = tools[0]["function"]
+            message["tool_calls"] = [{
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": function["name"], "arguments": json.dumps(fill_schema(function.get("parameters", {})))},
+            }]
+            finish_reason = "tool_calls"
+        elif response_format.get("type") == "json_schema":
+            message["content"] = json.dumps(fill_schema(response_format["json_schema"]["schema"]))
+        elif response_format.get("type") == "json_object":
+            message["content"] = "{}"
+        else:
+            message["content"] = "stub response"
+
+        prompt_chars = sum(len(str(m.get("content") or "")) for m in body.get("messages", []))
+        completion_chars = len(json.dumps(message))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model") or "stub",
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_chars // 4,
+                "completion_tokens": completion_chars // 4,
+                "total_tokens": (prompt_chars + completion_chars) // 4,
+            },
+        }
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, latency=0.2, rate_limit_probability=0.0, retry_after=1.0):
+        """
+        :param latency: Mean latency of a completion in seconds.
+        :param rate_limit_probability: Fraction of requests answered with a 429.
+        :param retry_after: Retry-After header (seconds) sent with every 429.
+        """
+        super().__init__(address, StubLLMHandler)
+        self.latency = latency
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.counters = {"requests": 0, "rate_limited": 0}
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of an (Azure) OpenAI chat completions endpoint.")
+    parser.add_argument('--host', type=str, default="127.0.0.1", help='Host to bind to.')
+    parser.add_argument('--port', type=int, default=8001, help='Port to listen on.')
+    parser.add_argument('--latency', type=float, default=0.2, help='Mean latency of a completion in seconds.')
+    parser.add_argument('--rate_limit_probability', type=float, default=0.0, help='Fraction of requests answered with a 429.')
+    parser.add_argument('--retry_after', type=float, default=1.0, help='Retry-After seconds sent with every 429.')
+    args = parser.parse_args()
+
+    server = StubLLMServer((args.host, args.port), args.latency, args.rate_limit_probability, args.retry_after)
+    print(f"Stub LLM server listening on http://{args.host}:{args.port}")
+    print(f"Point AZURE_ENDPOINT at http://{args.host}:{args.port} to generate against it.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
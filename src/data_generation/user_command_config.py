@@ -25,6 +25,21 @@ class IncompleteCommandOutput(BaseModel):
 class IncompleteCommands(BaseModel):
     incomplete_commands: List[IncompleteCommandOutput] = Field(..., description="List of incomplete user commands generated for the function call.")
 
+class BatchedCallCommands(BaseModel):
+    call_id: int = Field(..., description="Number of the function call the commands were generated for.")
+    commands: List[str] = Field(..., description="List of user commands generated for the function call.")
+
+class BatchedCorrectCommandsOutput(BaseModel):
+    results: List[BatchedCallCommands] = Field(..., description="User commands generated for every function call, one entry per function call.")
+
+class BatchedIncompleteCommandOutput(BaseModel):
+    command_id: int = Field(..., description="Number of the complete command the incomplete command was generated from.")
+    incomplete_command: str|None = Field(..., description="Incomplete user command generated for the function call.")
+    modified_incorrect_function_call: str|None = Field(..., description="Modified function call with missing values.")
+
+class BatchedIncompleteCommandsOutput(BaseModel):
+    results: List[BatchedIncompleteCommandOutput] = Field(..., description="Incomplete user command generated for every complete command, one entry per complete command.")
+
 class SampleCorrectnessJudgement(BaseModel):
     judgement: bool = Field(..., description="Judgement of correctness of the modified function call.")
     reason: str = Field(..., description="Reason for the judgement.")
@@ -114,6 +129,24 @@ complete_command_gen_prompt = [
 
             ]
 
+# Same instructions as complete_command_gen_prompt, for several numbered function calls in one request
+complete_command_gen_prompt_batched = complete_command_gen_prompt[:-2] + [
+(
+    "human",
+    "You are given several numbered function calls in <FUNCTION_CALLS>. Treat each of them as its own \
+    <FUNCTION_CALL> and follow all of the instructions above for each of them independently."
+),
+(
+    "human",
+    "For every function call, output its call_id (the number in square brackets) together with its list of \
+    5 diverse, natural-sounding sentences, and nothing else. Output exactly one entry per function call."
+),
+(
+    "human",
+    "<FUNCTION_CALLS> are:\n{function_calls}"
+)
+]
+
 incomplete_command_gen_prompt = \
     [
         (
@@ -220,6 +253,16 @@ incomplete_command_gen_prompt_reinforced = \
         
     ]
 
+# Same instructions as incomplete_command_gen_prompt_reinforced, for all complete commands of one call in one request
+incomplete_command_gen_prompt_batched = incomplete_command_gen_prompt_reinforced[:-5] + [
+("human", "You are given one <CORRECT_FUNCTION_CALL> and several numbered <COMPLETE_COMMANDS>. Treat each of them as its own <COMPLETE_COMMAND> and follow the guidelines above for each of them independently."),
+("human", "Your Output:"),
+("human", "For every complete command, output its command_id (the number in square brackets), the <INCOMPLETE_COMMAND> and the corresponding <MODIFIED_INCORRECT_FUNCTION_CALL>. Output exactly one entry per complete command. Provide no explanations or additional text."),
+("human", "Input:"),
+("human", "<CORRECT_FUNCTION_CALL> is {function_call}"),
+("human", "<COMPLETE_COMMANDS> are:\n{commands}")
+]
+
 incorrectness_judgement_prompt = \
     [
         ("system","You are AI assistant whose task is to judge."),
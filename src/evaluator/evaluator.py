@@ -1,11 +1,73 @@
 import os
 import json
+import time
 import argparse
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from utils import convert_command
-from config import ErrorType, functions
+from utils import convert_command, parse_function_calls, iter_json_array
+from config import ErrorType
+from schema_registry import registry
+
+DEFUNCTIONING_ERRORS = ['gt_defunctioning_error', 'pred_defunctioning_error']
+
+
+def iter_results(result_file):
+    """Yields the outputs of a JSONL result file (one per line) or of a JSON array result file."""
+    with open(result_file, "r") as f:
+        if result_file.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(f)
+
+
+def iter_chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def evaluate_chunk(outputs):
+    """
+    Evaluates a chunk of outputs in a worker process.
+
+    :return: Tuple of the counters ({fn: {'total', 'correct'}} plus the number of defunctioning
+             errors) and the per-sample detail records.
+    """
+    evaluator = Evaluator(None)
+    evaluator.results = outputs
+    evaluator.process_results()
+
+    counters, details = {}, []
+    for key, value in evaluator.eval_result.items():
+        if key in DEFUNCTIONING_ERRORS:
+            counters[key] = len(value)
+            details.extend({'function': None, 'error': key, 'response': response} for response in value)
+        else:
+            counters[key] = {'total': value['total'], 'correct': value['correct']}
+            details.extend(dict(sample, function=key) for sample in value.get('samples', []))
+    return counters, details
+
+
+def merge_counters(total, counters):
+    """Adds the counters of a chunk to the running totals."""
+    for key, value in counters.items():
+        if key in DEFUNCTIONING_ERRORS:
+            total[key] = total.get(key, 0) + value
+        else:
+            merged = total.setdefault(key, {'total': 0, 'correct': 0})
+            merged['total'] += value['total']
+            merged['correct'] += value['correct']
+
 
 class Evaluator:
     def __init__(self, result_file):
@@ -20,23 +82,60 @@ class Evaluator:
 
     def save_eval_results(self):
         """Saves the evaluation results to a JSON file."""
-        output_file = self.result_file.replace(".json", "_eval_metrics.json")
+        output_file = os.path.splitext(self.result_file)[0] + "_eval_metrics.json"
         with open(output_file, "w") as f:
             json.dump(self.eval_result, f)
 
+    def evaluate_stream(self, details_file=None, num_workers=None, chunk_size=1000):
+        """
+        Evaluates the result file without loading it: outputs are read incrementally, evaluated
+        in chunks of chunk_size on a process pool, and the per-sample details are streamed to a
+        JSONL file. At most two chunks per worker are in flight, so memory stays bounded.
+
+        self.eval_result only keeps the merged counters: {fn: {'total', 'correct'}} and the
+        number of gt / pred defunctioning errors.
+
+        :param details_file: JSONL file of the per-sample details, defaults to <result_file>_eval_details.jsonl.
+        :param num_workers: Number of worker processes, defaults to the number of CPUs.
+        """
+        num_workers = num_workers or os.cpu_count()
+        details_file = details_file or os.path.splitext(self.result_file)[0] + "_eval_details.jsonl"
+        self.eval_result = {}
+
+        with ProcessPoolExecutor(max_workers=num_workers) as executor, open(details_file, "w") as f:
+            pending = deque()
+
+            def collect():
+                # Chunks are collected in submission order, so the details keep the input order
+                counters, details = pending.popleft().result()
+                merge_counters(self.eval_result, counters)
+                f.writelines(json.dumps(record) + "\n" for record in details)
+
+            for chunk in iter_chunks(iter_results(self.result_file), chunk_size):
+                pending.append(executor.submit(evaluate_chunk, chunk))
+                if len(pending) >= 2 * num_workers:
+                    collect()
+            while pending:
+                collect()
+
     def process_results(self):
         """Processes each output in the results."""
-        for output in self.results:
-            self.process_output(output)
+        # Batch parsing parses repeated responses (ground truths especially) only once
+        gt_fn_calls = parse_function_calls([output['assistant'] for output in self.results])
+        pred_fn_calls = parse_function_calls([output['model_response'] for output in self.results])
+        for output, gt_fn_call, pred_fn_call in zip(self.results, gt_fn_calls, pred_fn_calls):
+            self.process_output(output, gt_fn_call, pred_fn_call)
 
-    def process_output(self, output):
-        """Processes a single output."""
+    def process_output(self, output, gt_fn_call=None, pred_fn_call=None):
+        """Processes a single output, optionally with its already parsed ground truth and prediction."""
         gt = output['assistant']
         pred = output['model_response']
         user_command = output['user']
 
-        gt_fn_call = convert_command(gt)
-        pred_fn_call = convert_command(pred)
+        if gt_fn_call is None:
+            gt_fn_call = convert_command(gt)
+        if pred_fn_call is None:
+            pred_fn_call = convert_command(pred)
 
         if 'error' in gt_fn_call:
             self.eval_result.setdefault('gt_defunctioning_error', []).append(gt)
@@ -82,11 +181,9 @@ class Evaluator:
                 if key not in pred_properties:
                     self.append_error_to_sample(sample_res, ErrorType.MISSING_PARAMETER, key, gt_properties[key], None)
                 elif gt_properties[key] != pred_properties[key]:
-                    fn_details = next(fn for fn in functions if fn['name'] == gt_fn)
-                    param_details = fn_details['parameters']['properties'][key]
-                    param_type = param_details['type']
-                    if 'array' not in param_type:
-                        if 'enum' in param_details and pred_properties[key] not in param_details['enum']:
+                    param = registry[gt_fn].parameters[key]
+                    if not param.is_array:
+                        if not param.in_enum(pred_properties[key]):
                             self.append_error_to_sample(sample_res, ErrorType.HALLUCINATED_PARAMETER_VALUE, key, gt_properties[key], pred_properties[key])
                         else:
                             self.append_error_to_sample(sample_res, ErrorType.INCORRECT_PARAMETER_VALUE, key, gt_properties[key], pred_properties[key])
@@ -101,7 +198,7 @@ class Evaluator:
                             # loop through all values of pred_values and check if they are in gt_values
                             for pred_value in pred_values:
                                 if pred_value not in gt_values:
-                                    if 'enum' in param_details and pred_value not in param_details['enum']:
+                                    if not param.in_enum(pred_value):
                                         self.append_error_to_sample(sample_res, ErrorType.HALLUCINATED_ARRAY_ELEMENT, key, gt_values, pred_values)
                                     else:
                                         self.append_error_to_sample(sample_res, ErrorType.INCORRECT_ARRAY_ELEMENT, key, gt_values, pred_values)
@@ -133,8 +230,7 @@ class Evaluator:
     def append_function_error(self, sample_res, gt_fn_name, pred_fn_name):
         """Appends a function-level error to the sample result."""
         sample_res.setdefault('errors', [])
-        allowed_pred_fns = [fn['name'] for fn in functions]
-        if pred_fn_name not in allowed_pred_fns:
+        if pred_fn_name not in registry.names:
             sample_res['errors'].append({
                 'error_type': ErrorType.HALLUCINATED_FUNCTION.value,
                 'key': None,
@@ -151,14 +247,26 @@ class Evaluator:
 
 def main():
     argparser = argparse.ArgumentParser()
-    argparser.add_argument("--result_file", type=str, default="./data/sample_predicted_outputs.json")
+    argparser.add_argument("--result_file", type=str, default="./data/sample_predicted_outputs.json",
+                           help="JSON array or JSONL (one output per line) file of predictions.")
+    argparser.add_argument("--stream", action="store_true",
+                           help="Evaluate incrementally on a process pool and stream the per-sample details to a separate file.")
+    argparser.add_argument("--details_file", type=str, default=None,
+                           help="Per-sample details file of --stream, defaults to <result_file>_eval_details.jsonl.")
+    argparser.add_argument("--num_workers", type=int, default=None, help="Worker processes of --stream, defaults to the number of CPUs.")
+    argparser.add_argument("--chunk_size", type=int, default=1000, help="Outputs per worker task of --stream.")
     args = argparser.parse_args()
     result_file = args.result_file
 
     evaluator = Evaluator(result_file)
-    evaluator.load_results()
-    evaluator.process_results()
+    if args.stream:
+        evaluator.evaluate_stream(args.details_file, args.num_workers, args.chunk_size)
+    else:
+        evaluator.load_results()
+        evaluator.process_results()
     evaluator.save_eval_results()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    start_time = time.time()
+    main()
+    print(f"Execution completed in {time.time() - start_time:.2f} seconds.")
\ No newline at end of file
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import subprocess
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'evaluator'))
+
+
+def run_worker(args):
+    """Runs one quantization mode in this process and prints its metrics as a JSON line."""
+    from function_call_predict import FunctionCallPredictor
+    from evaluator import Evaluator
+    from training_data_format import read_messages
+
+    predictor = FunctionCallPredictor(args)
+    load_start = time.perf_counter()
+    predictor.setup()
+    load_time = time.perf_counter() - load_start
+
+    eval_data = read_messages(args.eval_file)
+    random.Random(args.seed).shuffle(eval_data)
+    eval_data = eval_data[:args.n]
+    prompts = [data["system"] + data["user"] for data in eval_data]
+
+    start_time = time.perf_counter()
+    responses = predictor.generate_batch(prompts)
+    elapsed = time.perf_counter() - start_time
+    generated_tokens = sum(len(ids) for ids in predictor.tokenizer(responses, add_special_tokens=False)["input_ids"])
+
+    for data, response in zip(eval_data, responses):
+        data["model_response"] = response
+    prediction_file = os.path.join(args.output_dir, f"cpu_benchmark_{args.quantization}.json")
+    with open(prediction_file, "w") as f:
+        json.dump(eval_data, f)
+
+    evaluator = Evaluator(prediction_file)
+    evaluator.load_results()
+    evaluator.process_results()
+    evaluator.save_eval_results()
+    fn_results = [v for v in evaluator.eval_result.values() if isinstance(v, dict)]
+    correct = sum(v["correct"] for v in fn_results)
+    total = sum(v["total"] for v in fn_results) + len(evaluator.eval_result.get("pred_defunctioning_error", []))
+
+    print(json.dumps({
+        "quantization": args.quantization,
+        "num_threads": args.num_threads,
+        "load_time_s": load_time,
+        "samples": len(prompts),
+        "generation_time_s": elapsed,
+        "tokens_per_sec": generated_tokens / max(elapsed, 1e-9),
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "accuracy": correct / total if total else None,
+    }))
+
+
+def main():
+    from function_call_predict import add_model_args
+
+    argparser = argparse.ArgumentParser(description="Compare fp32 / int8 / int4 CPU inference speed, memory and accuracy.")
+    add_model_args(argparser)
+    argparser.add_argument("--eval_file", type=str, required=True)
+    argparser.add_argument("--n", type=int, default=100, help="Number of evaluation samples per mode.")
+    argparser.add_argument("--seed", type=int, default=42)
+    argparser.add_argument("--modes", type=str, default="none,int8,int4", help="Comma separated quantization modes.")
+    argparser.add_argument("--output_dir", type=str, default="../data")
+    argparser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    # Each mode runs in its own process so peak RSS is measured independently
+    results = []
+    for mode in args.modes.split(","):
+        # Every mode runs a merged model, so the fp32 baseline differs from int8 / int4 only by quantization
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", "--quantization", mode, "--device_name", "cpu",
+               "--merge_adapter"]
+        cmd += ["--model_save_path", args.model_save_path, "--eval_file", args.eval_file, "--n", str(args.n),
+                "--seed", str(args.seed), "--output_dir", args.output_dir, "--batch_size", str(args.batch_size),
+                "--max_new_tokens", str(args.max_new_tokens)]
+        if args.num_threads:
+            cmd += ["--num_threads", str(args.num_threads)]
+        if args.no_prefix_cache:
+            cmd.append("--no_prefix_cache")
+        if args.constrained:
+            cmd.append("--constrained")
+        completed = subprocess.run(cmd, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"Mode {mode} failed:\n{completed.stderr}")
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    print(f"{'mode':<8}{'tokens/sec':>12}{'peak RSS (MB)':>16}{'load (s)':>10}{'accuracy':>10}")
+    for r in results:
+        accuracy = f"{r['accuracy']:.3f}" if r["accuracy"] is not None else "-"
+        print(f"{r['quantization']:<8}{r['tokens_per_sec']:>12.2f}{r['peak_rss_mb']:>16.1f}{r['load_time_s']:>10.2f}{accuracy:>10}")
+
+
+if __name__ == "__main__":
+    main()
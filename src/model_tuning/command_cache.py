@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from utils import canonicalize_command, convert_command
+
+
+def model_version(model_save_path):
+    """
+    Fingerprints a model directory (adapter or merged export) from the name, size and
+    modification time of its files, so re-training or re-exporting changes the version.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(model_save_path)):
+        path = os.path.join(model_save_path, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CommandCache:
+    """
+    LRU cache from canonicalized user commands to model responses.
+
+    Only responses that parse into a valid <functioncall> are stored. Entries are tied to a
+    model version and dropped as soon as a different version is set or loaded.
+    """
+
+    def __init__(self, max_size=1024, version=None, cache_file=None):
+        """
+        :param max_size: Maximum number of cached commands.
+        :param version: Version of the model that produced the cached responses.
+        :param cache_file: Optional JSON file the cache is loaded from and saved to.
+        """
+        self.max_size = max_size
+        self.version = version
+        self.cache_file = cache_file
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def set_version(self, version):
+        """Sets the model version, invalidating every entry if it changed."""
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+
+    def get(self, command):
+        key = canonicalize_command(command)
+        with self.lock:
+            response = self.entries.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, command, response):
+        if 'error' in convert_command(response):
+            return
+        key = canonicalize_command(command)
+        with self.lock:
+            self.entries[key] = response
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def metrics(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+    def load(self):
+        """Loads entries saved by the same model version; anything else is ignored."""
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        with open(self.cache_file, "r") as f:
+            saved = json.load(f)
+        if saved.get("version") != self.version:
+            return
+        with self.lock:
+            for key, response in saved["entries"][-self.max_size:]:
+                self.entries[key] = response
+
+    def save(self):
+        if not self.cache_file:
+            return
+        with self.lock:
+            saved = {"version": self.version, "entries": list(self.entries.items())}
+        with open(self.cache_file, "w") as f:
+            json.dump(saved, f)
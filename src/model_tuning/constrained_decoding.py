@@ -0,0 +1,337 @@
+import os
+import sys
+from functools import lru_cache
+import torch
+from transformers import DynamicCache, LogitsProcessor
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from config import functions
+from schema_registry import INCORRECT_PREFIX, DEFAULT_LOWER_BOUND, DEFAULT_UPPER_BOUND
+
+
+DONE = ("done",)
+
+
+def int_prefix_viable(digits, lower, upper):
+    """Checks whether a (non-negative) digit string can still be extended to a value in [lower, upper]."""
+    if digits == "0":
+        return lower <= 0 <= upper
+    if digits[0] == "0":
+        return False
+    value = int(digits)
+    for extra in range(0, len(str(upper)) - len(digits) + 1):
+        lo = value * 10 ** extra
+        hi = (value + 1) * 10 ** extra - 1
+        if lo <= upper and hi >= lower:
+            return True
+    return False
+
+
+class FunctionCallAutomaton:
+    """
+    Character-level automaton over the assistant responses the model is trained to emit:
+
+        <|im_start|>assistant\\n<functioncall> {"name": "<fn>", "arguments": "{'<key>': <value>, ...}"} <|im_end|>
+
+    It is compiled from the functions list in config.py: function names (plus their
+    POSSIBLY_INCORRECT_ variants used by negative samples), the keys allowed per function
+    (each at most once, required keys are not enforced since negative samples omit them),
+    enum values for strings and arrays, True/False for booleans and integer bounds from
+    lower_bound/upper_bound. Free-form strings may contain anything but quotes, backslashes
+    and newlines.
+
+    States are hashable tuples so transitions can be memoized across requests; advance keeps
+    the cache_size most recently used (state, token text) transitions of this automaton.
+    """
+
+    def __init__(self, functions=functions, cache_size=1 << 18):
+        """
+        :param cache_size: Maximum number of memoized advance transitions.
+        """
+        self.parameters = {}
+        for fn in functions:
+            properties = fn["parameters"]["properties"]
+            self.parameters[fn["name"]] = {
+                key: self.compile_parameter(details) for key, details in properties.items()
+            }
+        names = list(self.parameters.keys())
+        self.names = tuple(names + [INCORRECT_PREFIX + name for name in names])
+        # Bounded and per instance, so a long-running server neither grows it without limit
+        # nor keeps discarded automata alive through a class-level cache
+        self.advance = lru_cache(maxsize=cache_size)(self.consume)
+
+    def compile_parameter(self, details):
+        param_type = details.get("type", "string")
+        is_array = "array" in param_type
+        if "enum" in details:
+            return ("enum", tuple(str(v) for v in details["enum"]), is_array)
+        if param_type == "boolean":
+            return ("bool", ("True", "False"), False)
+        if param_type in ["integer", "number"]:
+            return ("int", (details.get("lower_bound", DEFAULT_LOWER_BOUND), details.get("upper_bound", DEFAULT_UPPER_BOUND)), False)
+        return ("str", None, is_array)
+
+    # ----------------------------------------------------------------------------------
+    # *** States
+
+    def initial_state(self):
+        return self.literal(
+            '<|im_start|>assistant\n<functioncall> {"name": "',
+            ("choice", "name", None, tuple(name + '"' for name in self.names), ""),
+        )
+
+    def literal(self, text, next_state):
+        return ("lit", text, next_state) if text else next_state
+
+    def is_done(self, state):
+        return state == DONE
+
+    def remaining_keys(self, fn, used):
+        return tuple(key for key in self.parameters[fn] if key not in used)
+
+    def key_state(self, fn, used):
+        return ("choice", "key", (fn, used), tuple(key + "'" for key in self.remaining_keys(fn, used)), "")
+
+    def closing_state(self):
+        return self.literal('"} <|im_end|>', DONE)
+
+    def value_state(self, fn, used, key):
+        kind, spec, is_array = self.parameters[fn][key]
+        if is_array:
+            if kind == "enum":
+                return self.literal("['", self.array_element_state(fn, used, key, ()))
+            return self.literal("['", ("str", ("arr_next", fn, used, key, ())))
+        if kind == "enum":
+            return self.literal("'", ("choice", "value", (fn, used), tuple(v + "'" for v in spec), ""))
+        if kind == "bool":
+            return ("choice", "value", (fn, used), spec, "")
+        if kind == "int":
+            return ("int", fn, used, key, "")
+        return self.literal("'", ("str", ("args", fn, used, False)))
+
+    def array_element_state(self, fn, used, key, chosen):
+        values = self.parameters[fn][key][1]
+        candidates = tuple(v + "'" for v in values if v not in chosen)
+        return ("choice", "element", (fn, used, key, chosen), candidates, "")
+
+    def after_choice(self, tag, ctx, chosen):
+        if tag == "name":
+            fn = chosen[:-1]
+            if fn.startswith(INCORRECT_PREFIX):
+                fn = fn[len(INCORRECT_PREFIX):]
+            return self.literal(', "arguments": "{', ("args", fn, frozenset(), True))
+        if tag == "key":
+            fn, used = ctx
+            key = chosen[:-1]
+            return self.literal(": ", self.value_state(fn, used | {key}, key))
+        if tag == "value":
+            fn, used = ctx
+            return ("args", fn, used, False)
+        # tag == "element"
+        fn, used, key, chosen_elements = ctx
+        return ("arr_next", fn, used, key, chosen_elements + (chosen[:-1],))
+
+    # ----------------------------------------------------------------------------------
+    # *** Transitions
+
+    def step(self, state, ch):
+        """Consumes a single character. Returns the next state, or None if ch is not allowed."""
+        kind = state[0]
+
+        if kind == "lit":
+            _, text, next_state = state
+            if ch != text[0]:
+                return None
+            return self.literal(text[1:], next_state)
+
+        if kind == "choice":
+            _, tag, ctx, candidates, partial = state
+            partial += ch
+            if partial in candidates:
+                return self.after_choice(tag, ctx, partial)
+            candidates = tuple(c for c in candidates if c.startswith(partial))
+            if not candidates:
+                return None
+            return ("choice", tag, ctx, candidates, partial)
+
+        if kind == "args":
+            _, fn, used, first = state
+            if ch == "}":
+                return self.closing_state()
+            remaining = self.remaining_keys(fn, used)
+            if not remaining:
+                return None
+            if first and ch == "'":
+                return self.key_state(fn, used)
+            if not first and ch == ",":
+                return self.literal(" '", self.key_state(fn, used))
+            return None
+
+        if kind == "arr_next":
+            _, fn, used, key, chosen = state
+            if ch == "]":
+                return ("args", fn, used, False)
+            if ch != ",":
+                return None
+            if self.parameters[fn][key][0] == "enum":
+                element_state = self.array_element_state(fn, used, key, chosen)
+                if not element_state[3]:
+                    return None
+                return self.literal(" '", element_state)
+            return self.literal(" '", ("str", state))
+
+        if kind == "int":
+            _, fn, used, key, digits = state
+            lower, upper = self.parameters[fn][key][1]
+            if ch.isdigit():
+                digits += ch
+                return ("int", fn, used, key, digits) if int_prefix_viable(digits, lower, upper) else None
+            if digits and lower <= int(digits) <= upper:
+                return self.step(("args", fn, used, False), ch)
+            return None
+
+        if kind == "str":
+            _, next_state = state
+            if ch == "'":
+                return next_state
+            if ch in "\"\\\n":
+                return None
+            return state
+
+        return None
+
+    def consume(self, state, text):
+        """
+        Consumes a string (typically one decoded token). Returns None if it is not allowed.
+        Use the memoized self.advance when decoding.
+        """
+        for ch in text:
+            if state is None or state == DONE:
+                return None
+            state = self.step(state, ch)
+        return state
+
+    def forced_text(self, state):
+        """Returns the text that is fully determined by the schema from this state on."""
+        forced = ""
+        while state is not None and state != DONE:
+            kind = state[0]
+            if kind == "lit":
+                forced += state[1]
+                state = state[2]
+            elif kind == "choice":
+                _, tag, ctx, candidates, partial = state
+                if len(candidates) == 1:
+                    forced += candidates[0][len(partial):]
+                    state = self.after_choice(tag, ctx, candidates[0])
+                else:
+                    common = os.path.commonprefix(candidates)
+                    forced += common[len(partial):]
+                    break
+            elif kind == "args" and not state[3] and not self.remaining_keys(state[1], state[2]):
+                forced += "}"
+                state = self.closing_state()
+            elif kind == "arr_next" and self.parameters[state[1]][state[3]][0] == "enum" \
+                    and not self.array_element_state(state[1], state[2], state[3], state[4])[3]:
+                forced += "]"
+                state = ("args", state[1], state[2], False)
+            else:
+                break
+        return forced
+
+
+class SchemaConstrainedLogitsProcessor(LogitsProcessor):
+    """
+    Masks every token that would take a row's output outside of the FunctionCallAutomaton.
+
+    Only the top_k highest scoring tokens are checked first (greedy decoding only needs the
+    best valid one); the whole vocabulary is scanned only if none of them is valid. A new
+    instance must be created for every generate() call since it tracks one state per row.
+    """
+
+    def __init__(self, automaton, token_texts, stop_token_ids, top_k=32):
+        self.automaton = automaton
+        self.token_texts = token_texts
+        self.stop_token_ids = list(stop_token_ids)
+        self.top_k = top_k
+        self.states = None
+
+    def allowed_tokens(self, state, row_scores):
+        if state is None:
+            return None
+        if self.automaton.is_done(state):
+            return self.stop_token_ids
+        ranked = torch.argsort(row_scores, descending=True).tolist()
+        allowed = [t for t in ranked[:self.top_k] if self.automaton.advance(state, self.token_texts[t]) is not None]
+        if not allowed:
+            allowed = [t for t in ranked[self.top_k:] if self.automaton.advance(state, self.token_texts[t]) is not None]
+        return allowed
+
+    def __call__(self, input_ids, scores):
+        if self.states is None:
+            self.states = [self.automaton.initial_state()] * input_ids.shape[0]
+        else:
+            for b, token_id in enumerate(input_ids[:, -1].tolist()):
+                state = self.states[b]
+                if state is not None and not self.automaton.is_done(state):
+                    self.states[b] = self.automaton.advance(state, self.token_texts[token_id])
+
+        mask = torch.full_like(scores, float("-inf"))
+        for b, state in enumerate(self.states):
+            allowed = self.allowed_tokens(state, scores[b])
+            if allowed is None:
+                # The row left the grammar (should not happen); leave it unconstrained
+                mask[b] = 0
+            else:
+                mask[b, allowed] = 0
+        return scores + mask
+
+
+def build_token_texts(tokenizer):
+    """Decodes every token id on its own, once per model load."""
+    return tokenizer.batch_decode([[i] for i in range(len(tokenizer))])
+
+
+def jump_forward_generate(model, tokenizer, automaton, token_texts, input_ids, stop_token_ids,
+                          past_key_values=None, max_new_tokens=128, device="cpu"):
+    """
+    Greedy constrained decoding for a single prompt.
+
+    Whenever the schema fully determines the next characters (e.g. '{"name": "' or the rest
+    of a function name once it is unambiguous) they are tokenized and appended directly,
+    without sampling them one forward pass at a time; they are fed to the model together
+    with the next sampled token's context in a single forward pass.
+
+    :param input_ids: Prompt token ids that are not yet part of past_key_values.
+    :return: List of generated token ids.
+    """
+    processor = SchemaConstrainedLogitsProcessor(automaton, token_texts, stop_token_ids)
+    cache = past_key_values if past_key_values is not None else DynamicCache()
+    state = automaton.initial_state()
+    pending = list(input_ids)
+    generated = []
+
+    while len(generated) < max_new_tokens and not automaton.is_done(state):
+        forced = automaton.forced_text(state)
+        if forced:
+            forced_ids = tokenizer(forced, add_special_tokens=False)["input_ids"]
+            generated += forced_ids
+            pending += forced_ids
+            state = automaton.advance(state, forced)
+            continue
+
+        with torch.inference_mode():
+            outputs = model(
+                input_ids=torch.tensor([pending], device=device),
+                past_key_values=cache,
+                use_cache=True,
+            )
+        cache = outputs.past_key_values
+        allowed = processor.allowed_tokens(state, outputs.logits[0, -1])
+        if not allowed:
+            break
+        token_id = allowed[0]
+        generated.append(token_id)
+        pending = [token_id]
+        state = automaton.advance(state, token_texts[token_id])
+
+    return generated[:max_new_tokens]
@@ -0,0 +1,63 @@
+import os
+import json
+import time
+import argparse
+import torch
+
+from function_call_predict import load_adapter_model
+
+
+DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+}
+
+
+def export_merged_model(adapter_path, output_path, dtype="float32"):
+    """
+    Merges the LoRA adapter saved by ModelTrainer.save_model into the base weights and writes
+    a single safetensors checkpoint that function_call_predict.py loads memory-mapped.
+
+    The resized vocab size ends up in the exported config.json, so loading the merged model
+    needs neither the base model nor any embedding slicing.
+
+    :param adapter_path: Directory written by ModelTrainer.save_model.
+    :param output_path: Directory to write the merged model and tokenizer to.
+    :param dtype: Dtype of the exported weights.
+    """
+    model, tokenizer = load_adapter_model(adapter_path)
+    merged_model = model.merge_and_unload()
+    merged_model = merged_model.to(DTYPES[dtype])
+
+    os.makedirs(output_path, exist_ok=True)
+    # A shard size larger than the model keeps everything in a single model.safetensors
+    merged_model.save_pretrained(output_path, safe_serialization=True, max_shard_size="100GB")
+    tokenizer.save_pretrained(output_path)
+
+    export_info = {
+        "base_model": model.peft_config["default"].base_model_name_or_path,
+        "adapter_path": os.path.abspath(adapter_path),
+        "vocab_size": merged_model.get_input_embeddings().weight.shape[0],
+        "dtype": dtype,
+    }
+    with open(os.path.join(output_path, "export_info.json"), "w") as f:
+        json.dump(export_info, f, indent=4)
+    return export_info
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Merge the LoRA adapter into the base model for fast startup.")
+    argparser.add_argument("--adapter_path", type=str, default="../models/phi-2-adapter")
+    argparser.add_argument("--output_path", type=str, default="../models/phi-2-merged")
+    argparser.add_argument("--dtype", type=str, default="float32", choices=list(DTYPES.keys()))
+    args = argparser.parse_args()
+
+    export_info = export_merged_model(args.adapter_path, args.output_path, dtype=args.dtype)
+    print(f"Exported merged model to {args.output_path}: {export_info}")
+
+
+if __name__ == "__main__":
+    start_time = time.time()
+    main()
+    print(f"Execution completed in {time.time() - start_time:.2f} seconds.")
@@ -1,17 +1,54 @@
 import os
+import sys
 import numpy as np
 import torch
-from datasets import Dataset
+from datasets import Dataset, concatenate_datasets
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from trl import setup_chat_format, SFTConfig, SFTTrainer
 from peft import LoraConfig, get_peft_model
 import argparse
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from training_data_format import is_arrow_file, read_table
+
+from token_cache import TokenizedDataCache, TokenizedDataset
+from packing import PackedDataset, collate_packed, dataset_lengths
+from length_bucketing import LengthBucketBatchSampler
+
+
+class TokenBudgetSFTTrainer(SFTTrainer):
+    """SFTTrainer whose training batches are length-bucketed and sized by max_tokens_per_batch."""
+
+    def __init__(self, *args, max_tokens_per_batch=None, **kwargs):
+        self.max_tokens_per_batch = max_tokens_per_batch
+        super().__init__(*args, **kwargs)
+
+    def get_train_dataloader(self):
+        if self.max_tokens_per_batch is None:
+            return super().get_train_dataloader()
+
+        batch_sampler = LengthBucketBatchSampler(
+            dataset_lengths(self.train_dataset),
+            self.max_tokens_per_batch,
+            seed=self.args.seed,
+        )
+        dataloader = torch.utils.data.DataLoader(
+            self.train_dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader)
 
 
 class ModelTrainer:
+    SPLIT_SEED = 42
+    TEST_FRACTION = 0.1
+
     def __init__(self, args):
         self.args = args
         self.IGNORE_INDEX = -100
+        self.max_length = 1024
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.tokenizer = None
         self.model = None
@@ -46,13 +83,9 @@ class ModelTrainer:
         self.model.config.use_cache = False
 
     def tokenize(self, input):
-        max_length = 1024
+        max_length = self.max_length
         input_ids, attention_mask, labels = [], [], []
-        messages = [
-            input['messages_templated']['system'],
-            input['messages_templated']['user'],
-            input['messages_templated']['assistant']
-        ]
+        messages = [input['system'], input['user'], input['assistant']]
         for i, msg in enumerate(messages):
             msg_tokenized = self.tokenizer(msg, truncation=False, add_special_tokens=False)
             input_ids += msg_tokenized["input_ids"]
@@ -85,27 +118,91 @@ class ModelTrainer:
 
         return batch
 
-    def prepare_data(self):
-        complete_messages = np.load(self.args.complete_data_path, allow_pickle=True)
-        if self.args.incomplete_data_path:
-            incomplete_messages = np.load(self.args.incomplete_data_path, allow_pickle=True)
-            num_samples = int(len(complete_messages) * 0.5)
-            if len(incomplete_messages) < num_samples:
-                num_samples = len(incomplete_messages)
-                
-            incomplete_messages = np.random.choice(incomplete_messages, num_samples, replace=False)
-            messages = np.concatenate([complete_messages, incomplete_messages])
-        else:
-            messages = complete_messages
+    def collate_packed(self, elements):
+        return collate_packed(elements, self.tokenizer.pad_token_id, self.IGNORE_INDEX)
 
-        dataset = Dataset.from_dict({"messages_templated": messages})
-        dataset = dataset.shuffle(seed=42).train_test_split(test_size=0.1, seed=42)
-        self.dataset_tokenized = dataset.map(
+    def load_messages(self, data_path):
+        """
+        Loads a training data file as a Dataset with system / user / assistant / function_name /
+        is_negative columns. Arrow files are memory-mapped without copying; the legacy pickled
+        .npy and .json files are converted.
+        """
+        if is_arrow_file(data_path):
+            return Dataset.from_file(data_path)
+        return Dataset(read_table(data_path))
+
+    def tokenize_messages(self, dataset):
+        return dataset.map(
             self.tokenize,
             batched=False,
             num_proc=min(4, os.cpu_count()),
-            remove_columns=dataset["train"].column_names
+            remove_columns=dataset.column_names
+        )
+
+    def sample_incomplete(self, num_complete, num_incomplete):
+        """
+        Indices of the incomplete samples mixed into the data: half as many as there are
+        complete samples, at most all of them, drawn with a fixed seed.
+        """
+        num_samples = min(int(num_complete * 0.5), num_incomplete)
+        return np.random.RandomState(self.SPLIT_SEED).choice(num_incomplete, num_samples, replace=False)
+
+    def split_indices(self, num_rows):
+        """
+        Train and test row indices of a seeded permutation, TEST_FRACTION of the rows (rounded up)
+        going to the test split. Both the cached and the uncached data paths split with it, so
+        they hold out the same samples.
+        """
+        permutation = np.random.RandomState(self.SPLIT_SEED).permutation(num_rows)
+        num_test = int(np.ceil(num_rows * self.TEST_FRACTION))
+        return permutation[num_test:], permutation[:num_test]
+
+    def prepare_data(self):
+        if self.args.no_token_cache:
+            self.prepare_data_uncached()
+        else:
+            self.prepare_data_cached()
+
+        if self.args.packing:
+            self.dataset_tokenized = {
+                split: PackedDataset(dataset, self.max_length)
+                for split, dataset in self.dataset_tokenized.items()
+            }
+
+    def prepare_data_cached(self):
+        cache = TokenizedDataCache(
+            self.args.token_cache_dir,
+            self.tokenizer,
+            self.tokenize_messages,
+            settings={"max_length": self.max_length, "ignore_index": self.IGNORE_INDEX},
         )
+        complete_store = cache.load(self.args.complete_data_path, self.load_messages)
+        refs = [(complete_store, i) for i in range(len(complete_store))]
+        if self.args.incomplete_data_path:
+            incomplete_store = cache.load(self.args.incomplete_data_path, self.load_messages)
+            incomplete_idx = self.sample_incomplete(len(complete_store), len(incomplete_store))
+            refs += [(incomplete_store, int(i)) for i in incomplete_idx]
+
+        train_idx, test_idx = self.split_indices(len(refs))
+        self.dataset_tokenized = {
+            "train": TokenizedDataset([refs[i] for i in train_idx]),
+            "test": TokenizedDataset([refs[i] for i in test_idx]),
+        }
+
+    def prepare_data_uncached(self):
+        complete_messages = self.load_messages(self.args.complete_data_path)
+        if self.args.incomplete_data_path:
+            incomplete_messages = self.load_messages(self.args.incomplete_data_path)
+            incomplete_idx = self.sample_incomplete(len(complete_messages), len(incomplete_messages))
+            dataset = concatenate_datasets([complete_messages, incomplete_messages.select(incomplete_idx)])
+        else:
+            dataset = complete_messages
+
+        train_idx, test_idx = self.split_indices(len(dataset))
+        self.dataset_tokenized = {
+            "train": self.tokenize_messages(dataset.select(train_idx)),
+            "test": self.tokenize_messages(dataset.select(test_idx)),
+        }
 
     def configure_trainer(self):
         sft_config = SFTConfig(
@@ -123,17 +220,26 @@ class ModelTrainer:
             eval_strategy="steps",
             report_to=[]
         )
-        self.trainer = SFTTrainer(
+        self.trainer = TokenBudgetSFTTrainer(
             model=self.model,
             train_dataset=self.dataset_tokenized["train"],
             eval_dataset=self.dataset_tokenized["test"],
             tokenizer=self.tokenizer,
             args=sft_config,
-            data_collator=self.collate,
+            data_collator=self.collate_packed if self.args.packing else self.collate,
+            max_tokens_per_batch=self.args.max_tokens_per_batch,
         )
 
     def train_model(self):
-        self.trainer.train()
+        train_output = self.trainer.train()
+        self.report_throughput(train_output.metrics)
+
+    def report_throughput(self, metrics):
+        """Prints non-padding training tokens per second, comparable with and without --packing."""
+        num_tokens = sum(dataset_lengths(self.dataset_tokenized["train"])) * self.trainer.args.num_train_epochs
+        print(f"Training throughput (packing={'on' if self.args.packing else 'off'}): "
+              f"{num_tokens / metrics['train_runtime']:.1f} tokens/sec, "
+              f"{len(self.dataset_tokenized['train'])} rows, {metrics['train_runtime']:.1f} seconds")
 
     def save_model(self):
         self.model.save_pretrained(self.args.save_adapter_path)
@@ -142,10 +248,18 @@ class ModelTrainer:
 
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser()
-    argparser.add_argument("--complete_data_path", type=str, required=True)
+    argparser.add_argument("--complete_data_path", type=str, required=True,
+                           help="Arrow training data file of generate_training_data (legacy .npy / .json files also load).")
     argparser.add_argument("--incomplete_data_path", type=str, default=None)
     argparser.add_argument("--save_adapter_path", type=str, default="../models/phi-2-adapter")
     argparser.add_argument("--base_model", type=str, default="microsoft/phi-2")
+    argparser.add_argument("--token_cache_dir", type=str, default="../data/token_cache",
+                           help="Directory of memory-mapped tokenized data, reused across runs.")
+    argparser.add_argument("--no_token_cache", action="store_true", help="Tokenize the data in memory on every run.")
+    argparser.add_argument("--packing", action="store_true",
+                           help="Pack several samples into each row of up to max_length tokens.")
+    argparser.add_argument("--max_tokens_per_batch", type=int, default=None,
+                           help="Length-bucket training batches by a padded token budget instead of a fixed batch size.")
     args = argparser.parse_args()
 
     trainer = ModelTrainer(args)
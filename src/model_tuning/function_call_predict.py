@@ -1,103 +1,388 @@
+import os
+import sys
+import copy
 import torch
-from peft import PeftConfig, PeftModel, PeftModelForCausalLM
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from peft import PeftConfig, PeftModel
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache, LogitsProcessorList
 import argparse
 import json
+import random
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from config import system_message
+from training_data_format import read_messages
 
-# --------------------------------------------------------------------------------------
-# *** Load model for inference
-
-argparser = argparse.ArgumentParser()
-argparser.add_argument("--model_save_path", type=str, default="./phi-2-adapter")
-argparser.add_argument("--device_name", type=str, default="cuda")
-argparser.add_argument("--mode", type=str, default="test")
-argparser.add_argument("--eval_file", type=str, default="none")
-
-args = argparser.parse_args()
-model_save_path = args.model_save_path
-device_name = args.device_name
-mode = args.mode
-eval_file = args.eval_file
-
-if mode == "eval":
-    assert eval_file != "none", "Please provide the evaluation file path."
-
-device = torch.device(device_name)
-config = PeftConfig.from_pretrained(model_save_path)
-base_model = AutoModelForCausalLM.from_pretrained(
-    config.base_model_name_or_path,
-    trust_remote_code=True,
-  )
-
-#### CHANGE THIS IF YOU ARE USING ANYTHING OTHER THAN PHI-2 #### 
-#### NUMBERS WILL CHANGE, RUN IT ONCE, LOOK AT THE ERROR AND CHANGE IT ACCORDINGLY ####
-
-new_vocab_size = 50297  # This should match the size from the checkpoint error
-original_embedding_dim = base_model.model.embed_tokens.weight.shape[1]
-
-# Resize the embeddings
-base_model.model.embed_tokens.weight.data = base_model.model.embed_tokens.weight.data[:new_vocab_size]
-base_model.lm_head.weight.data = base_model.lm_head.weight.data[:new_vocab_size]
-base_model.lm_head.bias.data = base_model.lm_head.bias.data[:new_vocab_size]
-
-############# LOAD MODEL #############
-finetuned_model = PeftModel.from_pretrained(
-    base_model, model_save_path
-)
-
-########### LOAD TOKENIZER ############
-loaded_tokenizer = AutoTokenizer.from_pretrained(model_save_path)
-
-if mode != "eval":
-    
-    while True:
-        user_query = input("Enter your query: \n")
-        messages = [
-            {
-                "role":"system", 
-                # "content":"You are a helpful assistant with access to the following functions. Use these functions when they are relevant to assist with a user's request\n[\n	{\n		\"name\": \"calculate_retirement_savings\",\n		\"description\": \"Project the savings at retirement based on current contributions.\",\n		\"parameters\": {\n			\"type\": \"object\",\n			\"properties\": {\n				\"current_age\": {\n					\"type\": \"integer\",\n					\"description\": \"The current age of the individual.\"\n				},\n				\"retirement_age\": {\n					\type\": \"integer\",\n					\"description\": \"The desired retirement age.\"\n				},\n				\"current_savings\": {\n					\"type\": \"number\",\n					\"description\": \"The current amount of savings.\"\n				},\n				\"monthly_contribution\": {\n					\"type\": \"number\",\n					\"description\": \"The monthly contribution towards retirement savings.\"\n				}\n			},\n			\"required\": [\"current_age\", \"retirement_age\", \"current_savings\", \"monthly_contribution\"]\n		}\n	}\n]"
-                "content": "You are a helpful assistant. You have to either provide a way to answer user's request or answer user's query."
-            },
-            {
-                "role": "user", 
-                "content": user_query
-            }
-        ]
-        
-        input_text = loaded_tokenizer.apply_chat_template(messages,tokenize=False)
-        input_ids = loaded_tokenizer(input_text, return_tensors="pt").to('cuda')
-
-        outputs = finetuned_model.to('cuda').generate(**input_ids, max_length=128)
-        print("Model response: ", loaded_tokenizer.decode(outputs[0])[len(input_text):])
-
-else:
-    with open(eval_file) as f:
-        eval_data = json.load(f)
-    
-    #shuffle
-    import random
-    random.shuffle(eval_data)
-    
-    n = 1000
-    
-    for i,data in enumerate(eval_data):
-        system_message = data["system"]
-        user_message = data["user"]
-        input_text = system_message + user_message
-        input_ids = loaded_tokenizer(input_text, return_tensors="pt").to('cuda')
-        
-        outputs = finetuned_model.to('cuda').generate(**input_ids, max_length=512)
-        data["model_response"] = loaded_tokenizer.decode(outputs[0])[len(input_text):]
-        
-        if i > n:
-            break
-    
-    # import pdb; pdb.set_trace()
-    
-    fname = '../data/predicted_outputs_incomplete_train.json'
-    with open(fname, "w") as f:
-        json.dump(eval_data[:n+2], f)
-        
-        
-        
-    
+from constrained_decoding import FunctionCallAutomaton, SchemaConstrainedLogitsProcessor, \
+    build_token_texts, jump_forward_generate
+from command_cache import CommandCache, model_version
+
+
+def is_adapter_checkpoint(model_save_path):
+    return os.path.exists(os.path.join(model_save_path, "adapter_config.json"))
+
+
+def load_adapter_model(adapter_path):
+    """
+    Loads the base model and wraps it with the LoRA adapter saved by ModelTrainer.save_model.
+
+    setup_chat_format resized the embeddings to len(tokenizer) before training, so the base
+    model is resized to the adapter's tokenizer size instead of a hard-coded vocab size.
+
+    :return: Tuple of (PeftModel, tokenizer).
+    """
+    config = PeftConfig.from_pretrained(adapter_path)
+    tokenizer = AutoTokenizer.from_pretrained(adapter_path)
+    base_model = AutoModelForCausalLM.from_pretrained(
+        config.base_model_name_or_path,
+        trust_remote_code=True,
+    )
+    base_model.resize_token_embeddings(len(tokenizer))
+    model = PeftModel.from_pretrained(base_model, adapter_path)
+    return model, tokenizer
+
+
+class FunctionCallPredictor:
+    def __init__(self, args):
+        self.args = args
+        self.device = torch.device(args.device_name)
+        if args.num_threads:
+            torch.set_num_threads(args.num_threads)
+        self.model = None
+        self.tokenizer = None
+        self.stop_token_ids = []
+        self.prefix_ids = None
+        self.prefix_cache = None
+        self.automaton = None
+        self.token_texts = None
+        self.command_cache = None
+
+    # --------------------------------------------------------------------------------------
+    # *** Load model for inference
+
+    def load_model(self):
+        if is_adapter_checkpoint(self.args.model_save_path):
+            self.model, _ = load_adapter_model(self.args.model_save_path)
+        else:
+            # Merged checkpoint written by export_merged_model.py: a single memory-mapped safetensors file
+            self.model = AutoModelForCausalLM.from_pretrained(
+                self.args.model_save_path,
+                trust_remote_code=True,
+                torch_dtype="auto",
+                low_cpu_mem_usage=True,
+            )
+        if self.args.quantization != "none":
+            self.quantize_model()
+        elif self.args.merge_adapter:
+            self.merge_adapter()
+        # Move the weights once; generate() is called many times afterwards
+        self.model.to(self.device)
+        self.model.eval()
+
+    def merge_adapter(self):
+        """Merges the LoRA adapter into the base weights, so inference runs plain Linear layers."""
+        if isinstance(self.model, PeftModel):
+            self.model = self.model.merge_and_unload()
+
+    def quantize_model(self):
+        """
+        Applies weight-only quantization for CPU inference.
+
+        int8 uses PyTorch's built-in dynamic quantization of all Linear layers; int4 needs
+        optimum-quanto. LoRA adapters are merged first so the quantized weights include them.
+        """
+        assert self.device.type == "cpu", "Quantized inference is only supported with --device_name cpu."
+        self.merge_adapter()
+        self.model = self.model.float()
+
+        if self.args.quantization == "int8":
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif self.args.quantization == "int4":
+            try:
+                from optimum.quanto import freeze, qint4, quantize
+            except ImportError:
+                raise ImportError("int4 quantization requires optimum-quanto: pip install optimum-quanto")
+            quantize(self.model, weights=qint4)
+            freeze(self.model)
+        else:
+            raise ValueError(f"Unknown quantization: {self.args.quantization}")
+
+    def load_tokenizer(self):
+        self.tokenizer = AutoTokenizer.from_pretrained(self.args.model_save_path)
+        # Decoder-only models need left padding so every row ends at its last prompt token
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        im_end_id = self.tokenizer.convert_tokens_to_ids("<|im_end|>")
+        self.stop_token_ids = [im_end_id]
+        if self.tokenizer.eos_token_id is not None and self.tokenizer.eos_token_id != im_end_id:
+            self.stop_token_ids.append(self.tokenizer.eos_token_id)
+
+    def build_prefix_cache(self):
+        """
+        Pre-computes the past-key-values of the shared system prompt once per model load.
+
+        The prefix is tokenized on its own, the same way ModelTrainer.tokenize tokenizes the
+        system message during training, so prefix_ids + user ids matches the training layout.
+        """
+        self.prefix_ids = self.tokenizer(system_message, add_special_tokens=False)["input_ids"]
+        with torch.inference_mode():
+            outputs = self.model(
+                input_ids=torch.tensor([self.prefix_ids], device=self.device),
+                past_key_values=DynamicCache(),
+                use_cache=True,
+            )
+        self.prefix_cache = outputs.past_key_values
+
+    def build_constrained_decoding(self):
+        """Compiles config.functions into the decoding automaton and decodes the vocabulary once."""
+        self.automaton = FunctionCallAutomaton()
+        self.token_texts = build_token_texts(self.tokenizer)
+
+    def build_command_cache(self):
+        """Builds the LRU cache of responses to frequent commands, tied to the loaded model version."""
+        self.command_cache = CommandCache(
+            max_size=self.args.command_cache_size,
+            version=model_version(self.args.model_save_path),
+            cache_file=self.args.command_cache_file,
+        )
+        self.command_cache.load()
+
+    def setup(self):
+        """Loads the model and tokenizer and builds the optional inference accelerations."""
+        self.load_model()
+        self.load_tokenizer()
+        if not self.args.no_prefix_cache:
+            self.build_prefix_cache()
+        if self.args.constrained:
+            self.build_constrained_decoding()
+        if self.args.command_cache_size > 0:
+            self.build_command_cache()
+
+    # --------------------------------------------------------------------------------------
+    # *** Generation
+
+    def build_prompt(self, user_query):
+        """Builds a prompt in the same format as generate_training_data."""
+        return system_message + "<|im_start|>user\n" + user_query + "<|im_end|>\n"
+
+    def left_pad(self, batch_ids):
+        """Left-pads a list of token id lists into input_ids / attention_mask tensors."""
+        max_len = max(len(ids) for ids in batch_ids)
+        pad_id = self.tokenizer.pad_token_id
+        input_ids = [[pad_id] * (max_len - len(ids)) + ids for ids in batch_ids]
+        attention_mask = [[0] * (max_len - len(ids)) + [1] * len(ids) for ids in batch_ids]
+        return (
+            torch.tensor(input_ids, device=self.device),
+            torch.tensor(attention_mask, device=self.device),
+        )
+
+    def prefix_pad(self, batch_suffix_ids):
+        """
+        Pads suffixes to a common length between the cached prefix and the suffix:
+        [prefix][pad...][suffix]. The padding is masked out, so position ids derived from the
+        attention mask stay contiguous and the cached prefix is valid for every row.
+        """
+        max_len = max(len(ids) for ids in batch_suffix_ids)
+        pad_id = self.tokenizer.pad_token_id
+        prefix_len = len(self.prefix_ids)
+        input_ids = [self.prefix_ids + [pad_id] * (max_len - len(ids)) + ids for ids in batch_suffix_ids]
+        attention_mask = [[1] * prefix_len + [0] * (max_len - len(ids)) + [1] * len(ids) for ids in batch_suffix_ids]
+        return (
+            torch.tensor(input_ids, device=self.device),
+            torch.tensor(attention_mask, device=self.device),
+        )
+
+    def batch_prefix_cache(self, batch_size):
+        """Returns a fresh copy of the prefix cache expanded to batch_size rows."""
+        cache = copy.deepcopy(self.prefix_cache)
+        if batch_size > 1:
+            cache.batch_repeat_interleave(batch_size)
+        return cache
+
+    def decode_response(self, token_ids):
+        """Decodes generated tokens and drops everything after the first <|im_end|>."""
+        text = self.tokenizer.decode(token_ids)
+        end_idx = text.find("<|im_end|>")
+        if end_idx != -1:
+            text = text[:end_idx + len("<|im_end|>")]
+        return text
+
+    def generate_batch(self, prompts, batch_size=None, max_new_tokens=None):
+        """
+        Generates responses for a list of prompts.
+
+        Prompts are sorted by token length so each batch holds prompts of similar size, generated
+        together with left padding, and returned in the original order. When the prefix cache is
+        built and every prompt starts with the shared system prompt, only the user part is encoded
+        and the cached system prompt is reused for every row.
+
+        :param prompts: List of fully templated prompt strings.
+        :param batch_size: Number of prompts per generate() call.
+        :param max_new_tokens: Maximum number of tokens to generate per prompt.
+        :return: List of decoded responses, aligned with prompts.
+        """
+        batch_size = batch_size or self.args.batch_size
+        max_new_tokens = max_new_tokens or self.args.max_new_tokens
+
+        use_prefix = self.prefix_cache is not None and all(p.startswith(system_message) for p in prompts)
+        if use_prefix:
+            # Only the part after the shared system prompt needs to be encoded
+            encoded = self.tokenizer(
+                [p[len(system_message):] for p in prompts], add_special_tokens=False
+            )["input_ids"]
+        else:
+            encoded = self.tokenizer(prompts)["input_ids"]
+        order = sorted(range(len(prompts)), key=lambda i: len(encoded[i]), reverse=True)
+        responses = [None] * len(prompts)
+
+        for start in range(0, len(order), batch_size):
+            batch_idx = order[start:start + batch_size]
+            generate_kwargs = {}
+            if self.automaton is not None:
+                generate_kwargs["logits_processor"] = LogitsProcessorList([
+                    SchemaConstrainedLogitsProcessor(self.automaton, self.token_texts, self.stop_token_ids)
+                ])
+            if use_prefix:
+                input_ids, attention_mask = self.prefix_pad([encoded[i] for i in batch_idx])
+                generate_kwargs["past_key_values"] = self.batch_prefix_cache(len(batch_idx))
+            else:
+                input_ids, attention_mask = self.left_pad([encoded[i] for i in batch_idx])
+            with torch.inference_mode():
+                outputs = self.model.generate(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    max_new_tokens=max_new_tokens,
+                    eos_token_id=self.stop_token_ids,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    do_sample=False,
+                    **generate_kwargs,
+                )
+            generated = outputs[:, input_ids.shape[1]:]
+            for i, token_ids in zip(batch_idx, generated):
+                responses[i] = self.decode_response(token_ids)
+
+        return responses
+
+    def generate_one(self, prompt, max_new_tokens=None):
+        """
+        Generates a response for a single prompt. With constrained decoding enabled, tokens
+        fully determined by the function schema are appended without sampling them.
+        """
+        if self.automaton is None:
+            return self.generate_batch([prompt], batch_size=1, max_new_tokens=max_new_tokens)[0]
+
+        if self.prefix_cache is not None and prompt.startswith(system_message):
+            input_ids = self.tokenizer(prompt[len(system_message):], add_special_tokens=False)["input_ids"]
+            past_key_values = self.batch_prefix_cache(1)
+        else:
+            input_ids = self.tokenizer(prompt)["input_ids"]
+            past_key_values = None
+
+        generated = jump_forward_generate(
+            self.model, self.tokenizer, self.automaton, self.token_texts, input_ids,
+            stop_token_ids=self.stop_token_ids,
+            past_key_values=past_key_values,
+            max_new_tokens=max_new_tokens or self.args.max_new_tokens,
+            device=self.device,
+        )
+        return self.decode_response(generated)
+
+    def respond(self, user_queries):
+        """
+        Answers raw user commands. Commands found in the command cache are answered without a
+        forward pass; the rest are generated and their valid function calls are cached.
+        """
+        responses = [None] * len(user_queries)
+        if self.command_cache is not None:
+            responses = [self.command_cache.get(query) for query in user_queries]
+
+        missing = [i for i, response in enumerate(responses) if response is None]
+        if missing:
+            prompts = [self.build_prompt(user_queries[i]) for i in missing]
+            if len(prompts) == 1:
+                generated = [self.generate_one(prompts[0])]
+            else:
+                generated = self.generate_batch(prompts)
+            for i, response in zip(missing, generated):
+                responses[i] = response
+                if self.command_cache is not None:
+                    self.command_cache.put(user_queries[i], response)
+        return responses
+
+    # --------------------------------------------------------------------------------------
+    # *** Modes
+
+    def run_interactive(self):
+        try:
+            while True:
+                user_query = input("Enter your query: \n")
+                response = self.respond([user_query])[0]
+                print("Model response: ", response)
+        except (KeyboardInterrupt, EOFError):
+            if self.command_cache is not None:
+                self.command_cache.save()
+                print(f"Command cache: {self.command_cache.metrics()}")
+
+    def run_eval(self):
+        eval_data = read_messages(self.args.eval_file)
+
+        # shuffle
+        random.shuffle(eval_data)
+        eval_data = eval_data[:self.args.n]
+
+        prompts = [data["system"] + data["user"] for data in eval_data]
+
+        start_time = time.time()
+        responses = self.generate_batch(prompts)
+        elapsed = time.time() - start_time
+        print(f"Generated {len(prompts)} responses in {elapsed:.2f} seconds "
+              f"({len(prompts) / max(elapsed, 1e-9):.2f} samples/sec, batch_size={self.args.batch_size}).")
+
+        for data, response in zip(eval_data, responses):
+            data["model_response"] = response
+
+        with open(self.args.output_file, "w") as f:
+            json.dump(eval_data, f)
+
+
+def add_model_args(argparser):
+    """Adds the model loading / generation arguments shared by the predict script and the server."""
+    argparser.add_argument("--model_save_path", type=str, default="./phi-2-adapter",
+                           help="LoRA adapter directory, or a merged model exported by export_merged_model.py.")
+    argparser.add_argument("--device_name", type=str, default="cuda")
+    argparser.add_argument("--batch_size", type=int, default=16, help="Number of prompts per generate() call.")
+    argparser.add_argument("--max_new_tokens", type=int, default=128)
+    argparser.add_argument("--no_prefix_cache", action="store_true",
+                           help="Re-encode the system prompt on every request instead of reusing its KV-cache.")
+    argparser.add_argument("--constrained", action="store_true",
+                           help="Constrain decoding to the function schemas in config.functions.")
+    argparser.add_argument("--quantization", type=str, default="none", choices=["none", "int8", "int4"],
+                           help="Weight-only quantization for CPU inference.")
+    argparser.add_argument("--merge_adapter", action="store_true",
+                           help="Merge the LoRA adapter into the base weights before inference (always done when quantizing).")
+    argparser.add_argument("--num_threads", type=int, default=None, help="Number of CPU threads used by torch.")
+    argparser.add_argument("--command_cache_size", type=int, default=0,
+                           help="Number of canonicalized commands to answer from cache without a forward pass (0 disables).")
+    argparser.add_argument("--command_cache_file", type=str, default=None, help="JSON file to persist the command cache to.")
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    add_model_args(argparser)
+    argparser.add_argument("--mode", type=str, default="test")
+    argparser.add_argument("--eval_file", type=str, default="none")
+    argparser.add_argument("--output_file", type=str, default="../data/predicted_outputs_incomplete_train.json")
+    argparser.add_argument("--n", type=int, default=1000, help="Number of evaluation samples to predict.")
+    args = argparser.parse_args()
+
+    if args.mode == "eval":
+        assert args.eval_file != "none", "Please provide the evaluation file path."
+
+    predictor = FunctionCallPredictor(args)
+    predictor.setup()
+
+    if args.mode != "eval":
+        predictor.run_interactive()
+    else:
+        predictor.run_eval()
@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import socketserver
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from function_call_predict import FunctionCallPredictor, add_model_args
+
+
+class PendingRequest:
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests into micro-batches for a single generation worker.
+
+    The worker blocks for the first request, then keeps collecting until either max_batch_size
+    requests are pending or max_wait_ms have passed since the first one arrived, and runs them
+    through generate_fn in one call.
+    """
+
+    def __init__(self, generate_fn, max_batch_size=16, max_wait_ms=10.0, latency_window=10000):
+        """
+        :param generate_fn: Callable mapping a list of prompts to a list of responses.
+        :param max_batch_size: Maximum number of requests per generate_fn call.
+        :param max_wait_ms: Maximum time to wait for more requests after the first one (in milliseconds).
+        :param latency_window: Number of most recent request latencies kept for percentiles.
+        """
+        self.generate_fn = generate_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.latencies = deque(maxlen=latency_window)
+        self.batch_sizes = deque(maxlen=latency_window)
+        self.total_requests = 0
+        self.total_errors = 0
+        self.lock = threading.Lock()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.worker.start()
+
+    def submit(self, prompt, timeout=None):
+        """Enqueues a prompt and blocks until its response is ready."""
+        request = PendingRequest(prompt)
+        self.queue.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError("Timed out waiting for the model response.")
+        if request.error is not None:
+            raise request.error
+        return request.response
+
+    def collect_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect_batch()
+            try:
+                responses = self.generate_fn([request.prompt for request in batch])
+                error = None
+            except Exception as e:
+                responses = [None] * len(batch)
+                error = e
+
+            finished_at = time.perf_counter()
+            with self.lock:
+                self.batch_sizes.append(len(batch))
+                for request, response in zip(batch, responses):
+                    request.response = response
+                    request.error = error
+                    self.latencies.append(finished_at - request.enqueued_at)
+                    self.total_requests += 1
+                    if error is not None:
+                        self.total_errors += 1
+            for request in batch:
+                request.done.set()
+
+    def metrics(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            batch_sizes = list(self.batch_sizes)
+            total_requests = self.total_requests
+            total_errors = self.total_errors
+
+        def percentile(p):
+            if not latencies:
+                return None
+            idx = min(len(latencies) - 1, int(round(p / 100.0 * (len(latencies) - 1))))
+            return latencies[idx] * 1000.0
+
+        return {
+            "queue_depth": self.queue.qsize(),
+            "total_requests": total_requests,
+            "total_errors": total_errors,
+            "latency_p50_ms": percentile(50),
+            "latency_p99_ms": percentile(99),
+            "mean_batch_size": sum(batch_sizes) / len(batch_sizes) if batch_sizes else None,
+        }
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict  {"query": "..."} or {"prompt": "<full templated prompt>"}
+    GET  /metrics  latency percentiles, queue depth and batch statistics
+    GET  /health
+    """
+
+    predictor = None
+    batcher = None
+    request_timeout = None
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            metrics = self.batcher.metrics()
+            if self.predictor.command_cache is not None:
+                metrics["command_cache"] = self.predictor.command_cache.metrics()
+            self.send_json(200, metrics)
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(payload, dict):
+                raise ValueError("the body must be a JSON object")
+            query = payload.get("query")
+            if "prompt" in payload:
+                prompt = payload["prompt"]
+                if not isinstance(prompt, str) or not prompt:
+                    raise ValueError("'prompt' must be a non-empty string")
+            else:
+                if not isinstance(query, str) or not query:
+                    raise ValueError("'query' must be a non-empty string")
+                prompt = self.predictor.build_prompt(query)
+        except ValueError as e:
+            self.send_json(400, {"error": f"Invalid request: {e}"})
+            return
+
+        start_time = time.perf_counter()
+        command_cache = self.predictor.command_cache if "prompt" not in payload else None
+        response = command_cache.get(query) if command_cache is not None else None
+        cached = response is not None
+        if not cached:
+            try:
+                response = self.batcher.submit(prompt, timeout=self.request_timeout)
+            except Exception as e:
+                self.send_json(500, {"error": str(e)})
+                return
+            if command_cache is not None:
+                command_cache.put(query, response)
+        self.send_json(200, {
+            "response": response,
+            "cached": cached,
+            "latency_ms": (time.perf_counter() - start_time) * 1000.0,
+        })
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+
+class InferenceHTTPServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops connections when many sessions connect at once
+    request_queue_size = 128
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Serve the function calling model over HTTP with micro-batching.")
+    add_model_args(argparser)
+    argparser.add_argument("--host", type=str, default="127.0.0.1")
+    argparser.add_argument("--port", type=int, default=8000)
+    argparser.add_argument("--unix_socket", type=str, default=None, help="Serve on this Unix socket path instead of TCP.")
+    argparser.add_argument("--max_wait_ms", type=float, default=10.0,
+                           help="How long to wait for more requests before running a micro-batch.")
+    argparser.add_argument("--request_timeout", type=float, default=None, help="Per-request timeout in seconds.")
+    args = argparser.parse_args()
+
+    predictor = FunctionCallPredictor(args)
+    predictor.setup()
+
+    batcher = MicroBatcher(
+        lambda prompts: predictor.generate_batch(prompts, batch_size=len(prompts)),
+        max_batch_size=args.batch_size,
+        max_wait_ms=args.max_wait_ms,
+    )
+    batcher.start()
+
+    InferenceRequestHandler.predictor = predictor
+    InferenceRequestHandler.batcher = batcher
+    InferenceRequestHandler.request_timeout = args.request_timeout
+
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        server = ThreadingUnixHTTPServer(args.unix_socket, InferenceRequestHandler)
+        print(f"Serving on unix socket {args.unix_socket}")
+    else:
+        server = InferenceHTTPServer((args.host, args.port), InferenceRequestHandler)
+        print(f"Serving on http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if predictor.command_cache is not None:
+            predictor.command_cache.save()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import numpy as np
+import torch
+
+
+class LengthBucketBatchSampler(torch.utils.data.Sampler):
+    """
+    Batch sampler that groups samples of similar token length and sizes every batch by a
+    token budget instead of a fixed number of samples.
+
+    Samples are sorted by length (ties broken randomly) and cut greedily into batches whose
+    padded size, batch_size * longest_sample, stays within max_tokens. The batches are built
+    once, so len() is stable for the Trainer's step count, and their order is reshuffled
+    every epoch.
+    """
+
+    def __init__(self, lengths, max_tokens, max_batch_size=None, shuffle=True, seed=42):
+        """
+        :param lengths: Token length of every sample in the dataset.
+        :param max_tokens: Maximum number of (padded) tokens per batch.
+        :param max_batch_size: Optional cap on the number of samples per batch.
+        :param shuffle: Whether to shuffle the batch order every epoch.
+        :param seed: Seed for tie-breaking and shuffling.
+        """
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.batches = self.build_batches(np.asarray(lengths))
+
+    def build_batches(self, lengths):
+        rng = np.random.RandomState(self.seed)
+        order = np.lexsort((rng.random_sample(len(lengths)), lengths))
+
+        batches = []
+        batch, batch_max = [], 0
+        for idx in order.tolist():
+            new_max = max(batch_max, int(lengths[idx]))
+            too_many_tokens = new_max * (len(batch) + 1) > self.max_tokens
+            too_many_samples = self.max_batch_size is not None and len(batch) >= self.max_batch_size
+            if batch and (too_many_tokens or too_many_samples):
+                batches.append(batch)
+                batch, new_max = [], int(lengths[idx])
+            batch.append(idx)
+            batch_max = new_max
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        order = np.arange(len(self.batches))
+        if self.shuffle:
+            np.random.RandomState(self.seed + self.epoch).shuffle(order)
+        self.epoch += 1
+        for i in order.tolist():
+            yield self.batches[i]
@@ -0,0 +1,107 @@
+import bisect
+import torch
+
+
+def dataset_lengths(dataset):
+    """Token length of every sample of a tokenized dataset."""
+    if hasattr(dataset, "lengths"):
+        return list(dataset.lengths)
+    return [len(ids) for ids in dataset["input_ids"]]
+
+
+def pack_samples(lengths, max_length):
+    """
+    Groups sample indices into rows of at most max_length tokens (best-fit decreasing).
+
+    :param lengths: Token length of every sample.
+    :param max_length: Maximum number of tokens per packed row.
+    :return: List of rows, each a list of sample indices.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    rows = []
+    # Sorted (remaining capacity, row index) pairs of the rows that still have room
+    free = []
+    for i in order:
+        length = min(lengths[i], max_length)
+        pos = bisect.bisect_left(free, (length, -1))
+        if pos < len(free):
+            remaining, row = free.pop(pos)
+        else:
+            remaining, row = max_length, len(rows)
+            rows.append([])
+        rows[row].append(i)
+        remaining -= length
+        if remaining > 0:
+            bisect.insort(free, (remaining, row))
+    return rows
+
+
+class PackedDataset(torch.utils.data.Dataset):
+    """
+    Concatenates several tokenized samples into one row. Position ids restart at 0 for every
+    sample and sample_lengths records the boundaries, so collate_packed can build an
+    attention mask that keeps samples from attending to each other.
+    """
+
+    def __init__(self, dataset, max_length):
+        self.dataset = dataset
+        self.max_length = max_length
+        self.sample_lengths = dataset_lengths(dataset)
+        self.rows = pack_samples(self.sample_lengths, max_length)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def lengths(self):
+        return [sum(self.sample_lengths[i] for i in row) for row in self.rows]
+
+    def __getitem__(self, i):
+        packed = {"input_ids": [], "labels": [], "position_ids": [], "sample_lengths": []}
+        for idx in self.rows[i]:
+            sample = self.dataset[idx]
+            length = len(sample["input_ids"])
+            packed["input_ids"] += list(sample["input_ids"])
+            packed["labels"] += list(sample["labels"])
+            packed["position_ids"] += list(range(length))
+            packed["sample_lengths"].append(length)
+        return packed
+
+
+def collate_packed(elements, pad_token_id, ignore_index):
+    """
+    Pads packed rows to the longest row in the batch and builds a 4D block-diagonal causal
+    attention mask (0 = attend, dtype min = masked), the inverted form transformers accepts
+    as a custom attention mask.
+    """
+    seq_len = max(len(e["input_ids"]) for e in elements)
+    input_ids = torch.full((len(elements), seq_len), pad_token_id, dtype=torch.long)
+    labels = torch.full((len(elements), seq_len), ignore_index, dtype=torch.long)
+    position_ids = torch.zeros((len(elements), seq_len), dtype=torch.long)
+    # Segment id of every token; padding gets -1
+    segments = torch.full((len(elements), seq_len), -1, dtype=torch.long)
+
+    for b, e in enumerate(elements):
+        length = len(e["input_ids"])
+        input_ids[b, :length] = torch.tensor(e["input_ids"])
+        labels[b, :length] = torch.tensor(e["labels"])
+        position_ids[b, :length] = torch.tensor(e["position_ids"])
+        segments[b, :length] = torch.repeat_interleave(
+            torch.arange(len(e["sample_lengths"])), torch.tensor(e["sample_lengths"])
+        )
+
+    causal = torch.tril(torch.ones((seq_len, seq_len), dtype=torch.bool))
+    same_sample = segments[:, :, None] == segments[:, None, :]
+    allowed = same_sample & causal & (segments[:, None, :] != -1)
+    # Padding rows attend to themselves only, so their softmax stays finite
+    allowed |= torch.eye(seq_len, dtype=torch.bool)
+
+    attention_mask = torch.zeros(allowed.shape, dtype=torch.float32)
+    attention_mask.masked_fill_(~allowed, torch.finfo(torch.float32).min)
+
+    return {
+        "input_ids": input_ids,
+        "labels": labels,
+        "position_ids": position_ids,
+        "attention_mask": attention_mask[:, None, :, :],
+    }
@@ -0,0 +1,150 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import torch
+
+# Bump when the on-disk layout or the tokenization logic changes
+CACHE_FORMAT_VERSION = 1
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tokenizer_hash(tokenizer):
+    """Hashes the full tokenizer definition (vocab, merges, added/special tokens)."""
+    digest = hashlib.sha256()
+    digest.update(type(tokenizer).__name__.encode("utf-8"))
+    if getattr(tokenizer, "is_fast", False):
+        digest.update(tokenizer.backend_tokenizer.to_str().encode("utf-8"))
+    else:
+        digest.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode("utf-8"))
+    digest.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class TokenizedStore:
+    """
+    Memory-mapped tokenized samples: flat int32 input_ids / labels buffers plus an int64
+    offsets index, so sample i spans [offsets[i], offsets[i + 1]).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        num_tokens = int(self.offsets[-1])
+        self.input_ids = self.open_buffer("input_ids.int32.bin", num_tokens)
+        self.labels = self.open_buffer("labels.int32.bin", num_tokens)
+
+    def open_buffer(self, name, num_tokens):
+        if num_tokens == 0:
+            return np.zeros(0, dtype=np.int32)
+        return np.memmap(os.path.join(self.path, name), dtype=np.int32, mode="r", shape=(num_tokens,))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def get(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return {
+            "input_ids": self.input_ids[start:end].tolist(),
+            "attention_mask": [1] * (end - start),
+            "labels": self.labels[start:end].tolist(),
+        }
+
+    @staticmethod
+    def write(path, samples):
+        """Writes an iterable of tokenized samples (dicts with input_ids / labels) to path."""
+        offsets = [0]
+        with open(os.path.join(path, "input_ids.int32.bin"), "wb") as f_ids, \
+                open(os.path.join(path, "labels.int32.bin"), "wb") as f_labels:
+            for sample in samples:
+                np.asarray(sample["input_ids"], dtype=np.int32).tofile(f_ids)
+                np.asarray(sample["labels"], dtype=np.int32).tofile(f_labels)
+                offsets.append(offsets[-1] + len(sample["input_ids"]))
+        np.save(os.path.join(path, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+
+
+class TokenizedDataCache:
+    """
+    On-disk cache of tokenized training files, keyed by the tokenizer hash, the data file
+    hash and the tokenization settings. A hit skips loading and tokenizing the data entirely.
+    """
+
+    def __init__(self, cache_dir, tokenizer, tokenize_fn, settings):
+        """
+        :param cache_dir: Directory holding one sub-directory per cached data file.
+        :param tokenizer: Tokenizer used by tokenize_fn.
+        :param tokenize_fn: Callable tokenizing a list of messages into a list of samples.
+        :param settings: Dict of tokenization settings that change the output (e.g. max_length).
+        """
+        self.cache_dir = cache_dir
+        self.tokenize_fn = tokenize_fn
+        self.tokenizer_key = tokenizer_hash(tokenizer)
+        self.settings = dict(settings, format_version=CACHE_FORMAT_VERSION)
+
+    def cache_key(self, data_path):
+        digest = hashlib.sha256()
+        digest.update(self.tokenizer_key.encode("utf-8"))
+        digest.update(file_hash(data_path).encode("utf-8"))
+        digest.update(json.dumps(self.settings, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def load(self, data_path, load_messages):
+        """
+        Returns the TokenizedStore for data_path, tokenizing and caching it on a miss.
+
+        :param load_messages: Callable returning the list of messages stored in data_path.
+        """
+        key = self.cache_key(data_path)
+        path = os.path.join(self.cache_dir, key)
+        if os.path.exists(os.path.join(path, "offsets.npy")):
+            print(f"Token cache hit for {data_path}")
+            return TokenizedStore(path)
+
+        print(f"Token cache miss for {data_path}, tokenizing...")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            TokenizedStore.write(tmp_path, self.tokenize_fn(load_messages(data_path)))
+            with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+                json.dump({"data_path": os.path.abspath(data_path), **self.settings}, f, indent=4)
+            # Publish atomically so an interrupted run never leaves a half-written entry
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                # Another run published the same entry first
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        return TokenizedStore(path)
+
+
+class TokenizedDataset(torch.utils.data.Dataset):
+    """Torch dataset over (store, index) references into one or more TokenizedStores."""
+
+    def __init__(self, refs):
+        self.refs = refs
+
+    def __len__(self):
+        return len(self.refs)
+
+    def __getitem__(self, i):
+        store, idx = self.refs[i]
+        return store.get(idx)
+
+    @property
+    def lengths(self):
+        return [int(store.offsets[idx + 1] - store.offsets[idx]) for store, idx in self.refs]
@@ -0,0 +1,153 @@
+from config import ErrorType, functions
+
+# Prefix of the function names of negative (incomplete command) samples
+INCORRECT_PREFIX = "POSSIBLY_INCORRECT_"
+
+# Same defaults as FunctionCallGenerator.get_param_choices
+DEFAULT_LOWER_BOUND = 1
+DEFAULT_UPPER_BOUND = 100
+
+
+class ParameterSpec:
+    """Compiled schema of one function parameter."""
+
+    __slots__ = ("name", "details", "type", "is_array", "item_type", "enum", "lower_bound", "upper_bound")
+
+    def __init__(self, name, details):
+        self.name = name
+        self.details = details
+        self.type = details.get("type", "string")
+        self.is_array = "array" in self.type
+        items = details.get("items", {})
+        self.item_type = items.get("type", "string") if self.type == "array" else self.type.split("[")[-1].rstrip("]")
+        enum = details.get("enum", items.get("enum"))
+        self.enum = frozenset(enum) if enum is not None else None
+        bounds = items if self.type == "array" else details
+        if self.item_type in ["integer", "number"]:
+            self.lower_bound = bounds.get("lower_bound", DEFAULT_LOWER_BOUND)
+            self.upper_bound = bounds.get("upper_bound", DEFAULT_UPPER_BOUND)
+        else:
+            self.lower_bound = self.upper_bound = None
+
+    def in_enum(self, value):
+        """True when the parameter has no enum or the value is one of its values."""
+        if self.enum is None:
+            return True
+        try:
+            return value in self.enum
+        except TypeError:
+            # Unhashable values (lists, dicts) are never enum values
+            return False
+
+    def is_valid_value(self, value):
+        """Checks a scalar value (or one array element) against the enum, type and bounds."""
+        if self.enum is not None:
+            return self.in_enum(value)
+        if self.item_type == "boolean":
+            return isinstance(value, bool)
+        if self.item_type in ["integer", "number"]:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return False
+            return self.lower_bound <= value <= self.upper_bound
+        return isinstance(value, str)
+
+    def validate(self, value):
+        """
+        :return: ErrorType of an invalid value, None for a valid one.
+        """
+        if self.is_array:
+            if not isinstance(value, list):
+                return ErrorType.INCORRECT_PARAMETER_TYPE_ARRAY
+            if not all(self.is_valid_value(v) for v in value):
+                return ErrorType.HALLUCINATED_ARRAY_ELEMENT
+            return None
+        if not self.is_valid_value(value):
+            return ErrorType.HALLUCINATED_PARAMETER_VALUE if self.enum is not None else ErrorType.INCORRECT_PARAMETER_VALUE
+        return None
+
+
+class FunctionSpec:
+    """Compiled schema of one function: its parameters and required / optional parameter sets."""
+
+    __slots__ = ("name", "schema", "parameters", "required", "optional")
+
+    def __init__(self, schema):
+        self.name = schema["name"]
+        self.schema = schema
+        properties = schema["parameters"]["properties"]
+        self.parameters = {name: ParameterSpec(name, details) for name, details in properties.items()}
+        self.required = frozenset(schema["parameters"].get("required", []))
+        self.optional = frozenset(schema["parameters"].get("optional", []))
+
+    def validate(self, properties, check_required=True):
+        """
+        Validates the arguments of a call of this function.
+
+        :param properties: Dictionary of the call arguments.
+        :param check_required: Report missing required parameters (negative samples omit them).
+        :return: List of (ErrorType, parameter name) pairs, empty for a valid call.
+        """
+        errors = []
+        for key, value in properties.items():
+            parameter = self.parameters.get(key)
+            if parameter is None:
+                errors.append((ErrorType.HALLUCINATED_PARAMETER, key))
+                continue
+            error = parameter.validate(value)
+            if error is not None:
+                errors.append((error, key))
+        if check_required:
+            errors.extend((ErrorType.MISSING_PARAMETER, key) for key in self.required if key not in properties)
+        return errors
+
+
+class SchemaRegistry:
+    """
+    Function schemas of config.functions compiled once into name-indexed lookups, so per-sample
+    schema access and validation cost stays constant however many functions there are.
+    Names with the POSSIBLY_INCORRECT_ prefix of negative samples resolve to their function.
+    """
+
+    def __init__(self, functions=functions):
+        self.functions = {schema["name"]: FunctionSpec(schema) for schema in functions}
+        self.names = frozenset(self.functions)
+
+    def base_name(self, fn_name):
+        return fn_name[len(INCORRECT_PREFIX):] if fn_name.startswith(INCORRECT_PREFIX) else fn_name
+
+    def get(self, fn_name):
+        """:return: FunctionSpec of the function, None for an unknown function."""
+        return self.functions.get(self.base_name(fn_name))
+
+    def __getitem__(self, fn_name):
+        spec = self.get(fn_name)
+        if spec is None:
+            raise KeyError(fn_name)
+        return spec
+
+    def __contains__(self, fn_name):
+        return self.base_name(fn_name) in self.names
+
+    def __iter__(self):
+        return iter(self.functions.values())
+
+    def __len__(self):
+        return len(self.functions)
+
+    def schema(self, fn_name):
+        """Raw config.functions entry of a function."""
+        return self[fn_name].schema
+
+    def validate(self, fn_name, properties, check_required=True):
+        """
+        Validates a call against the registry.
+
+        :return: List of (ErrorType, parameter name) pairs, empty for a valid call.
+        """
+        spec = self.get(fn_name)
+        if spec is None:
+            return [(ErrorType.HALLUCINATED_FUNCTION, None)]
+        return spec.validate(properties, check_required and not fn_name.startswith(INCORRECT_PREFIX))
+
+
+registry = SchemaRegistry()
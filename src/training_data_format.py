@@ -0,0 +1,89 @@
+import json
+import numpy as np
+import pyarrow as pa
+
+from utils import parse_function_call
+from schema_registry import INCORRECT_PREFIX
+
+# Training data files are Arrow IPC streams: one row per sample, memory-mapped on read, and the
+# layout datasets.Dataset.from_file maps without copying
+ARROW_EXTENSION = ".arrow"
+
+MESSAGE_COLUMNS = ["system", "user", "assistant"]
+# function_name is the called function; is_negative is derived from it on every path (Arrow
+# writers and legacy .npy / .json conversion alike): True when the call is to a
+# POSSIBLY_INCORRECT_ function, i.e. the command lacks the information the function needs.
+# Incomplete commands answered with a partial call of the real function are not negative.
+SCHEMA = pa.schema([
+    ("system", pa.string()),
+    ("user", pa.string()),
+    ("assistant", pa.string()),
+    ("function_name", pa.string()),
+    ("is_negative", pa.bool_()),
+])
+
+
+def is_arrow_file(path):
+    return path.endswith(ARROW_EXTENSION)
+
+
+def messages_to_columns(messages):
+    """Column lists of the training data schema from {'system', 'user', 'assistant'} messages."""
+    columns = {name: [message[name] for message in messages] for name in MESSAGE_COLUMNS}
+    columns["function_name"] = [parse_function_call(assistant).get("fn_name") for assistant in columns["assistant"]]
+    columns["is_negative"] = [bool(name and name.startswith(INCORRECT_PREFIX)) for name in columns["function_name"]]
+    return columns
+
+
+class MessageWriter:
+    """Appends messages to an Arrow IPC stream file, one record batch per write."""
+
+    def __init__(self, path):
+        self.sink = pa.OSFile(path, "wb")
+        self.writer = pa.ipc.new_stream(self.sink, SCHEMA)
+        self.num_rows = 0
+
+    def write(self, messages):
+        if not messages:
+            return
+        columns = messages_to_columns(messages)
+        self.writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=SCHEMA))
+        self.num_rows += len(messages)
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+def write_messages(path, messages, batch_size=10000):
+    """Writes messages to an Arrow IPC stream file in record batches of batch_size rows."""
+    writer = MessageWriter(path)
+    try:
+        for start in range(0, len(messages), batch_size):
+            writer.write(messages[start:start + batch_size])
+    finally:
+        writer.close()
+
+
+def read_table(path):
+    """
+    Reads a training data file as a pyarrow Table. Arrow files are memory-mapped, so the
+    columns reference the file pages instead of being copied; legacy pickled .npy and .json
+    message lists are converted.
+    """
+    if is_arrow_file(path):
+        return pa.ipc.open_stream(pa.memory_map(path, "r")).read_all()
+    if path.endswith(".npy"):
+        messages = list(np.load(path, allow_pickle=True))
+    else:
+        with open(path, "r") as f:
+            messages = json.load(f)
+    return pa.Table.from_pydict(messages_to_columns(messages), schema=SCHEMA)
+
+
+def read_messages(path):
+    """Reads a training data file (Arrow, .npy or .json) as a list of message dicts."""
+    if not is_arrow_file(path) and path.endswith(".json"):
+        with open(path, "r") as f:
+            return json.load(f)
+    return read_table(path).to_pylist()
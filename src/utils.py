@@ -1,52 +1,250 @@
+import re
+import ast
+import copy
 import json
+from enum import Enum
 
-def convert_command(command):
+# Filler phrases that do not change which function call a command maps to; the same ones
+# generate_training_data.refine_command_expression strips (randomly) from training commands
+FILLER_PHRASES = ["can you", "could you", "please", "car"]
+
+
+def canonicalize_command(command):
+    """
+    Deterministically normalizes a user command so trivially different phrasings of the same
+    request ("Please lock the doors!" / "lock the doors") share one key.
+    """
+    text = command.lower()
+    text = re.sub(r"[^\w\s'.-]", " ", text)
+    # Keep decimal points ("35.5") but drop sentence punctuation
+    text = re.sub(r"\.(?!\d)", " ", text)
+    for phrase in FILLER_PHRASES:
+        text = re.sub(r"\b" + phrase + r"\b", " ", text)
+    return " ".join(text.split())
+
+
+FUNCTION_CALL_START = '<functioncall> '
+FUNCTION_CALL_END = '<|im_end|>'
+
+_json_decoder = json.JSONDecoder()
+
+
+class ParseErrorCode(Enum):
+    DELIMITERS_NOT_FOUND = "DelimitersNotFound"
+    INVALID_CALL_JSON = "InvalidCallJson"
+    MISSING_NAME = "MissingName"
+    INVALID_ARGUMENTS = "InvalidArguments"
+    ARGUMENTS_NOT_DICT = "ArgumentsNotDict"
+    TRUNCATED = "Truncated"
+
+
+def parse_error(code, message):
+    return {"error": message, "error_code": code.value}
+
+
+# Tokens of a Python dict literal that differ from JSON: double-quoted strings (kept as they
+# are), single-quoted strings and the True / False / None constants
+PYTHON_LITERAL_TOKENS = re.compile(r"""("(?:[^"\\]|\\.)*")|'((?:[^'\\]|\\.)*)'|\b(True|False|None)\b""")
+JSON_CONSTANTS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _python_token_to_json(match):
+    double_quoted, single_quoted, constant = match.groups()
+    if double_quoted is not None:
+        return double_quoted
+    if constant is not None:
+        return JSON_CONSTANTS[constant]
+    if '\\' in single_quoted or '"' in single_quoted:
+        return json.dumps(ast.literal_eval("'" + single_quoted + "'"))
+    return '"' + single_quoted + '"'
+
+
+def parse_arguments(arguments):
+    """
+    Parses the arguments string of a function call. The model emits Python dict literals
+    ("{'lock': True}"), which are translated to JSON token by token in one regex pass, so
+    apostrophes and "True" inside string values stay intact, and decoded with json.loads.
+    JSON objects ('{"lock": true}') pass through unchanged; anything else the translation
+    cannot handle goes through ast.literal_eval.
+
+    Arguments without Python constants skip the regex pass: without single quotes they are
+    JSON already, and without double quotes or backslashes every single quote delimits a
+    string, so swapping the quote characters is an exact translation.
+    """
+    if isinstance(arguments, dict):
+        return arguments
+    if not isinstance(arguments, str):
+        raise ValueError(f"arguments must be a string, got {type(arguments).__name__}")
+    if not arguments.strip():
+        return {}
+    if "True" not in arguments and "False" not in arguments and "None" not in arguments:
+        if "'" not in arguments:
+            fast = arguments
+        elif '"' not in arguments and "\\" not in arguments:
+            fast = arguments.replace("'", '"')
+        else:
+            fast = None
+        if fast is not None:
+            try:
+                return json.loads(fast)
+            except ValueError:
+                pass
+    try:
+        return json.loads(PYTHON_LITERAL_TOKENS.sub(_python_token_to_json, arguments))
+    except ValueError:
+        return ast.literal_eval(arguments.strip())
+
+
+def parse_function_call(command):
+    """
+    Parses a model response of the form
+    <functioncall> {"name": "<fn>", "arguments": "{'<key>': <value>, ...}"} <|im_end|>
+
+    The call JSON is decoded once from the start delimiter and the arguments once as a Python /
+    JSON literal, without rewriting the string in between. A response without the end delimiter
+    (e.g. cut off at max_new_tokens) is reported as TRUNCATED, even when the call JSON is complete.
+
+    :return: {'fn_name', 'properties'} or, on failure, {'error': message, 'error_code': ParseErrorCode value}.
+    """
+    start_idx = command.find(FUNCTION_CALL_START)
+    if start_idx == -1:
+        return parse_error(ParseErrorCode.DELIMITERS_NOT_FOUND, "Delimiters not found")
+    call_start = start_idx + len(FUNCTION_CALL_START)
+    if command.find(FUNCTION_CALL_END, call_start) == -1:
+        return parse_error(ParseErrorCode.TRUNCATED, "End delimiter not found, the response is truncated")
     try:
-        # Manually extract the JSON portion between known delimiters
-        start_delim = '<functioncall> '
-        end_delim = '<|im_end|>'
-        start_idx = command.find(start_delim) + len(start_delim)
-        end_idx = command.find(end_delim)
-
-        # import pdb; pdb.set_trace()
-        
-        if start_idx == -1 or end_idx == -1:
-            return {
-                "error": "Delimiters not found"
-            }
-
-        # Extract the JSON string
-        json_str = command[start_idx:end_idx]
-
-        # Load the JSON string into a dictionary
-        function_call_dict = json.loads(json_str)
-
-        # Extract function name and arguments
-        fn_name = function_call_dict.get('name')
-        arguments = function_call_dict.get('arguments', '{}')
-
-        # import pdb; pdb.set_trace()
-        
-        # Load arguments JSON, taking care of the replacing if necessary
-        arguments = arguments.replace("'", '"')
-        # replace True with 'true' and False with 'false' if they are present in the arguments
-        arguments = arguments.replace('True', 'true')
-        arguments = arguments.replace('False', 'false')
-        
-        properties = json.loads(arguments)
-
-        # Construct the final dictionary
-        result = {
-            'fn_name': fn_name,
-            'properties': properties
-        }
-
-        return result
+        function_call_dict, end = _json_decoder.raw_decode(command, call_start)
+    except json.JSONDecodeError as e:
+        return parse_error(ParseErrorCode.INVALID_CALL_JSON, str(e))
+    # Only whitespace may separate the call JSON from the end delimiter
+    if not command[end:].lstrip().startswith(FUNCTION_CALL_END):
+        return parse_error(ParseErrorCode.INVALID_CALL_JSON, f"Extra data after the function call at char {end}")
+    if not isinstance(function_call_dict, dict) or not function_call_dict.get('name'):
+        return parse_error(ParseErrorCode.MISSING_NAME, "Function name not found")
 
+    try:
+        properties = parse_arguments(function_call_dict.get('arguments', '{}'))
     except Exception as e:
-        return {
-            "error": str(e)
-        }
+        return parse_error(ParseErrorCode.INVALID_ARGUMENTS, str(e))
+    if not isinstance(properties, dict):
+        return parse_error(ParseErrorCode.ARGUMENTS_NOT_DICT, f"Arguments must be a dict, got {type(properties).__name__}")
+
+    return {
+        'fn_name': function_call_dict['name'],
+        'properties': properties
+    }
+
+
+def copy_parse_result(result):
+    """Copies a parse result deeply enough that callers may sort or edit the argument lists."""
+    if 'properties' not in result:
+        return dict(result)
+    properties = {
+        key: list(value) if isinstance(value, list) else copy.deepcopy(value) if isinstance(value, dict) else value
+        for key, value in result['properties'].items()
+    }
+    return {'fn_name': result['fn_name'], 'properties': properties}
+
+
+def parse_function_calls(commands):
+    """
+    Parses a batch of model responses. Identical responses (common for ground truths and
+    greedy predictions) are parsed once and get independent copies of the result.
+    """
+    parsed = {}
+    results = []
+    for command in commands:
+        if command not in parsed:
+            parsed[command] = parse_function_call(command)
+        results.append(copy_parse_result(parsed[command]))
+    return results
+
+
+# Characters that may continue a number cut by the end of a buffer ("12" of "123", "1." of "1.5")
+NUMBER_CONTINUATION = re.compile(r"[0-9.eE+-]*\Z")
+
+
+class JsonStreamReader:
+    """
+    Reads a JSON document token by token from a file, decoding one value at a time with
+    JSONDecoder.raw_decode over a buffer that is refilled chunk_size characters at a time,
+    so the file never has to fit in memory. A document that ends early raises JSONDecodeError.
+    """
+
+    def __init__(self, f, chunk_size=1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        chunk = self.f.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return not self.eof
+
+    def peek(self):
+        """Next non-whitespace character, '' at the end of the file."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def truncated(self):
+        return json.JSONDecodeError("Unexpected end of file, the JSON document is truncated", self.buffer, self.pos)
+
+    def skip(self, char):
+        """Consumes char if it is the next character."""
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, char):
+        if not self.skip(char):
+            if self.peek() == "":
+                raise self.truncated()
+            raise ValueError(f"Expected {char!r} at {self.buffer[self.pos:self.pos + 40]!r}")
+
+    def read_value(self):
+        if self.peek() == "":
+            raise self.truncated()
+        while True:
+            try:
+                value, end = _json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The value is cut by the end of the buffer, read more
+                if not self.fill():
+                    raise
+                continue
+            # A number cut by the end of the buffer decodes as its prefix, read more
+            if (not self.eof and isinstance(value, (int, float)) and not isinstance(value, bool)
+                    and NUMBER_CONTINUATION.match(self.buffer, end)):
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_array(f, chunk_size=1 << 20):
+    """Incrementally decodes the elements of a top-level JSON array (see JsonStreamReader)."""
+    reader = JsonStreamReader(f, chunk_size)
+    reader.expect("[")
+    while not reader.skip("]"):
+        yield reader.read_value()
+        if not reader.skip(","):
+            reader.expect("]")
+            return
+
+
+def convert_command(command):
+    """Parses a model response into {'fn_name', 'properties'}, or {'error': ...} (see parse_function_call)."""
+    return parse_function_call(command)
     
 if __name__ == '__main__':
     # Example command input, directly copying your provided debug output